@@ -0,0 +1,364 @@
+"""
+Non-blocking Vertex AI calls for Arkitecto AI Backend
+Every SDK call (Gemini, Imagen, model loading) runs on a dedicated, bounded
+thread pool and is awaited with a timeout, so a multi-second model call
+never stalls the event loop (and /search, /suggestions, ... keep answering).
+
+The SDK's *_async variants are not used: they resolve Google credentials
+synchronously on the event loop, which blocks it for seconds when the
+metadata server is slow or unavailable.
+
+Model clients are built once per process and reused (model registry): each
+GenerativeModel owns its own gRPC channel, so a fresh instance per request
+paid client construction, credential lookup and TLS handshake every time.
+warm_up() builds them (and opens the channels) at startup. Clients come
+from a pluggable backend: VertexBackend by default, or a local stand-in
+(fake_vertex.FakeBackend) installed with set_backend() for offline load
+tests.
+
+Each model has a circuit breaker (circuit_breaker.py): calls to a model
+that keeps failing raise CircuitOpenError right away instead of waiting
+for another failure.
+
+Every call is metered (usage_meter.py): tokens, images, latency and
+outcome, attributed to the endpoint / uid of the calling request.
+"""
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from vertexai.generative_models import GenerationConfig, GenerativeModel
+from vertexai.preview.vision_models import ImageGenerationModel
+
+import usage_meter
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+AI_THREAD_POOL_SIZE = int(os.getenv("AI_THREAD_POOL_SIZE", "16"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_TIMEOUT_SECONDS", "90"))
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("AI_WARMUP_TIMEOUT_SECONDS", "20"))
+
+# Circuit breaker per model
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=AI_THREAD_POOL_SIZE, thread_name_prefix="vertex-ai")
+
+
+class VertexBackend:
+    """
+    Builds the SDK model clients. A backend only needs these two blocking
+    factories; the clients must offer generate_content (with stream=True),
+    count_tokens and generate_images like the Vertex AI SDK ones.
+    """
+    name = "vertex"
+
+    def generative_model(self, model_name: str):
+        return GenerativeModel(model_name)
+
+    def image_model(self, model_name: str):
+        return ImageGenerationModel.from_pretrained(model_name)
+
+
+# Process-wide model registry: (kind, model name) -> client
+_backend = VertexBackend()
+_models = {}
+_models_lock = threading.Lock()
+_warmup = {}
+_breakers = {}
+
+
+def set_backend(backend):
+    """Replace the model backend (before serving); drops clients, warm-up results and breakers."""
+    global _backend
+    with _models_lock:
+        _backend = backend
+        _models.clear()
+        _warmup.clear()
+        _breakers.clear()
+
+
+def _get_model(kind: str, model_name: str, factory):
+    key = (kind, model_name)
+    model = _models.get(key)
+    if model is None:
+        # Built outside the lock (from_pretrained is a network call); a
+        # concurrent duplicate build is discarded, failures are not cached.
+        built = factory(model_name)
+        with _models_lock:
+            model = _models.setdefault(key, built)
+    return model
+
+
+def get_generative_model(model_name: str):
+    """Shared GenerativeModel for model_name (blocking; call from the AI pool)."""
+    return _get_model("gemini", model_name, _backend.generative_model)
+
+
+def get_image_model(model_name: str):
+    """Shared ImageGenerationModel for model_name (blocking; call from the AI pool)."""
+    return _get_model("imagen", model_name, _backend.image_model)
+
+
+def get_breaker(model_name: str) -> CircuitBreaker:
+    breaker = _breakers.get(model_name)
+    if breaker is None:
+        with _models_lock:
+            breaker = _breakers.setdefault(model_name, CircuitBreaker(
+                model_name,
+                window=BREAKER_WINDOW,
+                min_calls=BREAKER_MIN_CALLS,
+                error_rate=BREAKER_ERROR_RATE,
+                slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                cooldown_seconds=BREAKER_COOLDOWN_SECONDS,
+            ))
+    return breaker
+
+
+def is_available(model_name: str) -> bool:
+    """False while the model's circuit is open (calls would be rejected)."""
+    return get_breaker(model_name).state != "open"
+
+
+def _warm_generative(model_name: str):
+    # count_tokens is free and opens the gRPC channel (DNS, TLS, auth token);
+    # a deprecated model (404) trips its breaker before the first request
+    get_breaker(model_name).call(lambda: get_generative_model(model_name).count_tokens("ping"))
+
+
+def _warm_image(model_name: str):
+    get_breaker(model_name).call(get_image_model, model_name)
+
+
+def json_generation_config(schema: dict = None):
+    """
+    GenerationConfig asking Gemini for JSON constrained to `schema`. The
+    pinned SDK (requirements.txt) supports both response_mime_type and
+    response_schema; an older install gets whatever subset it has, or None
+    (the prompt outline and the tolerant parser still apply).
+    """
+    params = inspect.signature(GenerationConfig.__init__).parameters
+    kwargs = {}
+    if "response_mime_type" in params:
+        kwargs["response_mime_type"] = "application/json"
+    if schema is not None and "response_schema" in params:
+        kwargs["response_schema"] = schema
+    return GenerationConfig(**kwargs) if kwargs else None
+
+
+def _metered(kind: str, model_name: str, context: tuple, fn):
+    """Run fn (blocking, in the worker thread) and record its usage, whatever the caller did meanwhile."""
+    start = time.perf_counter()
+    try:
+        response = fn()
+    except Exception as e:
+        usage_meter.meter.record(context, model_name, kind, f"error:{type(e).__name__}",
+                                 (time.perf_counter() - start) * 1000)
+        raise
+    latency_ms = (time.perf_counter() - start) * 1000
+    if kind == "image":
+        usage_meter.meter.record(context, model_name, kind, "ok", latency_ms,
+                                 images=len(getattr(response, "images", None) or []))
+    else:
+        _record_tokens(context, model_name, kind, latency_ms, getattr(response, "usage_metadata", None))
+    return response
+
+
+def _record_tokens(context: tuple, model_name: str, kind: str, latency_ms: float, usage):
+    usage_meter.meter.record(
+        context, model_name, kind, "ok", latency_ms,
+        prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+        response_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+    )
+
+
+def _before_call(breaker: CircuitBreaker, kind: str, model_name: str) -> tuple:
+    """Check the breaker (rejections are metered too) and capture the request context."""
+    context = usage_meter.current()
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        usage_meter.meter.record(context, model_name, kind, "circuit_open", 0)
+        raise
+    return context
+
+
+async def run_in_ai_pool(fn, *args, timeout: float, **kwargs):
+    """
+    Run a blocking SDK call on the AI thread pool.
+    Raises asyncio.TimeoutError after `timeout` seconds; the worker thread
+    cannot be interrupted and finishes in the background, but the request
+    (and the event loop) move on.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def generate_content(model_name: str, contents, timeout: float = None, **kwargs):
+    """
+    Gemini generate_content, awaitable and bounded by a timeout.
+    Raises CircuitOpenError without calling the model if its circuit is open.
+    """
+    breaker = get_breaker(model_name)
+    context = _before_call(breaker, "text", model_name)
+
+    def call():
+        # The outcome is recorded by the worker thread, even after a timeout
+        return breaker.call(_metered, "text", model_name, context,
+                            lambda: get_generative_model(model_name).generate_content(contents, **kwargs))
+    return await run_in_ai_pool(call, timeout=timeout or GEMINI_TIMEOUT_SECONDS)
+
+
+async def stream_content(model_name: str, contents, timeout: float = None, **kwargs):
+    """
+    Async iterator over the text chunks of a streamed Gemini response.
+    The blocking SDK iterator runs on the AI pool and hands chunks to the
+    event loop through a queue; `timeout` bounds the whole stream. Closing
+    the iterator early stops the worker at the next chunk.
+    """
+    breaker = get_breaker(model_name)
+    context = _before_call(breaker, "stream", model_name)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    stop = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:   # loop already closed
+            pass
+
+    def produce():
+        start = time.perf_counter()
+        usage = None
+        try:
+            for chunk in get_generative_model(model_name).generate_content(contents, stream=True, **kwargs):
+                usage = getattr(chunk, "usage_metadata", None) or usage   # totals come with the last chunk
+                if stop.is_set():
+                    break
+                put(chunk.text)
+        except Exception as e:
+            usage_meter.meter.record(context, model_name, "stream", f"error:{type(e).__name__}",
+                                     (time.perf_counter() - start) * 1000)
+            put(e)
+            raise
+        finally:
+            put(finished)
+        _record_tokens(context, model_name, "stream", (time.perf_counter() - start) * 1000, usage)
+
+    future = loop.run_in_executor(_executor, partial(breaker.call, produce))
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    deadline = loop.time() + (timeout or GEMINI_TIMEOUT_SECONDS)
+    try:
+        while True:
+            item = await asyncio.wait_for(queue.get(), max(0, deadline - loop.time()))
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+async def generate_images(model_name: str, timeout: float = None, **kwargs):
+    """Imagen generate_images (including the from_pretrained lookup), awaitable with a timeout."""
+    breaker = get_breaker(model_name)
+    context = _before_call(breaker, "image", model_name)
+
+    def call():
+        return breaker.call(_metered, "image", model_name, context,
+                            lambda: get_image_model(model_name).generate_images(**kwargs))
+    return await run_in_ai_pool(call, timeout=timeout or IMAGE_TIMEOUT_SECONDS)
+
+
+async def warm_up(gemini_models: list, image_models: list = ()) -> dict:
+    """
+    Build and connect every model client in parallel (startup hook).
+    Failures are reported, not raised: the model is retried lazily on the
+    first request that needs it.
+    """
+    async def warm(kind: str, model_name: str, fn):
+        start = time.perf_counter()
+        try:
+            await run_in_ai_pool(fn, model_name, timeout=WARMUP_TIMEOUT_SECONDS)
+            status = "ready"
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except Exception as e:
+            status = f"error: {type(e).__name__}"
+        _warmup[model_name] = {
+            "kind": kind,
+            "status": status,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    await asyncio.gather(
+        *(warm("gemini", name, _warm_generative) for name in dict.fromkeys(gemini_models)),
+        *(warm("imagen", name, _warm_image) for name in dict.fromkeys(image_models)),
+    )
+    return dict(_warmup)
+
+
+def registry_info() -> dict:
+    """Backend, loaded clients, last warm-up result and circuit breaker state per model (health endpoint)."""
+    with _models_lock:
+        loaded = list(_models)
+        breakers = dict(_breakers)
+    return {
+        "backend": _backend.name,
+        "loaded": sorted(f"{kind}:{name}" for kind, name in loaded),
+        "warmup": dict(_warmup),
+        "breakers": {name: breaker.stats() for name, breaker in sorted(breakers.items())},
+    }
+
+
+async def hedged(attempts: list, hedge_delay: float, deadline: float):
+    """
+    Race (name, coroutine function) attempts in preference order.
+    The first attempt starts immediately; the next one starts when the
+    in-flight ones have been silent for hedge_delay seconds, or right away
+    when one fails. The first attempt to return (not raise) wins and the
+    rest are cancelled. Returns (name, result); raises asyncio.TimeoutError
+    when the deadline passes first, or the last error if all attempts fail.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    queue = list(attempts)
+    pending = {}
+    last_error = None
+
+    def launch():
+        name, fn = queue.pop(0)
+        pending[asyncio.ensure_future(fn())] = name
+
+    try:
+        while queue or pending:
+            if not pending:
+                launch()
+            remaining = end - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            wait = min(remaining, hedge_delay) if queue else remaining
+            done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = pending.pop(task)
+                if task.exception() is None:
+                    return name, task.result()
+                last_error = task.exception()
+            # Silence for hedge_delay (hedge) or a failure (fallback): next attempt
+            if queue:
+                launch()
+        raise last_error or ValueError("No attempts to run")
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,72 @@
+"""
+ARKITECTO AI - Formato binario para snapshots del catalogo APU
+Un archivo = cabecera JSON (metadatos y tabla de arreglos) + arreglos numpy
+alineados. Al leer, el archivo se mapea en memoria (mmap) y los arreglos
+son vistas de solo lectura sobre esas paginas: no se copian, y varios
+workers en la misma maquina comparten las mismas paginas del page cache.
+"""
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIA = b"APUSNAP1"
+ALINEACION = 64
+_CABECERA = struct.Struct("<8sQ")   # magia, largo del JSON
+
+
+def _alinear(posicion: int) -> int:
+    return -(-posicion // ALINEACION) * ALINEACION
+
+
+def es_binario(ruta: str) -> bool:
+    """True si el archivo empieza con la firma de un snapshot binario."""
+    with open(ruta, "rb") as f:
+        return f.read(len(MAGIA)) == MAGIA
+
+
+def escribir(ruta: str, meta: dict, arreglos: dict):
+    """
+    Escribe meta (serializable a JSON) y arreglos {nombre: np.ndarray 1D}.
+    Se escribe a un archivo temporal y se publica con os.replace: nunca se
+    sobrescribe en sitio un archivo que otro proceso tenga mapeado.
+    """
+    tabla = {}
+    posicion = 0
+    for nombre, arreglo in arreglos.items():
+        arreglo = np.ascontiguousarray(arreglo)
+        tabla[nombre] = [arreglo.dtype.str, posicion, len(arreglo)]
+        posicion = _alinear(posicion + arreglo.nbytes)
+
+    cabecera = json.dumps({"meta": meta, "arreglos": tabla}, ensure_ascii=False).encode("utf-8")
+    inicio_datos = _alinear(_CABECERA.size + len(cabecera))
+
+    temporal = f"{ruta}.tmp{os.getpid()}"
+    with open(temporal, "wb") as f:
+        f.write(_CABECERA.pack(MAGIA, len(cabecera)))
+        f.write(cabecera)
+        for nombre, arreglo in arreglos.items():
+            f.seek(inicio_datos + tabla[nombre][1])
+            f.write(np.ascontiguousarray(arreglo).tobytes())
+        f.truncate(inicio_datos + posicion)
+    os.replace(temporal, ruta)
+
+
+def leer(ruta: str) -> tuple:
+    """Retorna (meta, {nombre: vista numpy de solo lectura sobre el mmap})."""
+    with open(ruta, "rb") as f:
+        datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magia, largo = _CABECERA.unpack_from(datos, 0)
+    if magia != MAGIA:
+        raise ValueError(f"{ruta} no es un snapshot binario del catalogo")
+    cabecera = json.loads(datos[_CABECERA.size:_CABECERA.size + largo].decode("utf-8"))
+    inicio_datos = _alinear(_CABECERA.size + largo)
+
+    arreglos = {
+        nombre: np.frombuffer(datos, dtype=np.dtype(tipo), count=cantidad, offset=inicio_datos + posicion)
+        for nombre, (tipo, posicion, cantidad) in cabecera["arreglos"].items()
+    }
+    return cabecera["meta"], arreglos
@@ -3,6 +3,20 @@ ARKITECTO AI - Catalogo APU Profesional v2.0
 Sistema avanzado de presupuestos de construccion
 Precios reales de mercado chileno (CLP) - 2024/2025
 """
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+import apu_binario
+from apu_search import IndiceCatalogo, tokenizar
 
 # APUs organizados por categorias profesionales
 APU_CATALOG = {
@@ -436,153 +450,607 @@ KEYWORD_MAPPING = {
     "andamio": "equipos", "grua": "equipos", "arriendo": "equipos",
 }
 
-def buscar_apus(consulta: str, max_resultados: int = 8) -> list:
+class CatalogoCompacto:
+    """
+    Representacion inmutable "struct of arrays" de un catalogo APU.
+    Cada item es una fila: precio, unidad y categoria viven en arreglos
+    numpy paralelos (unidades y categorias como codigos enteros), y las
+    descripciones y codigos en una sola tabla de texto con offsets.
+    Busqueda y presupuesto trabajan con filas; los dicts se arman solo
+    al construir la respuesta (item()).
+    """
+
+    __slots__ = (
+        "categorias", "nombres_categoria", "unidades", "precios", "id_unidad",
+        "id_categoria", "_inicio_categoria", "_texto", "_offsets", "_fila_por_codigo",
+    )
+
+    def __init__(self, categorias, nombres_categoria, unidades, precios, id_unidad,
+                 id_categoria, inicio_categoria, texto, offsets, fila_por_codigo):
+        self.categorias = tuple(categorias)                 # id -> cat_key
+        self.nombres_categoria = tuple(nombres_categoria)   # id -> nombre visible
+        self.unidades = tuple(unidades)                     # id -> "m2", "un", ...
+        self.precios = precios
+        self.id_unidad = id_unidad
+        self.id_categoria = id_categoria
+        self._inicio_categoria = inicio_categoria           # id -> primera fila (+ total al final)
+        self._texto = texto                                 # desc0 cod0 desc1 cod1 ...
+        self._offsets = offsets                             # array("q"): acceso rapido por fila
+        self._fila_por_codigo = fila_por_codigo
+        for arreglo in (precios, id_unidad, id_categoria, inicio_categoria):
+            arreglo.flags.writeable = False
+
+    @classmethod
+    def desde_dict(cls, catalogo: dict) -> "CatalogoCompacto":
+        """Construye el catalogo compacto desde la forma de APU_CATALOG (codigos repetidos se omiten)."""
+        categorias, nombres, inicios = [], [], []
+        unidades, id_por_unidad = [], {}
+        precios, id_unidad, id_categoria = [], [], []
+        partes, offsets, fila_por_codigo = [], [0], {}
+        largo = 0
+
+        for cat_key, categoria in catalogo.items():
+            id_cat = len(categorias)
+            categorias.append(cat_key)
+            nombres.append(categoria["nombre"])
+            inicios.append(len(precios))
+            for item in categoria["items"]:
+                if item["codigo"] in fila_por_codigo:
+                    continue
+                fila_por_codigo[item["codigo"]] = len(precios)
+                unidad = item["unidad"]
+                if unidad not in id_por_unidad:
+                    id_por_unidad[unidad] = len(unidades)
+                    unidades.append(unidad)
+                precios.append(item["precio"])
+                id_unidad.append(id_por_unidad[unidad])
+                id_categoria.append(id_cat)
+                for texto in (item["desc"], item["codigo"]):
+                    partes.append(texto)
+                    largo += len(texto)
+                    offsets.append(largo)
+        inicios.append(len(precios))
+
+        return cls(
+            categorias, nombres, unidades,
+            np.array(precios, dtype=np.float64),
+            np.array(id_unidad, dtype=np.int16),
+            np.array(id_categoria, dtype=np.int16),
+            np.array(inicios, dtype=np.int64),
+            "".join(partes),
+            array("q", offsets),
+            fila_por_codigo,
+        )
+
+    def a_binario(self) -> tuple:
+        """(meta, arreglos) para apu_binario; ver desde_binario."""
+        meta = {
+            "categorias": self.categorias,
+            "nombres_categoria": self.nombres_categoria,
+            "unidades": self.unidades,
+        }
+        return meta, {
+            "precios": self.precios,
+            "id_unidad": self.id_unidad,
+            "id_categoria": self.id_categoria,
+            "inicio_categoria": self._inicio_categoria,
+            "texto": np.frombuffer(self._texto.encode("utf-8"), dtype=np.uint8),
+            "offsets": np.frombuffer(self._offsets, dtype=np.int64),
+        }
+
+    @classmethod
+    def desde_binario(cls, meta: dict, arreglos: dict) -> "CatalogoCompacto":
+        """Catalogo desde un snapshot binario; los arreglos numericos quedan sobre el mmap."""
+        texto = arreglos["texto"].tobytes().decode("utf-8")
+        offsets = array("q", arreglos["offsets"].tobytes())
+        fila_por_codigo = {
+            texto[offsets[i]:offsets[i + 1]]: i // 2 for i in range(1, len(offsets) - 1, 2)
+        }
+        return cls(
+            meta["categorias"], meta["nombres_categoria"], meta["unidades"],
+            arreglos["precios"], arreglos["id_unidad"], arreglos["id_categoria"],
+            arreglos["inicio_categoria"], texto, offsets, fila_por_codigo,
+        )
+
+    def __len__(self) -> int:
+        return len(self.precios)
+
+    def _cadena(self, indice: int) -> str:
+        offsets = self._offsets
+        return self._texto[offsets[indice]:offsets[indice + 1]]
+
+    def desc(self, fila: int) -> str:
+        return self._cadena(2 * fila)
+
+    def codigo(self, fila: int) -> str:
+        return self._cadena(2 * fila + 1)
+
+    def unidad(self, fila: int) -> str:
+        return self.unidades[self.id_unidad.item(fila)]
+
+    def precio(self, fila: int):
+        """Precio unitario como int si es entero (CLP), si no float."""
+        precio = self.precios.item(fila)
+        return int(precio) if precio.is_integer() else precio
+
+    def nombre_categoria(self, fila: int) -> str:
+        return self.nombres_categoria[self.id_categoria.item(fila)]
+
+    def nombre_de(self, cat_key: str):
+        """Nombre visible de una categoria, o None si no esta en este catalogo."""
+        if cat_key not in self.categorias:
+            return None
+        return self.nombres_categoria[self.categorias.index(cat_key)]
+
+    def fila(self, codigo: str):
+        """Fila del codigo APU, o None si no existe."""
+        return self._fila_por_codigo.get(codigo)
+
+    def rango_categoria(self, cat_key: str) -> range:
+        """Filas (contiguas) de una categoria."""
+        id_cat = self.categorias.index(cat_key)
+        return range(int(self._inicio_categoria[id_cat]), int(self._inicio_categoria[id_cat + 1]))
+
+    def item(self, fila: int, categoria: str = None) -> dict:
+        """Dict del item con su categoria visible, solo para la respuesta."""
+        return {
+            "desc": self.desc(fila),
+            "unidad": self.unidad(fila),
+            "precio": self.precio(fila),
+            "codigo": self.codigo(fila),
+            "categoria": categoria or self.nombre_categoria(fila),
+        }
+
+
+# Ranking de busqueda: "legacy" (orden de catalogo) o "bm25" (relevancia)
+RANKINGS = ("legacy", "bm25")
+RANKING_POR_DEFECTO = os.getenv("APU_RANKING", "legacy")
+
+
+def detectar_keywords(texto: str, snapshot: "SnapshotCatalogo" = None) -> list:
+    """
+    Keywords de KEYWORD_MAPPING presentes en el texto, con su posicion y
+    categoria, en una sola pasada (automata Aho-Corasick compartido).
+    Pasar el mismo snapshot con que luego se buscan y precian las filas.
+    """
+    return (snapshot or _SNAPSHOT).indice.automata.buscar(texto)
+
+
+def categoria_principal(calces: list):
+    """Categoria de la primera keyword segun el orden de KEYWORD_MAPPING, o None."""
+    if not calces:
+        return None
+    return min(calces, key=lambda c: c.orden).categoria
+
+
+def buscar_filas(consulta: str, max_resultados: int = 8, calces: list = None,
+                 ranking: str = None, snapshot: "SnapshotCatalogo" = None) -> list:
     """
     Busqueda inteligente de APUs usando multiples criterios.
     Soporta busqueda por keywords, categorias y texto libre.
-    Retorna lista ordenada por relevancia.
+    Retorna [(fila, categoria_visible)] ordenada por relevancia; la categoria
+    es None salvo que el fallback la reemplace.
+    Si se entregan los calces de detectar_keywords no se recorre el texto de nuevo.
+    Con ranking="bm25" los items se ordenan por puntaje BM25 en vez del
+    orden del catalogo.
+    Las filas son del snapshot entregado (por defecto, el vigente).
     """
-    consulta_lower = consulta.lower()
+    indice = (snapshot or _SNAPSHOT).indice
+    ranking = ranking or RANKING_POR_DEFECTO
+    if ranking not in RANKINGS:
+        raise ValueError(f"Ranking desconocido: {ranking}")
+
     resultados = []
-    categorias_encontradas = set()
-
-    # 1. Buscar por keywords exactos
-    for keyword, categoria in KEYWORD_MAPPING.items():
-        if keyword in consulta_lower and categoria not in categorias_encontradas:
-            if categoria in APU_CATALOG:
-                categorias_encontradas.add(categoria)
-                # Agregar items de esta categoria
-                for item in APU_CATALOG[categoria]["items"]:
-                    item_copy = item.copy()
-                    item_copy["categoria"] = APU_CATALOG[categoria]["nombre"]
-                    resultados.append(item_copy)
+    vistos = set()
+
+    def agregar(fila, categoria=None):
+        if fila not in vistos:
+            vistos.add(fila)
+            resultados.append((fila, categoria))
+
+    categorias = indice.categorias_por_keyword(consulta, calces)
+
+    # 1b. BM25: texto y categorias detectadas puntuados juntos
+    if ranking == "bm25":
+        filas_categoria = [indice.filas_por_categoria[c] for c in categorias]
+        for fila in indice.bm25.mejores(consulta, max_resultados, filas_categoria):
+            agregar(fila)
+        categorias = []
+
+    # 1. Buscar por keywords (categorias completas, en orden de KEYWORD_MAPPING)
+    for cat_key in categorias:
+        for fila in indice.filas_por_categoria[cat_key]:
+            if len(resultados) >= max_resultados:
+                return resultados
+            agregar(fila)
 
     # 2. Si no hay resultados, buscar en descripciones
+    if not resultados and ranking == "legacy":
+        for fila in indice.filas_por_texto(consulta):
+            if len(resultados) >= max_resultados:
+                return resultados
+            agregar(fila)
+
+    # 3. Si no hay calces exactos, tolerar errores de tipeo (trigramas)
     if not resultados:
-        palabras = consulta_lower.split()
-        for cat_key, categoria in APU_CATALOG.items():
-            for item in categoria["items"]:
-                desc_lower = item["desc"].lower()
-                for palabra in palabras:
-                    if len(palabra) > 3 and palabra in desc_lower:
-                        item_copy = item.copy()
-                        item_copy["categoria"] = categoria["nombre"]
-                        if item_copy not in resultados:
-                            resultados.append(item_copy)
-
-    # 3. Si aun no hay resultados, usar terminaciones como fallback
+        for fila, _ in indice.trigramas.buscar(consulta, k=max_resultados):
+            agregar(fila)
+
+    # 4. Si aun no hay resultados, usar terminaciones como fallback
     if not resultados:
-        for item in APU_CATALOG["revestimientos"]["items"][:3]:
-            item_copy = item.copy()
-            item_copy["categoria"] = "Terminaciones"
-            resultados.append(item_copy)
+        for fila in indice.filas_por_categoria.get("revestimientos", [])[:3]:
+            agregar(fila, "Terminaciones")
 
-    # 4. Eliminar duplicados manteniendo orden
-    vistos = set()
-    unicos = []
-    for item in resultados:
-        key = item["codigo"]
-        if key not in vistos:
-            vistos.add(key)
-            unicos.append(item)
+    return resultados[:max_resultados]
 
-    return unicos[:max_resultados]
+
+def buscar_apus(consulta: str, max_resultados: int = 8, calces: list = None,
+                ranking: str = None) -> list:
+    """Igual que buscar_filas, pero retorna los items como dicts (para respuestas)."""
+    snapshot = _SNAPSHOT
+    return [
+        snapshot.catalogo.item(fila, categoria)
+        for fila, categoria in buscar_filas(consulta, max_resultados, calces, ranking, snapshot)
+    ]
+
+
+# Cantidad por unidad cuando se conoce el area:
+#   cantidad = factor_area * area + factor_raiz * raiz(area)
+# y cantidad por defecto si no se indica area: (factor_area, factor_raiz, defecto)
+REGLAS_CANTIDAD = {
+    "m2": (1.0, 0.0, 30), "m²": (1.0, 0.0, 30),
+    "m3": (0.1, 0.0, 3), "m³": (0.1, 0.0, 3),
+    "ml": (0.0, 4.0, 12), "m": (0.0, 4.0, 12),
+    "kg": (5.0, 0.0, 50),
+}
+# "un" usa la cantidad indicada (1 por defecto); el resto de unidades cuenta 1
+UNIDADES_POR_CANTIDAD = ("un",)
+
+# Costos indirectos sobre el costo directo (CD)
+COSTOS_INDIRECTOS = [
+    # (clave, porcentaje, elemento, descripcion, apu_origen)
+    ("mano_obra", 0.18, "Mano de obra especializada",
+     "Maestros, oficiales y ayudantes segun partidas | 18% CD", "MO-18%"),
+    ("gastos_generales", 0.08, "Gastos generales de obra",
+     "Supervision, seguros, arriendos, transporte | 8% CD", "GG-8%"),
+    ("imprevistos", 0.05, "Imprevistos y contingencias",
+     "Reserva para variaciones y emergencias | 5% CD", "IMP-5%"),
+    ("utilidad", 0.10, "Utilidad contratista",
+     "Margen profesional del ejecutor | 10% CD", "UTI-10%"),
+]
+IVA = 0.19
+
+# Escenarios de precio: calidad (mismos factores que build_wizard_prompt)
+# x region (factores referenciales respecto de la Region Metropolitana)
+FACTORES_CALIDAD = {"economico": 0.8, "estandar": 1.0, "premium": 1.3}
+FACTORES_REGION = {
+    "arica_parinacota": 1.15, "tarapaca": 1.14, "antofagasta": 1.18, "atacama": 1.12,
+    "coquimbo": 1.04, "valparaiso": 1.02, "metropolitana": 1.00, "ohiggins": 1.00,
+    "maule": 0.98, "nuble": 0.98, "biobio": 1.00, "araucania": 1.02,
+    "los_rios": 1.04, "los_lagos": 1.06, "aysen": 1.25, "magallanes": 1.22,
+}
+# La calidad cambia materiales; mano de obra y arriendo de equipos no
+CATEGORIAS_SIN_FACTOR_CALIDAD = ("mano_obra", "equipos")
+
+# Palabras (normalizadas) que indican calidad o region en una instruccion
+PALABRAS_CALIDAD = {
+    "economico": "economico", "economica": "economico", "basico": "economico", "basica": "economico",
+    "estandar": "estandar", "premium": "premium", "lujo": "premium", "alta gama": "premium",
+}
+PALABRAS_REGION = {
+    "arica": "arica_parinacota", "iquique": "tarapaca", "tarapaca": "tarapaca",
+    "antofagasta": "antofagasta", "calama": "antofagasta", "copiapo": "atacama", "atacama": "atacama",
+    "la serena": "coquimbo", "coquimbo": "coquimbo", "valparaiso": "valparaiso",
+    "vina del mar": "valparaiso", "santiago": "metropolitana", "metropolitana": "metropolitana",
+    "rancagua": "ohiggins", "talca": "maule", "maule": "maule", "chillan": "nuble", "nuble": "nuble",
+    "concepcion": "biobio", "biobio": "biobio", "temuco": "araucania", "araucania": "araucania",
+    "valdivia": "los_rios", "puerto montt": "los_lagos", "osorno": "los_lagos", "chiloe": "los_lagos",
+    "coyhaique": "aysen", "aysen": "aysen", "punta arenas": "magallanes", "magallanes": "magallanes",
+}
+
+
+def detectar_escenario(texto: str) -> tuple:
+    """(calidad, region) mencionadas en el texto; estandar / metropolitana si no hay."""
+    palabras = f" {' '.join(tokenizar(texto))} "
+    calidad = next((c for p, c in PALABRAS_CALIDAD.items() if f" {p} " in palabras), "estandar")
+    region = next((r for p, r in PALABRAS_REGION.items() if f" {p} " in palabras), "metropolitana")
+    return calidad, region
+
+
+@lru_cache(maxsize=4)
+def _tablas_cantidad(catalogo: CatalogoCompacto) -> tuple:
+    """Tablas de reglas de cantidad indexadas por id de unidad del catalogo."""
+    n = len(catalogo.unidades)
+    es_area = np.zeros(n, dtype=bool)
+    es_cantidad = np.zeros(n, dtype=bool)
+    factor_area, factor_raiz, defecto = np.zeros(n), np.zeros(n), np.ones(n)
+    for id_unidad, unidad in enumerate(catalogo.unidades):
+        if unidad in REGLAS_CANTIDAD:
+            es_area[id_unidad] = True
+            factor_area[id_unidad], factor_raiz[id_unidad], defecto[id_unidad] = REGLAS_CANTIDAD[unidad]
+        es_cantidad[id_unidad] = unidad in UNIDADES_POR_CANTIDAD
+    return es_area, es_cantidad, factor_area, factor_raiz, defecto
+
+
+@lru_cache(maxsize=4)
+def _tabla_calidad(catalogo: CatalogoCompacto) -> np.ndarray:
+    """Por id de categoria: 1.0 si el factor de calidad aplica, 0.0 si no."""
+    return np.array([c not in CATEGORIAS_SIN_FACTOR_CALIDAD for c in catalogo.categorias], dtype=np.float64)
+
+
+def _escenarios(directo: np.ndarray, afectado: np.ndarray) -> dict:
+    """
+    Matriz calidad x region para n presupuestos en una sola operacion:
+    directo[q, r] = (afectado * calidad[q] + resto) * region[r]. Los
+    indirectos son proporcionales al costo directo.
+    """
+    calidad = np.array(list(FACTORES_CALIDAD.values()))
+    region = np.array(list(FACTORES_REGION.values()))
+    base = afectado[:, None] * calidad[None, :] + (directo - afectado)[:, None]
+    por_escenario = base[:, :, None] * region[None, None, :]
+    total = por_escenario * (1 + sum(pct for _, pct, *_ in COSTOS_INDIRECTOS))
+    return {
+        "subtotal_directo": por_escenario.astype(np.int64).tolist(),
+        "total_estimado": total.astype(np.int64).tolist(),
+        "total_con_iva": (total * (1 + IVA)).astype(np.int64).tolist(),
+    }
+
+
+def _numero(valor: float, decimal: bool):
+    """Float para montos derivados del area; int cuando el valor es entero y fijo."""
+    return valor if decimal or not valor.is_integer() else int(valor)
 
 
-def calcular_presupuesto_completo(consulta: str, area: float = None, cantidad: int = None) -> dict:
+def _presupuestos_desde_filas(snapshot: "SnapshotCatalogo", busquedas: list, areas: list,
+                              cantidades: list, incluir_items: bool = True,
+                              escenarios: bool = False) -> list:
+    """
+    Motor vectorizado: busquedas[i] son las filas [(fila, categoria)] del
+    presupuesto i, todas del mismo snapshot. Cantidades, subtotales,
+    indirectos y totales se calculan con operaciones numpy sobre todas las
+    lineas de todos los presupuestos; los dicts de salida se arman al final.
+    Con escenarios=True cada presupuesto trae ademas la matriz
+    FACTORES_CALIDAD x FACTORES_REGION de totales.
+    """
+    catalogo = snapshot.catalogo
+    n = len(busquedas)
+    largos = np.array([len(b) for b in busquedas], dtype=np.int64)
+    presupuesto = np.repeat(np.arange(n), largos)
+    filas = np.fromiter((f for b in busquedas for f, _ in b), dtype=np.int64, count=int(largos.sum()))
+
+    # None/0 significan "no especificado", igual que el calculo escalar original
+    area = np.array([a or 0 for a in areas], dtype=np.float64)[presupuesto]
+    cantidad = np.array([c or 0 for c in cantidades], dtype=np.float64)[presupuesto]
+
+    es_area, es_cantidad, factor_area, factor_raiz, defecto = _tablas_cantidad(catalogo)
+    unidad = catalogo.id_unidad[filas]
+    con_area = area != 0
+    base = np.where(con_area, area, 0.0)
+    por_area = np.where(con_area, factor_area[unidad] * base + factor_raiz[unidad] * np.sqrt(base),
+                        defecto[unidad])
+    por_cantidad = np.where(es_cantidad[unidad] & (cantidad != 0), cantidad, 1.0)
+    cant = np.round(np.where(es_area[unidad], por_area, por_cantidad), 2)
+
+    precios = catalogo.precios[filas]
+    subtotales = precios * cant
+    directo = np.bincount(presupuesto, weights=subtotales, minlength=n)
+
+    porcentajes = np.array([pct for _, pct, *_ in COSTOS_INDIRECTOS])
+    indirectos = directo[:, None] * porcentajes[None, :]
+    total = directo.copy()
+    for j in range(len(COSTOS_INDIRECTOS)):
+        total += indirectos[:, j]
+
+    if escenarios:
+        con_calidad = _tabla_calidad(catalogo)[catalogo.id_categoria[filas]]
+        matriz = _escenarios(directo, np.bincount(presupuesto, weights=subtotales * con_calidad, minlength=n))
+
+    # Del lado numpy a listas de Python una sola vez para armar la respuesta
+    decimal = (es_area[unidad] | (cant % 1 != 0)).tolist()
+    filas, cant, subtotales = filas.tolist(), cant.tolist(), subtotales.tolist()
+    directo, indirectos, total = directo.tolist(), indirectos.tolist(), total.tolist()
+
+    resultados = []
+    inicio = 0
+    for i, busqueda in enumerate(busquedas):
+        resumen = {}
+        if incluir_items:
+            items = []
+            for linea, (fila, categoria) in enumerate(busqueda, inicio):
+                desc, codigo = catalogo.desc(fila), catalogo.codigo(fila)
+                items.append({
+                    "elemento": desc.split(" - ")[0][:50],
+                    "descripcion": f"{desc} | Codigo: {codigo}",
+                    "cantidad": _numero(cant[linea], decimal[linea]),
+                    "unidad": catalogo.unidad(fila),
+                    "precio_unitario": catalogo.precio(fila),
+                    "subtotal": _numero(subtotales[linea], decimal[linea]),
+                    "apu_origen": f"APU Pro {codigo}",
+                    "categoria": categoria or catalogo.nombre_categoria(fila)
+                })
+            for monto, (_, _, elemento, descripcion, origen) in zip(indirectos[i], COSTOS_INDIRECTOS):
+                items.append({
+                    "elemento": elemento,
+                    "descripcion": descripcion,
+                    "cantidad": 1, "unidad": "gl",
+                    "precio_unitario": monto, "subtotal": monto,
+                    "apu_origen": origen, "categoria": "Costos Indirectos"
+                })
+            resumen["items"] = items
+        inicio += len(busqueda)
+
+        resumen["subtotal_directo"] = int(directo[i])
+        for monto, (clave, *_) in zip(indirectos[i], COSTOS_INDIRECTOS):
+            resumen[clave] = int(monto)
+        resumen.update({
+            "total_estimado": int(total[i]),
+            "moneda": "CLP",
+            "iva_incluido": False,
+            "total_con_iva": int(total[i] * (1 + IVA)),
+            "catalogo_version": snapshot.version
+        })
+        if escenarios:
+            resumen["escenarios"] = {
+                "calidades": list(FACTORES_CALIDAD),
+                "regiones": list(FACTORES_REGION),
+                **{clave: valores[i] for clave, valores in matriz.items()}
+            }
+        resultados.append(resumen)
+    return resultados
+
+
+def calcular_presupuesto_completo(consulta: str, area: float = None, cantidad: int = None,
+                                  calces: list = None, ranking: str = None,
+                                  escenarios: bool = False) -> dict:
     """
     Genera un presupuesto completo con desglose profesional.
     Incluye materiales, mano de obra, gastos generales e imprevistos.
     """
-    apus = buscar_apus(consulta)
-
-    items = []
-    subtotal_directo = 0
-
-    for apu in apus:
-        # Determinar cantidad segun unidad
-        if apu["unidad"] in ["m2", "m²"]:
-            cant = area if area else 30
-        elif apu["unidad"] in ["m3", "m³"]:
-            cant = (area / 10) if area else 3
-        elif apu["unidad"] in ["ml", "m"]:
-            cant = (area ** 0.5 * 4) if area else 12
-        elif apu["unidad"] == "kg":
-            cant = (area * 5) if area else 50
-        elif apu["unidad"] == "un":
-            cant = cantidad if cantidad else 1
-        else:
-            cant = 1
-
-        cant = round(cant, 2)
-        subtotal = apu["precio"] * cant
-        subtotal_directo += subtotal
-
-        items.append({
-            "elemento": apu["desc"].split(" - ")[0][:50],
-            "descripcion": f"{apu['desc']} | Codigo: {apu['codigo']}",
-            "cantidad": cant,
-            "unidad": apu["unidad"],
-            "precio_unitario": apu["precio"],
-            "subtotal": subtotal,
-            "apu_origen": f"APU Pro {apu['codigo']}",
-            "categoria": apu.get("categoria", "General")
+    snapshot = _SNAPSHOT
+    filas = buscar_filas(consulta, calces=calces, ranking=ranking, snapshot=snapshot)
+    return _presupuestos_desde_filas(snapshot, [filas], [area], [cantidad], escenarios=escenarios)[0]
+
+
+def calcular_presupuestos_lote(solicitudes: list, ranking: str = None,
+                               incluir_items: bool = True, calces: list = None,
+                               escenarios: bool = False, snapshot: "SnapshotCatalogo" = None) -> list:
+    """
+    Calcula N presupuestos de una vez. solicitudes es una lista de tuplas
+    (consulta, area, cantidad); area y cantidad pueden ser None.
+    Cada consulta distinta se busca una sola vez, y todo el calculo de
+    cantidades y costos es vectorizado. Con incluir_items=False solo se
+    retornan los totales (util para cotizar cientos de variantes).
+    calces, si se entrega, trae los calces de detectar_keywords de cada solicitud.
+    Todo el lote se precia con un mismo snapshot del catalogo (el entregado,
+    que debe ser el de los calces, o el vigente).
+    escenarios=True agrega a cada presupuesto la matriz calidad x region.
+    """
+    snapshot = snapshot or _SNAPSHOT
+    filas_por_consulta = {}
+    busquedas, areas, cantidades = [], [], []
+    for i, (consulta, area, cantidad) in enumerate(solicitudes):
+        if consulta not in filas_por_consulta:
+            filas_por_consulta[consulta] = buscar_filas(
+                consulta, calces=calces[i] if calces else None, ranking=ranking,
+                snapshot=snapshot
+            )
+        busquedas.append(filas_por_consulta[consulta])
+        areas.append(area)
+        cantidades.append(cantidad)
+    if not busquedas:
+        return []
+    return _presupuestos_desde_filas(snapshot, busquedas, areas, cantidades, incluir_items, escenarios)
+
+
+def _centesimos(precio: float, cantidad: float) -> int:
+    """Subtotal en centesimos enteros: sumas y restas repetidas no acumulan error."""
+    return round(precio * cantidad * 100)
+
+
+class PresupuestoIncremental:
+    """
+    Presupuesto "what if": mantiene el costo directo como agregado y
+    recalcula indirectos, total e IVA desde el (todos son lineales en el
+    costo directo). Agregar, modificar o quitar una linea cuesta O(1),
+    sin importar cuantas lineas tenga el presupuesto: el cliente guarda las
+    lineas y envia sus valores antes/despues (ajustar).
+    Los montos se llevan en centesimos enteros; los totales se truncan a
+    CLP igual que en calcular_presupuestos_lote.
+    """
+
+    def __init__(self, subtotal_directo: float = 0):
+        self._directo = _centesimos(subtotal_directo, 1)
+
+    def ajustar(self, precio_unitario: float, cantidad: float,
+                precio_anterior: float = 0, cantidad_anterior: float = 0) -> float:
+        """
+        Aplica el cambio de una linea: agregar (sin valores anteriores),
+        modificar, o quitar (precio y cantidad nuevos en 0).
+        Retorna el subtotal nuevo de la linea.
+        """
+        nuevo = _centesimos(precio_unitario, cantidad)
+        self._directo += nuevo - _centesimos(precio_anterior, cantidad_anterior)
+        return _numero(nuevo / 100, False)
+
+    @property
+    def subtotal_directo(self) -> float:
+        return self._directo / 100
+
+    def totales(self) -> dict:
+        """Costo directo, indirectos, total e IVA (mismas claves que el presupuesto completo)."""
+        directo = self.subtotal_directo
+        resumen = {"subtotal_directo": int(directo)}
+        total = directo
+        for clave, porcentaje, *_ in COSTOS_INDIRECTOS:
+            monto = directo * porcentaje
+            resumen[clave] = int(monto)
+            total += monto
+        resumen.update({
+            "total_estimado": int(total),
+            "moneda": "CLP",
+            "iva_incluido": False,
+            "total_con_iva": int(total * (1 + IVA))
         })
+        return resumen
+
+
 
-    # Agregar costos indirectos
-    mano_obra = subtotal_directo * 0.18  # 18%
-    gastos_generales = subtotal_directo * 0.08  # 8%
-    imprevistos = subtotal_directo * 0.05  # 5%
-    utilidad = subtotal_directo * 0.10  # 10%
-
-    items.append({
-        "elemento": "Mano de obra especializada",
-        "descripcion": "Maestros, oficiales y ayudantes segun partidas | 18% CD",
-        "cantidad": 1, "unidad": "gl",
-        "precio_unitario": mano_obra, "subtotal": mano_obra,
-        "apu_origen": "MO-18%", "categoria": "Costos Indirectos"
-    })
-
-    items.append({
-        "elemento": "Gastos generales de obra",
-        "descripcion": "Supervision, seguros, arriendos, transporte | 8% CD",
-        "cantidad": 1, "unidad": "gl",
-        "precio_unitario": gastos_generales, "subtotal": gastos_generales,
-        "apu_origen": "GG-8%", "categoria": "Costos Indirectos"
-    })
-
-    items.append({
-        "elemento": "Imprevistos y contingencias",
-        "descripcion": "Reserva para variaciones y emergencias | 5% CD",
-        "cantidad": 1, "unidad": "gl",
-        "precio_unitario": imprevistos, "subtotal": imprevistos,
-        "apu_origen": "IMP-5%", "categoria": "Costos Indirectos"
-    })
-
-    items.append({
-        "elemento": "Utilidad contratista",
-        "descripcion": "Margen profesional del ejecutor | 10% CD",
-        "cantidad": 1, "unidad": "gl",
-        "precio_unitario": utilidad, "subtotal": utilidad,
-        "apu_origen": "UTI-10%", "categoria": "Costos Indirectos"
-    })
-
-    total = subtotal_directo + mano_obra + gastos_generales + imprevistos + utilidad
+# Imprevistos que el prompt del wizard pide sobre el costo directo
+IMPREVISTOS_PRESUPUESTO_IA = 0.10
+
+
+def reconciliar_presupuesto_ia(items: list, calidad: str = "estandar",
+                               snapshot: "SnapshotCatalogo" = None) -> dict:
+    """
+    Re-precia un presupuesto generado por IA contra el catalogo vigente.
+    Las partidas con codigo APU conocido toman unidad y precio del catalogo
+    (con el factor de calidad, salvo mano de obra y equipos); las demas
+    conservan el precio del modelo. Subtotales y totales se recalculan, asi
+    un error aritmetico o un precio inventado no llega al usuario.
+    Retorna el presupuesto (forma schemas.Budget) y el detalle del ajuste.
+    """
+    snapshot = snapshot or _SNAPSHOT   # una sola lectura: precios y version del mismo snapshot
+    catalogo = snapshot.catalogo
+    factor = FACTORES_CALIDAD.get(calidad, 1.0)
+    partidas, desconocidos = [], []
+    materiales = mano_obra = 0.0
+    for item in items:
+        item = dict(item)
+        codigo = str(item.get("apu_origen", "")).replace("APU Pro ", "", 1).strip()
+        fila = catalogo.fila(codigo)
+        categoria = None
+        if fila is None:
+            desconocidos.append(codigo)
+        else:
+            categoria = catalogo.categorias[catalogo.id_categoria.item(fila)]
+            precio = catalogo.precios.item(fila)
+            if categoria not in CATEGORIAS_SIN_FACTOR_CALIDAD:
+                precio *= factor
+            item["unidad"] = catalogo.unidad(fila)
+            item["precio_unitario"] = round(precio)
+        item["subtotal"] = round(item["cantidad"] * item["precio_unitario"])
+        if categoria == "mano_obra":
+            mano_obra += item["subtotal"]
+        else:
+            materiales += item["subtotal"]
+        partidas.append(item)
 
+    imprevistos = (materiales + mano_obra) * IMPREVISTOS_PRESUPUESTO_IA
     return {
-        "items": items,
-        "subtotal_directo": int(subtotal_directo),
-        "mano_obra": int(mano_obra),
-        "gastos_generales": int(gastos_generales),
-        "imprevistos": int(imprevistos),
-        "utilidad": int(utilidad),
-        "total_estimado": int(total),
-        "moneda": "CLP",
-        "iva_incluido": False,
-        "total_con_iva": int(total * 1.19)
+        "items": partidas,
+        "total_materials": round(materiales),
+        "total_labor": round(mano_obra),
+        "total_contingency": round(imprevistos),
+        "total_final": round(materiales + mano_obra + imprevistos),
+        "currency": "CLP",
+        "reconciliacion": {
+            "calidad": calidad,
+            "partidas_catalogo": len(partidas) - len(desconocidos),
+            "codigos_desconocidos": desconocidos,
+            "catalogo_version": snapshot.version,
+        },
     }
 
-
 # Proyectos comunes para sugerencias rapidas
 PROYECTOS_COMUNES = [
     {
@@ -665,7 +1133,244 @@ def obtener_sugerencias() -> list:
 
 def obtener_categorias() -> list:
     """Retorna lista de todas las categorias disponibles."""
+    catalogo = _SNAPSHOT.catalogo
     return [
-        {"key": key, "nombre": cat["nombre"], "items_count": len(cat["items"])}
-        for key, cat in APU_CATALOG.items()
+        {"key": key, "nombre": nombre, "items_count": len(catalogo.rango_categoria(key))}
+        for key, nombre in zip(catalogo.categorias, catalogo.nombres_categoria)
     ]
+
+
+# Familias Ondac (primera letra de la clase) -> categoria del catalogo
+ONDAC_FAMILIAS = {
+    "A": "preliminares", "B": "movimiento_tierras", "C": "fundacion",
+    "D": "fundacion", "E": "enfierradura", "F": "muros", "G": "metalica",
+    "H": "tabiques", "I": "techumbre", "J": "cielos", "K": "revestimientos",
+    "L": "pisos",
+}
+
+ONDAC_UNIDADES = {"mt": "ml", "uni": "un"}
+
+
+def cargar_apus_ondac(ruta: str) -> dict:
+    """
+    Lee las partidas Ondac de apu_scan_full.json y las retorna con la misma
+    forma que APU_CATALOG. Las filas sin precio ("Ver/Agregar") se omiten.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        return _partidas_ondac(json.load(f))
+
+
+def _partidas_ondac(data: dict) -> dict:
+    """Partidas Ondac de un apu_scan_full.json ya leido (ver cargar_apus_ondac)."""
+    catalogo = {}
+    vistos = set()
+    for archivo in data.get("onda_apus", []):
+        for fila in archivo.get("items", []):
+            if len(fila) < 6 or fila[4] != "CLP":
+                continue
+            clase, numero, titulo, unidad, _, precio = fila[:6]
+            try:
+                precio = int(float(precio))
+            except ValueError:
+                continue
+
+            codigo = f"{clase}-{numero.zfill(5)}"
+            if codigo in vistos:
+                continue
+            vistos.add(codigo)
+
+            cat_key = ONDAC_FAMILIAS.get(clase[:1], "ondac")
+            nombre = APU_CATALOG[cat_key]["nombre"] if cat_key in APU_CATALOG else "Partidas Ondac"
+            categoria = catalogo.setdefault(cat_key, {"nombre": nombre, "items": []})
+            categoria["items"].append({
+                "desc": " ".join(titulo.split()),
+                "unidad": ONDAC_UNIDADES.get(unidad.lower(), unidad.lower()),
+                "precio": precio,
+                "codigo": codigo,
+            })
+
+    return catalogo
+
+
+def fusionar_catalogos(*catalogos: dict) -> dict:
+    """Une catalogos con forma de APU_CATALOG; los items se agregan por categoria."""
+    resultado = {}
+    for catalogo in catalogos:
+        for cat_key, categoria in catalogo.items():
+            destino = resultado.setdefault(cat_key, {"nombre": categoria["nombre"], "items": []})
+            destino["items"].extend(categoria["items"])
+    return resultado
+
+
+# =====================================================
+# CATALOGO VERSIONADO - recarga en caliente
+# =====================================================
+
+# Archivo de catalogo (opcional): JSON o snapshot binario; sin el se usa APU_CATALOG
+CATALOGO_RUTA = os.getenv("APU_CATALOG_PATH")
+
+# Version del formato binario; un snapshot de otra version se reconstruye
+FORMATO_SNAPSHOT = 1
+
+
+class SnapshotCatalogo(NamedTuple):
+    """
+    Version inmutable del catalogo: catalogo compacto e indices. Cada
+    solicitud toma el snapshot vigente una sola vez y lo usa de punta a
+    punta, asi una recarga nunca mezcla precios de dos versiones.
+    """
+    version: str
+    catalogo: CatalogoCompacto
+    indice: IndiceCatalogo
+    origen: str
+    cargado_en: float
+
+
+def _huella_catalogo(catalogo: dict) -> str:
+    """Huella corta del contenido del catalogo; cambia con cualquier precio o partida."""
+    contenido = json.dumps(catalogo, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()[:12]
+
+
+def validar_catalogo(datos: dict) -> dict:
+    """Verifica la forma de APU_CATALOG; un catalogo invalido nunca llega a publicarse."""
+    if not isinstance(datos, dict) or not datos:
+        raise ValueError("Catalogo vacio o con formato invalido")
+    for cat_key, categoria in datos.items():
+        if not isinstance(categoria, dict) or "nombre" not in categoria \
+                or not isinstance(categoria.get("items"), list):
+            raise ValueError(f"Categoria invalida: {cat_key}")
+        for item in categoria["items"]:
+            faltantes = {"desc", "unidad", "precio", "codigo"} - set(item)
+            if faltantes:
+                raise ValueError(f"Item sin {', '.join(sorted(faltantes))} en {cat_key}")
+            if not isinstance(item["precio"], (int, float)) or item["precio"] < 0:
+                raise ValueError(f"Precio invalido en {cat_key}: {item['codigo']}")
+    return datos
+
+
+def cargar_catalogo(ruta: str) -> dict:
+    """
+    Lee un catalogo desde JSON. Acepta la forma de APU_CATALOG o un
+    apu_scan_full.json; en ese caso las partidas Ondac se suman al
+    catalogo base.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "onda_apus" in data:
+        data = fusionar_catalogos(APU_CATALOG, _partidas_ondac(data))
+    return validar_catalogo(data)
+
+
+def construir_snapshot(datos: dict, origen: str = "builtin", version: str = None) -> SnapshotCatalogo:
+    """Arma catalogo compacto e indices de busqueda para una version del catalogo."""
+    catalogo = CatalogoCompacto.desde_dict(datos)
+    return SnapshotCatalogo(
+        version=version or _huella_catalogo(datos),
+        catalogo=catalogo,
+        indice=IndiceCatalogo(catalogo, KEYWORD_MAPPING),
+        origen=origen,
+        cargado_en=time.time(),
+    )
+
+
+def guardar_snapshot_binario(snapshot: SnapshotCatalogo, ruta: str):
+    """
+    Serializa catalogo e indices ya construidos (precios, postings BM25,
+    trigramas y automata) en un solo archivo para apu_binario.
+    """
+    meta_catalogo, arreglos = snapshot.catalogo.a_binario()
+    meta_indice, arreglos_indice = snapshot.indice.a_binario()
+    arreglos.update(arreglos_indice)
+    meta = {
+        "formato": FORMATO_SNAPSHOT,
+        "version": snapshot.version,
+        "origen": snapshot.origen,
+        "catalogo": meta_catalogo,
+        "indice": meta_indice,
+    }
+    apu_binario.escribir(ruta, meta, arreglos)
+
+
+def cargar_snapshot_binario(ruta: str) -> SnapshotCatalogo:
+    """Snapshot desde un archivo de guardar_snapshot_binario, mapeado en memoria."""
+    meta, arreglos = apu_binario.leer(ruta)
+    if meta.get("formato") != FORMATO_SNAPSHOT:
+        raise ValueError(f"Formato de snapshot {meta.get('formato')} no soportado en {ruta}")
+    catalogo = CatalogoCompacto.desde_binario(meta["catalogo"], arreglos)
+    return SnapshotCatalogo(
+        version=meta["version"],
+        catalogo=catalogo,
+        indice=IndiceCatalogo.desde_binario(catalogo, meta["indice"], arreglos),
+        origen=ruta,
+        cargado_en=time.time(),
+    )
+
+
+def snapshot_desde_archivo(ruta: str) -> SnapshotCatalogo:
+    """Snapshot binario (mmap) o catalogo JSON con indices construidos al vuelo."""
+    if apu_binario.es_binario(ruta):
+        return cargar_snapshot_binario(ruta)
+    return construir_snapshot(cargar_catalogo(ruta), ruta)
+
+
+_LOCK_RECARGA = threading.Lock()
+
+
+def recargar_catalogo(ruta: str = None) -> SnapshotCatalogo:
+    """
+    Construye un snapshot desde ruta (o APU_CATALOG_PATH) y lo publica con
+    una sola asignacion; las solicitudes en curso terminan con el anterior.
+    Si el contenido no cambio se conserva el vigente. Errores de lectura o
+    validacion se propagan y el snapshot vigente sigue activo.
+    """
+    global _SNAPSHOT
+    ruta = ruta or CATALOGO_RUTA
+    with _LOCK_RECARGA:
+        if ruta and apu_binario.es_binario(ruta):
+            nuevo = cargar_snapshot_binario(ruta)
+            if nuevo.version != _SNAPSHOT.version:
+                _SNAPSHOT = nuevo
+            return _SNAPSHOT
+        datos = cargar_catalogo(ruta) if ruta else APU_CATALOG
+        version = _huella_catalogo(datos)
+        if version != _SNAPSHOT.version:
+            _SNAPSHOT = construir_snapshot(datos, ruta or "builtin", version)
+        return _SNAPSHOT
+
+
+def snapshot_actual() -> SnapshotCatalogo:
+    """Snapshot vigente del catalogo."""
+    return _SNAPSHOT
+
+
+def version_catalogo() -> str:
+    """Version del catalogo con que se calculan los precios."""
+    return _SNAPSHOT.version
+
+
+def info_catalogo() -> dict:
+    """Resumen del snapshot vigente (para health check y recargas)."""
+    snapshot = _SNAPSHOT
+    return {
+        "version": snapshot.version,
+        "origen": snapshot.origen,
+        "partidas": len(snapshot.catalogo),
+        "cargado_en": datetime.fromtimestamp(snapshot.cargado_en).isoformat(),
+        "carga_inicial_ms": CARGA_INICIAL_MS,
+    }
+
+
+def _snapshot_inicial() -> SnapshotCatalogo:
+    if CATALOGO_RUTA:
+        try:
+            return snapshot_desde_archivo(CATALOGO_RUTA)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Catalogo {CATALOGO_RUTA} no disponible ({e}); usando catalogo base")
+    return construir_snapshot(APU_CATALOG)
+
+
+# Catalogo compacto e indices, construidos (o mapeados) al importar el modulo
+_inicio_carga = time.perf_counter()
+_SNAPSHOT = _snapshot_inicial()
+CARGA_INICIAL_MS = round((time.perf_counter() - _inicio_carga) * 1000, 1)
@@ -0,0 +1,242 @@
+"""
+ARKITECTO AI - Simulacion Monte Carlo del riesgo de costo
+Reemplaza el 5% fijo de imprevistos por una distribucion: se simulan
+miles de variantes del presupuesto (precio y cantidad inciertos por
+categoria) y se reportan percentiles del total y el aporte de cada
+categoria al riesgo. Todo el calculo es vectorizado con numpy.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from apu_catalog import COSTOS_INDIRECTOS, IVA, snapshot_actual
+
+# Incertidumbre triangular (minimo, moda, maximo) como factor sobre el valor base
+DISTRIBUCION_POR_DEFECTO = {
+    "precio": (0.95, 1.0, 1.15),
+    "cantidad": (0.95, 1.0, 1.10),
+}
+PERCENTILES = (50, 80, 95)
+
+# Simulaciones por bloque (unidad de reparto entre procesos) y simulaciones
+# por sub-bloque dentro de un bloque (temporales en cache)
+BLOQUE = 100_000
+COLUMNAS_CACHE = 2048
+
+# Corridas grandes se reparten en procesos; 0 procesos = siempre en proceso
+PROCESOS = int(os.getenv("RISK_PROCESS_WORKERS", "0"))
+UMBRAL_PROCESOS = int(os.getenv("RISK_PROCESS_THRESHOLD", "500000"))
+
+# Pool de iniciar_procesos (None: todo en proceso)
+_pool = None
+
+
+def iniciar_procesos(procesos: int = PROCESOS):
+    """
+    Crea el pool de procesos para corridas grandes (llamar al iniciar la
+    app). Los procesos se crean con spawn: fork desde un proceso con
+    threads (event loop, pool de Vertex AI, SQLite) puede dejar locks
+    tomados en el hijo y colgarlo.
+    """
+    global _pool
+    if procesos > 0 and _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def detener_procesos():
+    """Cierra el pool de iniciar_procesos (llamar al terminar la app)."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _validar_triangular(parametros, nombre: str) -> tuple:
+    minimo, moda, maximo = (float(v) for v in parametros)
+    if not 0 <= minimo <= moda <= maximo:
+        raise ValueError(f"Distribucion invalida para {nombre}: se espera 0 <= min <= moda <= max")
+    return minimo, moda, maximo
+
+
+def _triangular(u: np.ndarray, corte, escala_izq, escala_der, desplazamiento,
+                tmp: np.ndarray) -> np.ndarray:
+    """
+    Inversa de la CDF triangular sobre u, en sitio (u queda con el resultado).
+    Sin mascaras: izquierda(min(u, c)) + derecha(max(u, c)) - moda da la rama
+    que corresponde, porque la rama que no aplica queda evaluada en c (= moda).
+    Los parametros van por fila (columnas (k, 1)), asi cada fila se recorre
+    con escalares; tmp es un buffer del mismo tamano.
+    """
+    np.minimum(u, corte, out=tmp)           # izquierda: min + sqrt(u (max-min)(moda-min))
+    tmp *= escala_izq
+    np.sqrt(tmp, out=tmp)
+    np.maximum(u, corte, out=u)             # derecha: max - sqrt((1-u) (max-min)(max-moda))
+    np.subtract(1, u, out=u)
+    u *= escala_der
+    np.sqrt(u, out=u)
+    np.subtract(tmp, u, out=u)
+    u += desplazamiento                     # min + max - moda
+    return u
+
+
+def _parametros_triangular(minimo: np.ndarray, moda: np.ndarray, maximo: np.ndarray) -> tuple:
+    ancho = maximo - minimo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corte = np.where(ancho > 0, (moda - minimo) / ancho, 0)
+    parametros = (corte, ancho * (moda - minimo), ancho * (maximo - moda), minimo + maximo - moda)
+    return tuple(p.astype(np.float32)[:, None] for p in parametros)
+
+
+def _simular_bloque(n: int, semilla, montos_categoria: np.ndarray, cantidad: np.ndarray,
+                    precio: np.ndarray) -> np.ndarray:
+    """
+    n simulaciones -> costo directo por categoria (C x n).
+    La cantidad varia por linea (errores de cubicacion independientes) y
+    el precio por categoria (el mercado mueve a toda la categoria junta).
+    montos_categoria es C x L con el subtotal de cada linea en su categoria.
+    Las simulaciones van en el eje contiguo y se procesan en sub-bloques de
+    COLUMNAS_CACHE con buffers reutilizados, para que los temporales quepan
+    en cache.
+    """
+    rng = np.random.default_rng(semilla)
+    categorias, lineas = montos_categoria.shape
+    cantidad = _parametros_triangular(*cantidad)
+    precio = _parametros_triangular(*precio)
+    por_categoria = np.empty((categorias, n), dtype=np.float32)
+
+    columnas = min(n, COLUMNAS_CACHE)
+    u = np.empty((lineas, columnas), dtype=np.float32)
+    tmp = np.empty_like(u)
+    for desde in range(0, n, columnas):
+        m = min(columnas, n - desde)
+        bloque = rng.random(dtype=np.float32, out=u[:, :m]) if m == columnas else \
+            rng.random((lineas, m), dtype=np.float32)
+        factor = _triangular(bloque, *cantidad, tmp[:, :m])
+        por_categoria[:, desde:desde + m] = montos_categoria @ factor
+
+    u = rng.random((categorias, n), dtype=np.float32)
+    por_categoria *= _triangular(u, *precio, np.empty_like(u))
+    return por_categoria
+
+
+def _simular(n: int, semilla, montos_categoria, cantidad, precio, en_procesos: bool) -> np.ndarray:
+    """Reparte n simulaciones en bloques (y en procesos si corresponde) con semillas independientes."""
+    bloques = [BLOQUE] * (n // BLOQUE) + ([n % BLOQUE] if n % BLOQUE else [])
+    semillas = np.random.SeedSequence(semilla).spawn(len(bloques))
+    argumentos = [(b, s, montos_categoria, cantidad, precio) for b, s in zip(bloques, semillas)]
+
+    pool = _pool
+    if en_procesos and pool is not None and n >= UMBRAL_PROCESOS and len(bloques) > 1:
+        partes = list(pool.map(_simular_bloque, *zip(*argumentos)))
+    else:
+        partes = [_simular_bloque(*a) for a in argumentos]
+    return np.concatenate(partes, axis=1) if len(partes) > 1 else partes[0]
+
+
+def _lineas_directas(items: list) -> list:
+    """(categoria, subtotal) de las lineas de costo directo; los indirectos se recalculan."""
+    catalogo = snapshot_actual().catalogo
+    lineas = []
+    for item in items:
+        origen = item.get("apu_origen") or ""
+        if item.get("categoria") == "Costos Indirectos" or "%" in origen:
+            continue
+        categoria = item.get("categoria")
+        if not categoria:
+            # Project.budget no guarda la categoria: se deduce del codigo APU
+            codigo = origen.replace("APU Pro ", "", 1)
+            fila = catalogo.fila(codigo)
+            categoria = catalogo.nombre_categoria(fila) if fila is not None else "Sin categoria"
+        subtotal = item.get("subtotal")
+        if subtotal is None:
+            subtotal = item["precio_unitario"] * item["cantidad"]
+        lineas.append((categoria, float(subtotal)))
+    return lineas
+
+
+def simular_riesgo(items: list, distribuciones: dict = None, por_defecto: dict = None,
+                   simulaciones: int = 100_000, semilla: int = None, en_procesos: bool = True) -> dict:
+    """
+    Simulacion Monte Carlo del costo de un presupuesto.
+    items: items de calcular_presupuesto_completo o de Project.budget.
+    distribuciones: {categoria: {"precio": (min, moda, max), "cantidad": (...)}};
+    lo no indicado usa por_defecto (o DISTRIBUCION_POR_DEFECTO).
+    Retorna percentiles del total, la contingencia sugerida (P80) frente
+    al 5% fijo, y por categoria su valor esperado y su aporte a la varianza.
+    Las corridas grandes usan el pool de iniciar_procesos, si esta creado
+    y en_procesos es True.
+    """
+    inicio = time.perf_counter()
+    lineas = _lineas_directas(items)
+    if not lineas:
+        raise ValueError("El presupuesto no tiene lineas de costo directo")
+
+    distribuciones = distribuciones or {}
+    defecto = {**DISTRIBUCION_POR_DEFECTO, **(por_defecto or {})}
+    nombres = list(dict.fromkeys(categoria for categoria, _ in lineas))
+    id_categoria = {nombre: i for i, nombre in enumerate(nombres)}
+
+    def parametros(categoria: str, clave: str) -> tuple:
+        valor = (distribuciones.get(categoria) or {}).get(clave) or defecto[clave]
+        return _validar_triangular(valor, f"{categoria}/{clave}")
+
+    montos = np.zeros((len(nombres), len(lineas)), dtype=np.float32)
+    cantidad = np.empty((3, len(lineas)), dtype=np.float32)
+    for linea, (categoria, subtotal) in enumerate(lineas):
+        montos[id_categoria[categoria], linea] = subtotal
+        cantidad[:, linea] = parametros(categoria, "cantidad")
+    precio = np.array([parametros(c, "precio") for c in nombres], dtype=np.float32).T
+
+    por_categoria = _simular(simulaciones, semilla, montos, cantidad, precio, en_procesos)
+    directo = por_categoria.sum(axis=0, dtype=np.float64)
+
+    factor_total = 1 + sum(pct for _, pct, *_ in COSTOS_INDIRECTOS)
+    base = float(montos.sum(dtype=np.float64))
+    cuantiles = np.percentile(directo, PERCENTILES)
+
+    # Aporte de cada categoria a la varianza del total: cov(categoria, total) / var(total)
+    centrado = directo - directo.mean()
+    varianza = float(centrado @ centrado)
+    aportes = (por_categoria @ centrado) / varianza if varianza > 0 else np.zeros(len(nombres))
+    medias = por_categoria.mean(axis=1, dtype=np.float64)
+    p80_categoria = np.percentile(por_categoria, 80, axis=1)
+    base_categoria = montos.sum(axis=1, dtype=np.float64)
+
+    return {
+        "simulaciones": simulaciones,
+        "base": {
+            "subtotal_directo": int(base),
+            "total_estimado": int(base * factor_total),
+        },
+        "percentiles": {
+            f"P{p}": {
+                "subtotal_directo": int(d),
+                "total_estimado": int(d * factor_total),
+                "total_con_iva": int(d * factor_total * (1 + IVA)),
+            }
+            for p, d in zip(PERCENTILES, cuantiles.tolist())
+        },
+        "media_total_estimado": int(directo.mean() * factor_total),
+        # Contingencia sobre costo directo para cubrir el P80 (vs imprevistos fijo)
+        "contingencia_p80_pct": round((cuantiles[1] / base - 1) * 100, 2) if base else 0.0,
+        "imprevistos_actual_pct": dict((c, p) for c, p, *_ in COSTOS_INDIRECTOS)["imprevistos"] * 100,
+        "categorias": sorted(
+            (
+                {
+                    "categoria": nombre,
+                    "base": int(b),
+                    "media": int(m),
+                    "p80": int(p),
+                    "aporte_varianza": round(a, 4),
+                }
+                for nombre, b, m, p, a in zip(nombres, base_categoria.tolist(), medias.tolist(),
+                                              p80_categoria.tolist(), aportes.tolist())
+            ),
+            key=lambda c: -c["aporte_varianza"],
+        ),
+        "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 1),
+    }
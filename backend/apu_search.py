@@ -0,0 +1,410 @@
+"""
+ARKITECTO AI - Indices de busqueda del catalogo APU
+Se construyen una sola vez al cargar el catalogo, de modo que cada
+busqueda cuesta en proporcion a la consulta y no al tamano del catalogo.
+"""
+import heapq
+import re
+import unicodedata
+from collections import Counter, defaultdict, deque
+from typing import NamedTuple
+
+import numpy as np
+
+# Largo minimo de palabra para buscar en descripciones (antes: len(palabra) > 3)
+LARGO_MIN_PALABRA = 4
+
+# Parametros BM25 (valores habituales) y bonificacion por categoria detectada
+BM25_K1 = 1.2
+BM25_B = 0.75
+PESO_CATEGORIA = 1.0
+
+# Similitud minima (Jaccard de trigramas) entre una palabra de la consulta y
+# una palabra del catalogo para considerarlas la misma palabra mal escrita
+UMBRAL_TRIGRAMAS = 0.3
+
+_RE_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto: str) -> str:
+    """Minusculas y sin acentos ("Baño" -> "bano", "m²" -> "m2")."""
+    texto = texto.lower()
+    if texto.isascii():
+        return texto
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+
+
+def tokenizar(texto: str) -> list:
+    """Divide un texto normalizado en tokens alfanumericos."""
+    return _RE_TOKEN.findall(normalizar(texto))
+
+
+def _a_csr(listas: list, dtype) -> tuple:
+    """Listas de enteros/reales -> (indptr, datos) concatenados, para snapshots binarios."""
+    indptr = np.zeros(len(listas) + 1, dtype=np.int64)
+    np.cumsum([len(l) for l in listas], out=indptr[1:])
+    datos = np.concatenate(listas).astype(dtype) if listas else np.zeros(0, dtype=dtype)
+    return indptr, datos
+
+
+def _desde_csr(indptr: np.ndarray, datos: np.ndarray) -> list:
+    """Inverso de _a_csr: vistas (sin copia) sobre datos."""
+    limites = indptr.tolist()
+    return [datos[a:b] for a, b in zip(limites, limites[1:])]
+
+
+def trigramas(palabra: str) -> set:
+    """Trigramas de caracteres de una palabra, con relleno estilo pg_trgm ("  bano ")."""
+    palabra = f"  {palabra} "
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+class IndiceTrigramas:
+    """
+    Indice de trigramas sobre el vocabulario (palabras normalizadas, sin
+    acentos) de las descripciones. Cada palabra de la consulta se compara
+    con las palabras del catalogo, asi "ceramcia" se reconoce como
+    "ceramica" aunque la descripcion sea larga. Los conteos se hacen con
+    numpy sobre las listas de postings de los trigramas de la consulta.
+    """
+
+    def __init__(self, textos: list):
+        filas_por_palabra = defaultdict(set)
+        for fila, texto in enumerate(textos):
+            for token in tokenizar(texto):
+                filas_por_palabra[token].add(fila)
+
+        self.vocabulario = list(filas_por_palabra)
+        self.filas_por_palabra = [
+            np.array(sorted(filas_por_palabra[p]), dtype=np.int32) for p in self.vocabulario
+        ]
+        self.total_filas = len(textos)
+
+        postings = defaultdict(list)
+        largos = []
+        for id_palabra, palabra in enumerate(self.vocabulario):
+            tris = trigramas(palabra)
+            largos.append(len(tris))
+            for tri in tris:
+                postings[tri].append(id_palabra)
+        self.postings = {tri: np.array(ids, dtype=np.int32) for tri, ids in postings.items()}
+        self.largos = np.array(largos, dtype=np.int32)
+
+    def a_binario(self) -> tuple:
+        """(meta, arreglos) para apu_binario; ver desde_binario."""
+        claves = list(self.postings)
+        indptr_filas, filas = _a_csr(self.filas_por_palabra, np.int32)
+        indptr_tris, ids = _a_csr([self.postings[t] for t in claves], np.int32)
+        meta = {"vocabulario": self.vocabulario, "trigramas": claves, "total_filas": self.total_filas}
+        return meta, {
+            "indptr_filas": indptr_filas, "filas": filas,
+            "indptr_trigramas": indptr_tris, "ids": ids, "largos": self.largos,
+        }
+
+    @classmethod
+    def desde_binario(cls, meta: dict, arreglos: dict) -> "IndiceTrigramas":
+        indice = cls.__new__(cls)
+        indice.vocabulario = meta["vocabulario"]
+        indice.filas_por_palabra = _desde_csr(arreglos["indptr_filas"], arreglos["filas"])
+        indice.total_filas = meta["total_filas"]
+        indice.postings = dict(zip(
+            meta["trigramas"], _desde_csr(arreglos["indptr_trigramas"], arreglos["ids"])
+        ))
+        indice.largos = arreglos["largos"]
+        return indice
+
+    def palabras_similares(self, palabra: str, umbral: float = UMBRAL_TRIGRAMAS) -> list:
+        """Palabras del vocabulario con similitud >= umbral, como [(id_palabra, similitud)]."""
+        tris = trigramas(palabra)
+        listas = [self.postings[t] for t in tris if t in self.postings]
+        if not listas:
+            return []
+        comunes = np.bincount(np.concatenate(listas), minlength=len(self.vocabulario))
+        ids = np.flatnonzero(comunes)
+        similitud = comunes[ids] / (len(tris) + self.largos[ids] - comunes[ids])
+        aceptadas = similitud >= umbral
+        return list(zip(ids[aceptadas].tolist(), similitud[aceptadas].tolist()))
+
+    def buscar(self, consulta: str, k: int = 10, umbral: float = UMBRAL_TRIGRAMAS) -> list:
+        """
+        Las k filas mas similares como [(fila, similitud)], de mayor a menor.
+        La similitud de una fila es el promedio, sobre las palabras de la
+        consulta, de la mejor similitud de cada una dentro de la descripcion.
+        """
+        palabras = [t for t in tokenizar(consulta) if len(t) >= 3]
+        if not palabras:
+            return []
+
+        puntaje = np.zeros(self.total_filas)
+        for palabra in palabras:
+            mejor = np.zeros(self.total_filas)
+            for id_palabra, similitud in self.palabras_similares(palabra, umbral):
+                filas = self.filas_por_palabra[id_palabra]
+                mejor[filas] = np.maximum(mejor[filas], similitud)
+            puntaje += mejor
+        puntaje /= len(palabras)
+
+        candidatas = np.flatnonzero(puntaje)
+        if len(candidatas) > k:
+            candidatas = candidatas[np.argpartition(-puntaje[candidatas], k - 1)[:k]]
+        orden = np.lexsort((candidatas, -puntaje[candidatas]))
+        return [(int(candidatas[i]), float(puntaje[candidatas[i]])) for i in orden]
+
+
+class IndiceBM25:
+    """
+    Ranking BM25 sobre los prefijos de las descripciones. IDF, largo de
+    cada descripcion y el aporte de cada posting se calculan una vez al
+    cargar el catalogo; puntuar una consulta es sumar arreglos numpy.
+    """
+
+    def __init__(self, prefijos: dict, largos: list):
+        self.total_filas = len(largos)
+        largos = np.array(largos, dtype=np.float64)
+        promedio = largos.mean() if len(largos) else 1.0
+        normas = BM25_K1 * (1 - BM25_B + BM25_B * largos / max(promedio, 1.0))
+
+        self.postings = {}
+        for prefijo, frecuencias in prefijos.items():
+            filas = np.fromiter(sorted(frecuencias), dtype=np.int32, count=len(frecuencias))
+            tf = np.array([frecuencias[f] for f in filas.tolist()], dtype=np.float64)
+            df = len(filas)
+            idf = np.log(1 + (self.total_filas - df + 0.5) / (df + 0.5))
+            pesos = idf * tf * (BM25_K1 + 1) / (tf + normas[filas])
+            self.postings[prefijo] = (filas, pesos.astype(np.float32))
+
+    def a_binario(self) -> tuple:
+        """(meta, arreglos) para apu_binario; ver desde_binario."""
+        claves = list(self.postings)
+        indptr, filas = _a_csr([self.postings[p][0] for p in claves], np.int32)
+        _, pesos = _a_csr([self.postings[p][1] for p in claves], np.float32)
+        meta = {"prefijos": claves, "total_filas": self.total_filas}
+        return meta, {"indptr": indptr, "filas": filas, "pesos": pesos}
+
+    @classmethod
+    def desde_binario(cls, meta: dict, arreglos: dict) -> "IndiceBM25":
+        indice = cls.__new__(cls)
+        indice.total_filas = meta["total_filas"]
+        indice.postings = dict(zip(meta["prefijos"], zip(
+            _desde_csr(arreglos["indptr"], arreglos["filas"]),
+            _desde_csr(arreglos["indptr"], arreglos["pesos"]),
+        )))
+        return indice
+
+    def puntajes(self, consulta: str, filas_categoria: list = ()) -> np.ndarray:
+        """
+        Puntaje BM25 de cada fila; las filas de categorias detectadas
+        (rangos contiguos) suman PESO_CATEGORIA.
+        """
+        puntaje = np.zeros(self.total_filas, dtype=np.float32)
+        for token in set(tokenizar(consulta)):
+            if len(token) >= LARGO_MIN_PALABRA and token in self.postings:
+                filas, pesos = self.postings[token]
+                puntaje[filas] += pesos
+        for filas in filas_categoria:
+            puntaje[filas.start:filas.stop] += PESO_CATEGORIA
+        return puntaje
+
+    def mejores(self, consulta: str, k: int, filas_categoria: list = ()) -> list:
+        """Las k filas con mayor puntaje (> 0), de mayor a menor; empates por orden de catalogo."""
+        puntaje = self.puntajes(consulta, filas_categoria)
+        candidatas = np.flatnonzero(puntaje)
+        if len(candidatas) > k:
+            candidatas = candidatas[np.argpartition(-puntaje[candidatas], k - 1)[:k]]
+        orden = np.lexsort((candidatas, -puntaje[candidatas]))
+        return candidatas[orden].tolist()
+
+
+class CalceKeyword(NamedTuple):
+    inicio: int      # posicion en el texto normalizado
+    fin: int
+    keyword: str
+    categoria: str
+    orden: int       # posicion de la keyword en KEYWORD_MAPPING
+
+
+class AutomataKeywords:
+    """
+    Automata Aho-Corasick sobre las keywords de KEYWORD_MAPPING.
+    Encuentra todas las keywords de un texto en una sola pasada lineal,
+    sin importar cuantas keywords existan. Solo se aceptan calces que
+    empiezan al inicio de una palabra ("lana" no calza en "porcelanato").
+    """
+
+    def __init__(self, keywords: dict):
+        self._goto = [{}]
+        self._fail = [0]
+        self._salida = [[]]     # estado -> [(largo, keyword, categoria, orden)]
+
+        for orden, (keyword, categoria) in enumerate(keywords.items()):
+            patron = normalizar(keyword)
+            if not patron:
+                continue
+            estado = 0
+            for c in patron:
+                siguiente = self._goto[estado].get(c)
+                if siguiente is None:
+                    siguiente = len(self._goto)
+                    self._goto[estado][c] = siguiente
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._salida.append([])
+                estado = siguiente
+            self._salida[estado].append((len(patron), keyword, categoria, orden))
+
+        # Enlaces de falla por BFS; las salidas heredan las de su sufijo
+        cola = deque(self._goto[0].values())
+        while cola:
+            estado = cola.popleft()
+            for c, siguiente in self._goto[estado].items():
+                cola.append(siguiente)
+                falla = self._fail[estado]
+                while falla and c not in self._goto[falla]:
+                    falla = self._fail[falla]
+                destino = self._goto[falla].get(c, 0)
+                self._fail[siguiente] = destino if destino != siguiente else 0
+                self._salida[siguiente] = self._salida[siguiente] + self._salida[self._fail[siguiente]]
+
+        # Transiciones completas (DFA): la busqueda no necesita seguir fallas
+        alfabeto = set(self._goto[0])
+        for transiciones in self._goto:
+            alfabeto.update(transiciones)
+        self._delta = [dict(t) for t in self._goto]
+        orden_bfs = [0]
+        for estado in orden_bfs:
+            orden_bfs.extend(self._goto[estado].values())
+        for estado in orden_bfs[1:]:
+            falla = self._delta[self._fail[estado]]
+            delta = self._delta[estado]
+            for c in alfabeto:
+                if c not in delta and c in falla:
+                    delta[c] = falla[c]
+
+    def a_binario(self) -> tuple:
+        """(meta, arreglos) para apu_binario: transiciones del DFA en formato CSR."""
+        indptr, destinos = _a_csr([list(t.values()) for t in self._delta], np.int32)
+        caracteres = np.array([ord(c) for t in self._delta for c in t], dtype=np.int32)
+        return {"salida": self._salida}, {"indptr": indptr, "caracteres": caracteres, "destinos": destinos}
+
+    @classmethod
+    def desde_binario(cls, meta: dict, arreglos: dict) -> "AutomataKeywords":
+        automata = cls.__new__(cls)
+        caracteres = list(map(chr, arreglos["caracteres"].tolist()))
+        destinos = arreglos["destinos"].tolist()
+        limites = arreglos["indptr"].tolist()
+        automata._delta = [
+            dict(zip(caracteres[a:b], destinos[a:b])) for a, b in zip(limites, limites[1:])
+        ]
+        automata._salida = [[tuple(s) for s in salidas] for salidas in meta["salida"]]
+        return automata
+
+    def buscar(self, texto: str) -> list:
+        """Todos los calces de keywords en el texto, ordenados por posicion."""
+        texto = normalizar(texto)
+        delta, salida = self._delta, self._salida
+        calces = []
+        estado = 0
+        for fin, c in enumerate(texto, 1):
+            estado = delta[estado].get(c, 0)
+            if not salida[estado]:
+                continue
+            for largo, keyword, categoria, orden in salida[estado]:
+                inicio = fin - largo
+                if inicio == 0 or not texto[inicio - 1].isalnum():
+                    calces.append(CalceKeyword(inicio, fin, keyword, categoria, orden))
+        calces.sort()
+        return calces
+
+
+class IndiceCatalogo:
+    """
+    Indices de busqueda sobre un CatalogoCompacto (ver apu_catalog).
+    Cada item queda identificado por su fila (orden de insercion en el
+    catalogo), asi las busquedas devuelven resultados en el mismo orden
+    que el recorrido lineal original.
+    """
+
+    def __init__(self, catalogo, keywords: dict):
+        self._enlazar(catalogo)
+        prefijos = defaultdict(Counter)   # prefijo -> {fila: frecuencia}
+        largos = []                       # fila -> cantidad de tokens
+        descripciones = [catalogo.desc(fila) for fila in range(len(catalogo))]
+
+        for fila, desc in enumerate(descripciones):
+            # Cada prefijo util de cada token apunta a la fila
+            tokens = tokenizar(desc)
+            largos.append(len(tokens))
+            for token in tokens:
+                for largo in range(LARGO_MIN_PALABRA, len(token) + 1):
+                    prefijos[token[:largo]][fila] += 1
+
+        # Postings ordenados por fila (orden del catalogo) con sus pesos BM25
+        # precalculados; sirven a la busqueda por texto y al ranking
+        self.bm25 = IndiceBM25(prefijos, largos)
+
+        # Trigramas para consultas con errores de tipeo
+        self.trigramas = IndiceTrigramas(descripciones)
+
+        # Keywords de categoria (solo las que apuntan a categorias existentes)
+        self.automata = AutomataKeywords(
+            {kw: cat_key for kw, cat_key in keywords.items() if cat_key in self.filas_por_categoria}
+        )
+
+    def _enlazar(self, catalogo):
+        self.catalogo = catalogo
+        # Las filas de cada categoria son contiguas: cat_key -> range(inicio, fin)
+        self.filas_por_categoria = {
+            cat_key: catalogo.rango_categoria(cat_key) for cat_key in catalogo.categorias
+        }
+
+    def a_binario(self) -> tuple:
+        """(meta, arreglos) de los tres indices, con nombres de arreglo prefijados."""
+        meta, arreglos = {}, {}
+        for nombre in ("bm25", "trigramas", "automata"):
+            meta[nombre], partes = getattr(self, nombre).a_binario()
+            arreglos.update({f"{nombre}.{clave}": arreglo for clave, arreglo in partes.items()})
+        return meta, arreglos
+
+    @classmethod
+    def desde_binario(cls, catalogo, meta: dict, arreglos: dict) -> "IndiceCatalogo":
+        """Indices leidos de un snapshot binario, sin tokenizar ni recalcular nada."""
+        indice = cls.__new__(cls)
+        indice._enlazar(catalogo)
+        for nombre, tipo in (("bm25", IndiceBM25), ("trigramas", IndiceTrigramas),
+                             ("automata", AutomataKeywords)):
+            prefijo = f"{nombre}."
+            partes = {k[len(prefijo):]: v for k, v in arreglos.items() if k.startswith(prefijo)}
+            setattr(indice, nombre, tipo.desde_binario(meta[nombre], partes))
+        return indice
+
+    def categorias_por_keyword(self, consulta: str, calces: list = None) -> list:
+        """
+        Categorias cuyas keywords aparecen en la consulta, en el orden de
+        KEYWORD_MAPPING. Acepta calces ya calculados para no recorrer el
+        texto dos veces.
+        """
+        if calces is None:
+            calces = self.automata.buscar(consulta)
+        categorias = []
+        for calce in sorted(calces, key=lambda c: c.orden):
+            # Calces de otra version del catalogo pueden nombrar categorias que aqui no existen
+            if calce.categoria not in categorias and calce.categoria in self.filas_por_categoria:
+                categorias.append(calce.categoria)
+        return categorias
+
+    def filas_por_texto(self, consulta: str):
+        """
+        Filas cuya descripcion contiene una palabra que empieza con algun token
+        de la consulta. Mezcla perezosa de las listas de postings (ya ordenadas),
+        asi quien consume solo los primeros resultados no recorre el resto.
+        """
+        postings = self.bm25.postings
+        postings = [
+            postings[token][0].tolist() for token in set(tokenizar(consulta))
+            if len(token) >= LARGO_MIN_PALABRA and token in postings
+        ]
+        anterior = None
+        for fila in heapq.merge(*postings):
+            if fila != anterior:
+                anterior = fila
+                yield fila
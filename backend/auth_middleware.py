@@ -1,14 +1,17 @@
+import asyncio
 from typing import Callable
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response, JSONResponse
 from firebase_admin import auth
 
+import usage_meter
+
 # List of paths that do not require authentication
 PUBLIC_PATHS = [
     "/docs", "/openapi.json", "/",
-    "/analyze_budget", "/generate_sketch",
-    "/suggestions", "/categories",
+    "/analyze_budget", "/analyze_budget/stream", "/analyze_budget/batch", "/analyze_budget/lines", "/generate_sketch",
+    "/budget/risk", "/suggestions", "/categories",
     "/export/pdf", "/export/excel", "/export/text"
 ]
 
@@ -16,19 +19,25 @@ PUBLIC_PATHS = [
 PUBLIC_PATH_PREFIXES = ["/search/"]
 
 class FirebaseAuthMiddleware(BaseHTTPMiddleware):
+    """
+    Verifies the Firebase ID token (required outside PUBLIC_PATHS, optional
+    inside them) and binds the endpoint and uid for usage metering.
+    Token verification (RSA, occasionally a certificate fetch) runs in a
+    thread so it never blocks the event loop.
+    """
+
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         # Allow OPTIONS requests (CORS preflight)
         if request.method == "OPTIONS":
             return await call_next(request)
 
         # Check if the path is public
-        if request.url.path in PUBLIC_PATHS:
-            return await call_next(request)
-
-        # Check if the path starts with a public prefix
-        for prefix in PUBLIC_PATH_PREFIXES:
-            if request.url.path.startswith(prefix):
-                return await call_next(request)
+        if request.url.path in PUBLIC_PATHS or any(
+            request.url.path.startswith(prefix) for prefix in PUBLIC_PATH_PREFIXES
+        ):
+            # A token is optional here; if present, identify the user (usage metering, credits)
+            await self._attach_optional_user(request)
+            return await self._call_metered(request, call_next)
 
         auth_header = request.headers.get("Authorization")
         if not auth_header:
@@ -37,10 +46,26 @@ class FirebaseAuthMiddleware(BaseHTTPMiddleware):
         try:
             # Expecting "Bearer <token>"
             id_token = auth_header.split(" ")[1]
-            decoded_token = auth.verify_id_token(id_token)
+            decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token)
             request.state.user = decoded_token
         except Exception as e:
             return JSONResponse(status_code=401, content={"detail": f"Invalid authentication credentials: {str(e)}"})
 
-        response = await call_next(request)
-        return response
+        return await self._call_metered(request, call_next)
+
+    @staticmethod
+    async def _attach_optional_user(request: Request):
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return
+        try:
+            request.state.user = await asyncio.to_thread(auth.verify_id_token, auth_header.split(" ")[1])
+        except Exception:
+            pass
+
+    @staticmethod
+    async def _call_metered(request: Request, call_next: Callable) -> Response:
+        # AI calls made while handling the request are attributed to this endpoint / uid
+        user = getattr(request.state, "user", None) or {}
+        usage_meter.bind(request.url.path, user.get("uid"))
+        return await call_next(request)
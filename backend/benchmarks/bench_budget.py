@@ -0,0 +1,49 @@
+"""
+Benchmark del motor de presupuestos: N llamadas a calcular_presupuesto_completo
+vs una sola llamada vectorizada a calcular_presupuestos_lote, sobre variantes
+parametricas (mismas consultas, distintas areas y cantidades).
+
+Uso (desde backend/):
+    python benchmarks/bench_budget.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from apu_catalog import PROYECTOS_COMUNES, calcular_presupuesto_completo, calcular_presupuestos_lote
+
+
+def variantes(n: int) -> list:
+    """n solicitudes (consulta, area, cantidad) rotando los proyectos comunes."""
+    return [
+        (PROYECTOS_COMUNES[i % len(PROYECTOS_COMUNES)]["query"], 10.0 + i % 90, 1 + i % 5)
+        for i in range(n)
+    ]
+
+
+def medir_ms(fn) -> float:
+    inicio = time.perf_counter()
+    fn()
+    return (time.perf_counter() - inicio) * 1000
+
+
+def main():
+    print(f"{'variantes':>10}{'escalar ms':>12}{'lote ms':>10}{'solo totales ms':>17}")
+    for n in (10, 100, 500, 2000):
+        solicitudes = variantes(n)
+        escalar = medir_ms(lambda: [calcular_presupuesto_completo(q, area=a, cantidad=c) for q, a, c in solicitudes])
+        lote = medir_ms(lambda: calcular_presupuestos_lote(solicitudes))
+        totales = medir_ms(lambda: calcular_presupuestos_lote(solicitudes, incluir_items=False))
+
+        # Los dos caminos deben dar los mismos totales
+        esperado = [calcular_presupuesto_completo(q, area=a, cantidad=c)["total_estimado"] for q, a, c in solicitudes[:20]]
+        obtenido = [p["total_estimado"] for p in calcular_presupuestos_lote(solicitudes[:20], incluir_items=False)]
+        assert esperado == obtenido
+
+        print(f"{n:>10}{escalar:>12.1f}{lote:>10.1f}{totales:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
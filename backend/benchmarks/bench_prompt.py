@@ -0,0 +1,115 @@
+"""
+Prompt del wizard antes/despues de incluir las partidas APU relevantes.
+Sin argumentos compara el tamano de los prompts (tokens estimados como
+caracteres / 4). Con --live llama a Gemini con ambos y reporta tokens
+reales (usage_metadata), latencia y si la respuesta trae JSON valido.
+
+Uso (desde backend/):
+    python benchmarks/bench_prompt.py
+    python benchmarks/bench_prompt.py --live --model gemini-1.5-flash
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from prompts.wizard_prompt import LOICA_REFERENCE, build_wizard_prompt
+
+# Prompt anterior (sin catalogo), congelado para comparar
+PROMPT_ANTERIOR = """
+Eres un experto en presupuestación de construcción en Chile.
+
+{loica}
+
+PROYECTO DEL USUARIO:
+- Tipo: {type}
+- Dimensiones: {dimensions}
+- Calidad: {quality}
+- Detalles: {details}
+- Ubicación: {location}
+
+INSTRUCCIONES:
+1. Genera un presupuesto DETALLADO similar al ejemplo LOICA
+2. Incluye TODAS las partidas necesarias del catálogo APU
+3. Considera la calidad solicitada:
+   - Económico: materiales básicos, -20% en precios
+   - Estándar: precios normales APU
+   - Premium: materiales premium, +30% en precios
+4. Ajusta por ubicación si es necesario
+5. Incluye:
+   - Movimiento de tierras
+   - Fundaciones
+   - Estructura
+   - Instalaciones
+   - Terminaciones
+   - Imprevistos (10%)
+
+FORMATO DE SALIDA: JSON con estructura Budget
+"""
+
+PROYECTOS = [
+    {"type": "Quincho", "dimensions": "30 m2", "quality": "Estándar",
+     "details": "parrilla y cubierta de teja", "location": "Santiago"},
+    {"type": "Casa", "dimensions": "80 m2", "quality": "Premium",
+     "details": "dos pisos, porcelanato y termopaneles", "location": "Concepción"},
+    {"type": "Bodega", "dimensions": "120 m2", "quality": "Económico",
+     "details": "estructura metalica y radier", "location": "Antofagasta"},
+]
+
+
+def prompts(proyecto: dict) -> dict:
+    return {
+        "anterior": PROMPT_ANTERIOR.format(loica=LOICA_REFERENCE, **proyecto),
+        "con APU": build_wizard_prompt(proyecto),
+    }
+
+
+def tiene_json(texto: str) -> bool:
+    match = re.search(r'```json\n({.*?})\n```', texto, re.DOTALL)
+    try:
+        return bool(match) and isinstance(json.loads(match.group(1)), dict)
+    except ValueError:
+        return False
+
+
+async def en_vivo(modelo: str):
+    import ai_client
+    import vertexai
+    from main import PROJECT_ID, LOCATION
+    vertexai.init(project=PROJECT_ID, location=LOCATION)
+
+    print(f"{'proyecto':<10}{'prompt':<10}{'tok in':>8}{'tok out':>9}{'ms':>8}  json")
+    for proyecto in PROYECTOS:
+        for nombre, prompt in prompts(proyecto).items():
+            inicio = time.perf_counter()
+            respuesta = await ai_client.generate_content(modelo, prompt, timeout=120)
+            ms = (time.perf_counter() - inicio) * 1000
+            uso = respuesta.usage_metadata
+            print(f"{proyecto['type']:<10}{nombre:<10}{uso.prompt_token_count:>8}"
+                  f"{uso.candidates_token_count:>9}{ms:>8.0f}  {'si' if tiene_json(respuesta.text) else 'no'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--live", action="store_true", help="Llamar a Gemini (requiere credenciales)")
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+
+    if args.live:
+        asyncio.run(en_vivo(args.model))
+        return
+
+    print(f"{'proyecto':<10}{'prompt':<10}{'caracteres':>11}{'~tokens':>9}{'partidas':>10}")
+    for proyecto in PROYECTOS:
+        for nombre, prompt in prompts(proyecto).items():
+            partidas = len(re.findall(r"^[A-Z]+-\d+\|", prompt, re.MULTILINE))
+            print(f"{proyecto['type']:<10}{nombre:<10}{len(prompt):>11}{len(prompt) // 4:>9}{partidas:>10}")
+
+
+if __name__ == "__main__":
+    main()
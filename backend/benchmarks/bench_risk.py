@@ -0,0 +1,48 @@
+"""
+Benchmark de la simulacion Monte Carlo de riesgo (apu_riesgo.simular_riesgo)
+por numero de lineas del presupuesto y de simulaciones. Objetivo
+interactivo: 100k simulaciones de un presupuesto de 50 lineas < 200 ms.
+
+Uso (desde backend/):
+    python benchmarks/bench_risk.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from apu_catalog import PROYECTOS_COMUNES, calcular_presupuesto_completo
+from apu_riesgo import simular_riesgo
+
+
+def lineas(n: int) -> list:
+    """n lineas de costo directo tomadas de los presupuestos de los proyectos comunes."""
+    items = []
+    while len(items) < n:
+        for proyecto in PROYECTOS_COMUNES:
+            presupuesto = calcular_presupuesto_completo(proyecto["query"], area=40)
+            items += [i for i in presupuesto["items"] if i["categoria"] != "Costos Indirectos"]
+    return items[:n]
+
+
+def medir_ms(fn, repeticiones: int = 3) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        mejor = min(mejor, (time.perf_counter() - inicio) * 1000)
+    return mejor
+
+
+def main():
+    print(f"{'lineas':>8}{'10k ms':>10}{'100k ms':>10}{'1M ms':>10}")
+    for n in (10, 50, 200):
+        items = lineas(n)
+        tiempos = [medir_ms(lambda: simular_riesgo(items, simulaciones=s, semilla=1), 1 if s > 100_000 else 3)
+                   for s in (10_000, 100_000, 1_000_000)]
+        print(f"{n:>8}" + "".join(f"{t:>10.1f}" for t in tiempos))
+
+
+if __name__ == "__main__":
+    main()
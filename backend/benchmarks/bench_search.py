@@ -0,0 +1,155 @@
+"""
+Benchmark de busqueda APU: recorrido lineal original vs indice invertido.
+Mide la latencia por consulta a medida que el catalogo crece desde el
+catalogo base (~200 partidas) hasta miles de partidas Ondac.
+
+Uso (desde backend/):
+    python benchmarks/bench_search.py
+"""
+import json
+import sys
+import time
+import tracemalloc
+from itertools import chain
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from apu_catalog import (
+    APU_CATALOG, KEYWORD_MAPPING, PROYECTOS_COMUNES, CatalogoCompacto,
+    cargar_apus_ondac, fusionar_catalogos
+)
+from apu_search import IndiceCatalogo
+
+ONDAC_JSON = Path(__file__).resolve().parents[2] / "data" / "apu_scan_full.json"
+
+CONSULTAS = [p["query"] for p in PROYECTOS_COMUNES] + [
+    "bano 6m2", "albanileria ladrillo fiscal", "pintura latex interior",
+    "excavacion zanja", "porcelanato", "moldaje losa", "xyzzy",
+]
+
+# Consultas de autocompletado con errores de tipeo y acentos (indice de trigramas)
+CONSULTAS_TIPEO = ["ceramcia", "hormigón", "baño", "porcelanto", "exacavacion", "albañileria", "ventnaa"]
+
+
+def buscar_lineal(catalogo: dict, consulta: str, max_resultados: int = 8) -> list:
+    """Copia del algoritmo original de buscar_apus (referencia)."""
+    consulta_lower = consulta.lower()
+    resultados = []
+    categorias_encontradas = set()
+    for keyword, categoria in KEYWORD_MAPPING.items():
+        if keyword in consulta_lower and categoria not in categorias_encontradas:
+            if categoria in catalogo:
+                categorias_encontradas.add(categoria)
+                for item in catalogo[categoria]["items"]:
+                    item_copy = item.copy()
+                    item_copy["categoria"] = catalogo[categoria]["nombre"]
+                    resultados.append(item_copy)
+    if not resultados:
+        for categoria in catalogo.values():
+            for item in categoria["items"]:
+                desc_lower = item["desc"].lower()
+                for palabra in consulta_lower.split():
+                    if len(palabra) > 3 and palabra in desc_lower:
+                        item_copy = item.copy()
+                        item_copy["categoria"] = categoria["nombre"]
+                        if item_copy not in resultados:
+                            resultados.append(item_copy)
+    vistos = set()
+    unicos = []
+    for item in resultados:
+        if item["codigo"] not in vistos:
+            vistos.add(item["codigo"])
+            unicos.append(item)
+    return unicos[:max_resultados]
+
+
+def buscar_indice(indice: IndiceCatalogo, consulta: str, max_resultados: int = 8) -> list:
+    """Mismo flujo que apu_catalog.buscar_apus, sobre un indice arbitrario."""
+    resultados = []
+    vistos = set()
+    categorias = indice.categorias_por_keyword(consulta)
+    if categorias:
+        filas = chain.from_iterable(indice.filas_por_categoria[c] for c in categorias)
+    else:
+        filas = indice.filas_por_texto(consulta)
+    for fila in filas:
+        if len(resultados) >= max_resultados:
+            break
+        if fila not in vistos:
+            vistos.add(fila)
+            resultados.append(indice.catalogo.item(fila))
+    return resultados
+
+
+def escalar(catalogo: dict, factor: int) -> dict:
+    """Replica las partidas con codigos distintos para simular un catalogo mayor."""
+    return {
+        cat_key: {
+            "nombre": cat["nombre"],
+            "items": [
+                dict(item, codigo=f"{item['codigo']}#{copia}")
+                for copia in range(factor) for item in cat["items"]
+            ],
+        }
+        for cat_key, cat in catalogo.items()
+    }
+
+
+def medir(fn, repeticiones: int, consultas: list = CONSULTAS) -> float:
+    """Latencia media por consulta en microsegundos."""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for consulta in consultas:
+            fn(consulta)
+    return (time.perf_counter() - inicio) / (repeticiones * len(consultas)) * 1e6
+
+
+def memoria_kb(catalogo: dict, compacto: bool) -> float:
+    """KB que quedan vivos (tracemalloc) tras cargar el catalogo desde JSON."""
+    serializado = json.dumps(catalogo)
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    estructura = json.loads(serializado)
+    if compacto:
+        estructura = CatalogoCompacto.desde_dict(estructura)
+    usados = tracemalloc.get_traced_memory()[0] - antes
+    tracemalloc.stop()
+    del estructura
+    return usados / 1024
+
+
+def main():
+    ondac = cargar_apus_ondac(str(ONDAC_JSON))
+    completo = fusionar_catalogos(APU_CATALOG, ondac)
+    escenarios = [
+        ("base", APU_CATALOG),
+        ("base+ondac", completo),
+        ("x5", escalar(completo, 5)),
+        ("x20", escalar(completo, 20)),
+    ]
+
+    print(f"{'catalogo':<12}{'items':>8}{'build ms':>10}{'lineal us':>12}{'indice us':>12}{'speedup':>9}"
+          f"{'bm25 us':>10}{'trigram us':>12}")
+    for nombre, catalogo in escenarios:
+        items = sum(len(c["items"]) for c in catalogo.values())
+        inicio = time.perf_counter()
+        indice = IndiceCatalogo(CatalogoCompacto.desde_dict(catalogo), KEYWORD_MAPPING)
+        build_ms = (time.perf_counter() - inicio) * 1000
+        lineal = medir(lambda q: buscar_lineal(catalogo, q), 3)
+        rapido = medir(lambda q: buscar_indice(indice, q), 200)
+        bm25 = medir(lambda q: indice.bm25.mejores(q, 8), 200)
+        tipeo = medir(lambda q: indice.trigramas.buscar(q, 10), 200, CONSULTAS_TIPEO)
+        print(f"{nombre:<12}{items:>8}{build_ms:>10.1f}{lineal:>12.1f}{rapido:>12.1f}{lineal / rapido:>8.0f}x"
+              f"{bm25:>10.1f}{tipeo:>12.1f}")
+
+
+    print(f"\n{'catalogo':<12}{'dicts KB':>10}{'compacto KB':>13}")
+    for nombre, catalogo in escenarios:
+        dicts = memoria_kb(catalogo, compacto=False)
+        compacto = memoria_kb(catalogo, compacto=True)
+        print(f"{nombre:<12}{dicts:>10.0f}{compacto:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark de arranque: tiempo hasta tener el catalogo listo (datos +
+indices) en un proceso nuevo, cargando desde JSON (parseo + construccion
+de indices) vs desde el snapshot binario (mmap). Cada modo corre en
+procesos separados para medir un arranque en frio real del worker.
+
+Uso (desde backend/):
+    python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+from apu_catalog import APU_CATALOG, cargar_catalogo, construir_snapshot, guardar_snapshot_binario
+
+ONDAC_JSON = BACKEND.parent / "data" / "apu_scan_full.json"
+REPETICIONES = 7
+
+# Mide dentro del proceso hijo: import de numpy aparte, luego el catalogo
+_MEDIR = """
+import json, time
+import numpy
+inicio = time.perf_counter()
+import apu_catalog
+total = (time.perf_counter() - inicio) * 1000
+print(json.dumps({"import_ms": total, "carga_ms": apu_catalog.CARGA_INICIAL_MS,
+                  "version": apu_catalog.version_catalogo()}))
+"""
+
+
+def medir(ruta) -> dict:
+    env = dict(os.environ)
+    env.pop("APU_CATALOG_PATH", None)
+    if ruta:
+        env["APU_CATALOG_PATH"] = str(ruta)
+    corridas = []
+    for _ in range(REPETICIONES):
+        salida = subprocess.run([sys.executable, "-c", _MEDIR], cwd=BACKEND, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        corridas.append(json.loads(salida.strip().splitlines()[-1]))
+    return {
+        "import_ms": statistics.median(c["import_ms"] for c in corridas),
+        "carga_ms": statistics.median(c["carga_ms"] for c in corridas),
+        "version": corridas[0]["version"],
+    }
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        escenarios = [("base (APU_CATALOG)", None, "builtin")]
+        if ONDAC_JSON.exists():
+            escenarios.append(("base+ondac", ONDAC_JSON, str(ONDAC_JSON)))
+
+        print(f"{'catalogo':<20}{'modo':<10}{'carga ms':>10}{'import ms':>11}{'KB':>8}")
+        for nombre, fuente, origen in escenarios:
+            datos = cargar_catalogo(str(fuente)) if fuente else APU_CATALOG
+            snapshot = construir_snapshot(datos, origen)
+            binario = Path(tmp) / f"{snapshot.version}.apusnap"
+            guardar_snapshot_binario(snapshot, str(binario))
+
+            json_ = medir(fuente)
+            snap = medir(binario)
+            assert json_["version"] == snap["version"] == snapshot.version
+            tam_json = fuente.stat().st_size / 1024 if fuente else 0
+            modo = "json" if fuente else "dict"
+            print(f"{nombre:<20}{modo:<10}{json_['carga_ms']:>10.1f}{json_['import_ms']:>11.1f}{tam_json:>8.0f}")
+            print(f"{'':<20}{'snapshot':<10}{snap['carga_ms']:>10.1f}{snap['import_ms']:>11.1f}"
+                  f"{binario.stat().st_size / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
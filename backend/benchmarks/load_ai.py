@@ -0,0 +1,240 @@
+"""
+Prueba de carga de extremo a extremo de los endpoints con IA, sin red ni
+cuota: levanta el backend con AI_BACKEND=fake (fake_vertex) y lo ejercita
+con una mezcla de trafico realista durante --duration segundos con
+--concurrency clientes. Reporta por tipo de solicitud throughput, p50 /
+p95 / p99, errores HTTP y tasa de respaldo (presupuestos que terminaron en
+el generador offline porque ningun modelo respondio a tiempo), y al final
+el estado de los circuit breakers y del parser JSON.
+
+El perfil de fake_vertex (--profile: nominal, degraded, outage, JSON o
+archivo) fija latencias y tasas de error por modelo; --time-scale las
+acelera. La cache LLM y el registro de uso se desactivan para que cada
+solicitud llegue al modelo. Cada cliente usa su propio X-Forwarded-For
+para no chocar con el rate limit.
+
+Uso (desde backend/):
+    python benchmarks/load_ai.py
+    python benchmarks/load_ai.py --profile degraded --mix presupuestos --concurrency 40
+    python benchmarks/load_ai.py --profile outage --time-scale 0.2 --duration 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+from fake_vertex import png_bytes
+
+# Peso de cada tipo de solicitud en la mezcla
+MEZCLAS = {
+    "mixto": {"wizard": 50, "texto": 15, "stream": 15, "render_foto": 10, "render_texto": 10},
+    "presupuestos": {"wizard": 60, "texto": 20, "stream": 20},
+    "renders": {"render_foto": 60, "render_texto": 40},
+}
+
+PROYECTOS = [
+    ("Quincho", "30 m2", "Estándar", "parrilla y cubierta de teja"),
+    ("Casa", "80 m2", "Premium", "dos pisos, porcelanato y termopaneles"),
+    ("Bodega", "120 m2", "Económico", "estructura metalica y radier"),
+    ("Ampliacion", "25 m2", "Estándar", "dormitorio con bano"),
+]
+# Foto de obra subida a /generate_sketch
+FOTO = png_bytes(512)
+TEXTOS = ["radier 40 m2", "pintura interior 120 m2", "ceramica bano 12 m2", "cierre perimetral 60 ml"]
+
+_clientes = itertools.count(1)
+_solicitudes = itertools.count(1)
+
+
+def _cabeceras() -> dict:
+    n = next(_clientes)
+    return {"X-Forwarded-For": f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}"}
+
+
+def percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _es_respaldo(respuesta: dict) -> bool:
+    """Presupuesto del generador offline en vez del modelo."""
+    return "IA conversacional" not in (respuesta.get("analisis") or "")
+
+
+async def wizard(cliente: httpx.AsyncClient) -> bool:
+    # Detalle unico por solicitud: sin coalescing entre clientes
+    tipo, dimensiones, calidad, detalles = random.choice(PROYECTOS)
+    instruccion = (f"Tipo de proyecto: {tipo}\nDimensiones: {dimensiones}\nCalidad: {calidad}\n"
+                   f"Detalles: {detalles} #{next(_solicitudes)}\nUbicación: Santiago")
+    r = await cliente.post("/analyze_budget", json={"instruction": instruccion}, headers=_cabeceras())
+    r.raise_for_status()
+    return _es_respaldo(r.json())
+
+
+async def texto(cliente: httpx.AsyncClient) -> bool:
+    instruccion = f"{random.choice(TEXTOS)} ref {next(_solicitudes)}"
+    r = await cliente.post("/analyze_budget", json={"instruction": instruccion}, headers=_cabeceras())
+    r.raise_for_status()
+    return _es_respaldo(r.json())
+
+
+async def stream(cliente: httpx.AsyncClient) -> bool:
+    tipo, dimensiones, calidad, detalles = random.choice(PROYECTOS)
+    instruccion = (f"Tipo de proyecto: {tipo}\nDimensiones: {dimensiones}\nCalidad: {calidad}\n"
+                   f"Detalles: {detalles} #{next(_solicitudes)}\nUbicación: Santiago")
+    final = None
+    async with cliente.stream("POST", "/analyze_budget/stream", json={"instruction": instruccion},
+                              headers=_cabeceras()) as r:
+        r.raise_for_status()
+        evento = None
+        async for linea in r.aiter_lines():
+            if linea.startswith("event: "):
+                evento = linea[7:]
+            elif linea.startswith("data: ") and evento == "final":
+                final = json.loads(linea[6:])
+    return final is None or final.get("source") == "offline"
+
+
+async def render_foto(cliente: httpx.AsyncClient) -> bool:
+    r = await cliente.post(
+        "/generate_sketch",
+        data={"prompt": f"bodega industrial moderna {next(_solicitudes)}"},
+        files={"image": ("obra.png", FOTO, "image/png")},
+        headers=_cabeceras(),
+    )
+    r.raise_for_status()
+    return False
+
+
+async def render_texto(cliente: httpx.AsyncClient) -> bool:
+    r = await cliente.post("/generate_sketch", data={"prompt": f"casa mediterranea {next(_solicitudes)}"},
+                           headers=_cabeceras())
+    r.raise_for_status()
+    return False
+
+
+SOLICITUDES = {"wizard": wizard, "texto": texto, "stream": stream,
+               "render_foto": render_foto, "render_texto": render_texto}
+# Los renders no tienen respaldo offline: solo cuentan como error
+CON_RESPALDO = {"wizard", "texto", "stream"}
+
+
+async def correr(url: str, mezcla: dict, duracion: float, concurrencia: int):
+    latencias = defaultdict(list)
+    respaldos = Counter()
+    errores = defaultdict(Counter)
+    tipos, pesos = list(mezcla), list(mezcla.values())
+
+    async with httpx.AsyncClient(base_url=url, timeout=120) as cliente:
+        salud = (await cliente.get("/")).json()
+        backend = salud.get("ai_models", {}).get("backend")
+        if backend != "fake":
+            sys.exit(f"El backend en {url} usa modelos '{backend}', no fake: se gastaria cuota")
+
+        fin = time.perf_counter() + duracion
+
+        async def usuario():
+            while time.perf_counter() < fin:
+                tipo = random.choices(tipos, pesos)[0]
+                inicio = time.perf_counter()
+                try:
+                    respaldo = await SOLICITUDES[tipo](cliente)
+                except httpx.HTTPStatusError as e:
+                    errores[tipo][str(e.response.status_code)] += 1
+                except httpx.HTTPError as e:
+                    errores[tipo][type(e).__name__] += 1
+                else:
+                    latencias[tipo].append((time.perf_counter() - inicio) * 1000)
+                    respaldos[tipo] += respaldo
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(usuario() for _ in range(concurrencia)))
+        transcurrido = time.perf_counter() - inicio
+        salud = (await cliente.get("/")).json()
+
+    print(f"\n{'solicitud':<14}{'ok':>6}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'respaldo':>10}  errores")
+    total = 0
+    for tipo in tipos:
+        valores = latencias[tipo]
+        fallos = ", ".join(f"{codigo}x{n}" for codigo, n in errores[tipo].most_common()) or "-"
+        total += len(valores) + sum(errores[tipo].values())
+        if not valores:
+            print(f"{tipo:<14}{0:>6}{'-':>8}{'-':>9}{'-':>9}{'-':>9}{'-':>10}  {fallos}")
+            continue
+        respaldo = f"{respaldos[tipo] / len(valores):.1%}" if tipo in CON_RESPALDO else "-"
+        print(f"{tipo:<14}{len(valores):>6}{len(valores) / transcurrido:>8.2f}"
+              f"{statistics.median(valores):>9.0f}{percentil(valores, 95):>9.0f}{percentil(valores, 99):>9.0f}"
+              f"{respaldo:>10}  {fallos}")
+    print(f"\nTotal: {total} solicitudes en {transcurrido:.1f}s ({total / transcurrido:.2f} req/s), "
+          f"{concurrencia} clientes")
+
+    print("\nCircuit breakers:")
+    for modelo, estado in salud["ai_models"]["breakers"].items():
+        print(f"  {modelo:<22}{estado['state']:<11}trips {estado['trips']:<4}rechazadas {estado['rejected']:<6}"
+              f"{estado['last_error'] or ''}")
+    print(f"Parser JSON: {salud['llm_parse']}")
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="Backend ya levantado con AI_BACKEND=fake (por defecto se levanta uno local)")
+    parser.add_argument("--profile", default="nominal", help="Perfil de fake_vertex: nombre, JSON o archivo")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Factor sobre las latencias del perfil")
+    parser.add_argument("--mix", choices=sorted(MEZCLAS), default="mixto")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de carga")
+    parser.add_argument("--concurrency", type=int, default=20, help="Clientes en paralelo")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    servidor = None
+    url = args.url
+    if not url:
+        puerto = puerto_libre()
+        url = f"http://127.0.0.1:{puerto}"
+        env = dict(os.environ, AI_BACKEND="fake", FAKE_AI_PROFILE=args.profile,
+                   FAKE_AI_TIME_SCALE=str(args.time_scale), FAKE_AI_SEED=str(args.seed),
+                   LLM_CACHE_PATH="", USAGE_DB_PATH="")
+        servidor = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--log-level", "warning"],
+            cwd=BACKEND, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+        )
+        for _ in range(300):
+            try:
+                httpx.get(f"{url}/", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+    try:
+        print(f"Perfil {args.profile} (x{args.time_scale}), mezcla {args.mix}: "
+              + ", ".join(f"{k} {v}%" for k, v in MEZCLAS[args.mix].items()))
+        asyncio.run(correr(url, MEZCLAS[args.mix], args.duration, args.concurrency))
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
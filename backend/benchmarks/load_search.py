@@ -0,0 +1,138 @@
+"""
+Prueba de carga: latencia de /search (autocompletado) con y sin 20
+generaciones de presupuesto con IA en curso. Con llamadas a Vertex que
+bloquean el event loop, el p99 de /search sube al tiempo de una llamada
+al modelo; con ai_client (pool de threads + timeouts) debe mantenerse.
+
+Levanta el backend con uvicorn en un puerto libre (o usa --url) y lo
+ejercita con httpx (dependencia de desarrollo). Cada solicitud simula un
+cliente distinto (X-Forwarded-For) para no chocar con el rate limit.
+
+Uso (desde backend/):
+    python benchmarks/load_search.py
+    python benchmarks/load_search.py --url http://localhost:8000 --budgets 20
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+CONSULTAS = ["piso", "ceramica", "pintura", "radier", "techo", "puerta", "ventana", "quincho"]
+
+# Formato wizard: siempre va al modelo (no se resuelve offline)
+INSTRUCCION_IA = (
+    "Tipo de proyecto: Quincho\n"
+    "Dimensiones: 30 m2\n"
+    "Calidad: Estándar\n"
+    "Detalles: parrilla y cubierta de teja {n}\n"
+    "Ubicación: Santiago"
+)
+
+_clientes = itertools.count(1)
+
+
+def _cabeceras() -> dict:
+    n = next(_clientes)
+    return {"X-Forwarded-For": f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}"}
+
+
+def percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+async def carga_search(cliente: httpx.AsyncClient, total: int, concurrencia: int) -> list:
+    """total solicitudes a /search con `concurrencia` en paralelo; retorna latencias en ms."""
+    latencias = []
+    consultas = itertools.cycle(CONSULTAS)
+
+    async def trabajador(n: int):
+        for _ in range(n):
+            inicio = time.perf_counter()
+            r = await cliente.get(f"/search/{next(consultas)}", headers=_cabeceras())
+            r.raise_for_status()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    await asyncio.gather(*(trabajador(total // concurrencia) for _ in range(concurrencia)))
+    return latencias
+
+
+async def presupuesto_ia(cliente: httpx.AsyncClient, n: int) -> float:
+    inicio = time.perf_counter()
+    r = await cliente.post("/analyze_budget", json={"instruction": INSTRUCCION_IA.format(n=n)},
+                           headers=_cabeceras(), timeout=600)
+    r.raise_for_status()
+    return time.perf_counter() - inicio
+
+
+def resumen(nombre: str, latencias: list):
+    print(f"{nombre:<28}{len(latencias):>6}{statistics.median(latencias):>9.1f}"
+          f"{percentil(latencias, 95):>9.1f}{percentil(latencias, 99):>9.1f}{max(latencias):>9.1f}")
+
+
+async def correr(url: str, presupuestos: int, total: int, concurrencia: int):
+    async with httpx.AsyncClient(base_url=url, timeout=600) as cliente:
+        await carga_search(cliente, 40, 4)   # calentamiento
+
+        print(f"{'escenario':<28}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        resumen("solo /search", await carga_search(cliente, total, concurrencia))
+
+        tareas = [asyncio.create_task(presupuesto_ia(cliente, n)) for n in range(presupuestos)]
+        await asyncio.sleep(0.2)   # que las llamadas al modelo ya esten en curso
+        latencias = await carga_search(cliente, total, concurrencia)
+        en_curso = sum(not t.done() for t in tareas)
+        resumen(f"/search + {presupuestos} IA", latencias)
+        duraciones = await asyncio.gather(*tareas)
+        print(f"\nPresupuestos IA: {presupuestos} (aun en curso al terminar /search: {en_curso}), "
+              f"duracion p50 {statistics.median(duraciones):.1f}s, max {max(duraciones):.1f}s")
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="Backend ya levantado (por defecto se levanta uno local)")
+    parser.add_argument("--budgets", type=int, default=20, help="Presupuestos IA en paralelo")
+    parser.add_argument("--requests", type=int, default=400, help="Solicitudes a /search por escenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Solicitudes /search en paralelo")
+    args = parser.parse_args()
+
+    servidor = None
+    url = args.url
+    if not url:
+        puerto = puerto_libre()
+        url = f"http://127.0.0.1:{puerto}"
+        servidor = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--log-level", "warning"],
+            cwd=BACKEND, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ),
+        )
+        for _ in range(300):
+            try:
+                httpx.get(f"{url}/", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+    try:
+        asyncio.run(correr(url, args.budgets, args.requests, args.concurrency))
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compila el catalogo APU (con sus indices de busqueda) a un snapshot binario.
+Los workers lo cargan con APU_CATALOG_PATH=<archivo> mediante mmap, sin
+parsear JSON ni reconstruir indices al arrancar.
+
+Uso:
+    python build_catalog_snapshot.py                          # catalogo base
+    python build_catalog_snapshot.py --source ../data/apu_scan_full.json
+    python build_catalog_snapshot.py --output /ruta/catalogo.apusnap
+"""
+import argparse
+import os
+import time
+
+from apu_catalog import (
+    APU_CATALOG, cargar_catalogo, construir_snapshot,
+    guardar_snapshot_binario, cargar_snapshot_binario,
+)
+
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Compila el catalogo APU a un snapshot binario")
+    parser.add_argument("--source", help="Catalogo JSON (forma APU_CATALOG o apu_scan_full.json)")
+    parser.add_argument("--output", default="catalog.apusnap", help="Archivo de salida")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    datos = cargar_catalogo(args.source) if args.source else APU_CATALOG
+    snapshot = construir_snapshot(datos, args.source or "builtin")
+    construccion_ms = (time.perf_counter() - inicio) * 1000
+
+    guardar_snapshot_binario(snapshot, args.output)
+
+    inicio = time.perf_counter()
+    cargado = cargar_snapshot_binario(args.output)
+    carga_ms = (time.perf_counter() - inicio) * 1000
+
+    print(f"✅ Snapshot {snapshot.version}: {len(snapshot.catalogo)} partidas → {args.output} "
+          f"({os.path.getsize(args.output) / 1024:.0f} KB)")
+    print(f"   JSON + indices: {construccion_ms:.1f} ms | snapshot (mmap): {carga_ms:.1f} ms")
+    assert cargado.version == snapshot.version
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Result caching for Arkitecto AI Backend
+Bounded LRU with per-entry TTL and hit/miss counters, in memory
+(LRUTTLCache) or persisted in SQLite (SQLiteLRUCache), and coalescing of
+identical in-flight computations (SingleFlight).
+"""
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUTTLCache:
+    """
+    Thread-safe LRU cache with a time-to-live per entry.
+    Values are copied on the way in and on the way out, so callers can
+    mutate what they get without corrupting the cached entry.
+    Keys should include anything that invalidates a value (e.g. the
+    catalog version), so stale entries simply stop being hit.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600,
+                 copy_fn: Callable[[Any], Any] = copy.deepcopy):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._copy = copy_fn
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a copy of the cached value, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._copy(value)
+
+    def set(self, key: Hashable, value: Any):
+        """Store a copy of value, evicting least recently used entries if full."""
+        value = self._copy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SQLiteLRUCache:
+    """
+    LRU cache with TTL persisted in a SQLite file, for values that are
+    expensive to recompute (LLM responses) and should survive restarts.
+    Keys are strings, values anything JSON-serializable. WAL mode lets
+    several worker processes share the same file.
+    Uses wall-clock time (not monotonic) because entries outlive the process.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, ttl_seconds: float = 7 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_first(self, keys: list) -> Optional[tuple]:
+        """(key, value) of the first key in `keys` with a live entry, or None."""
+        if not keys:
+            return None
+        now = time.time()
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = dict(self._conn.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({placeholders}) AND expires_at > ?",
+                (*keys, now),
+            ).fetchall())
+            key = next((k for k in keys if k in rows), None)
+            if key is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return key, json.loads(rows[key])
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for key, or None on miss/expiry."""
+        hit = self.get_first([key])
+        return hit[1] if hit else None
+
+    def set(self, key: str, value: Any):
+        """Store value, then drop expired entries and the least recently used beyond max_entries."""
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, payload, now + self.ttl_seconds, now),
+                )
+                self.expirations += self._conn.execute(
+                    "DELETE FROM entries WHERE expires_at <= ?", (now,)
+                ).rowcount
+                self.evictions += self._conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    " SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "size": size,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent async computations with the same key: the first
+    caller runs it, callers arriving while it is in flight await the same
+    result (or exception). Nothing is kept once it completes.
+    The shared computation is shielded: a caller that disconnects does not
+    cancel it for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Result of fn() (a coroutine function), shared with concurrent callers of the same key."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        requests = self.calls + self.shared
+        return {
+            "requests": requests,
+            "executed": self.calls,
+            "deduplicated": self.shared,
+            "in_flight": len(self._inflight),
+            "dedup_rate": round(self.shared / requests, 4) if requests else 0.0,
+        }
@@ -0,0 +1,147 @@
+"""
+Per-model circuit breaker for Arkitecto AI Backend
+A model that keeps failing (deprecated -> 404, quota exhausted -> 429, or
+just slow) is skipped immediately instead of making every request wait for
+it to fail again.
+
+closed    -> calls go through; the outcome of the last `window` calls is kept.
+             Trips to open when the failure rate (errors + calls slower than
+             slow_call_seconds) reaches error_rate with at least min_calls
+             recorded, or at once on a non-recoverable error (see FATAL_ERRORS).
+open      -> calls fail fast with CircuitOpenError for cooldown_seconds.
+half_open -> a single probe call goes through; success closes the circuit,
+             failure re-opens it for another cooldown.
+"""
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as api_exceptions
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Errors that won't go away by retrying the next request. ResourceExhausted
+# (429, quota / rate) is not one of them: it is usually per-minute and
+# partial, so it counts toward the error rate like any other failure.
+FATAL_ERRORS = (
+    api_exceptions.NotFound,            # model deprecated / not enabled in the region
+    api_exceptions.PermissionDenied,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit open for {name}, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Thread-safe breaker; outcomes are recorded from the worker threads."""
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_call_seconds: float = 20, cooldown_seconds: float = 30):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=window)   # True = failed or slow
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._last_error = None
+        self._rejected = 0
+        self._trips = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                retry_in = self._opened_at + self.cooldown_seconds - now
+                if retry_in > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = HALF_OPEN
+                self._probe_started = None
+            if self._state == HALF_OPEN:
+                # One probe at a time; a probe that never reports back expires after a cooldown
+                if self._probe_started is not None and now - self._probe_started < self.cooldown_seconds:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, self._probe_started + self.cooldown_seconds - now)
+                self._probe_started = now
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn (blocking) and record its outcome and latency."""
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(False, time.monotonic() - start, e)
+            raise
+        self.record(True, time.monotonic() - start)
+        return result
+
+    def record(self, ok: bool, elapsed: float, error: Exception = None):
+        slow = elapsed > self.slow_call_seconds
+        failed = not ok or slow
+        with self._lock:
+            if failed:
+                self._last_error = (
+                    f"{type(error).__name__}: {str(error)[:120]}" if error else f"slow call ({elapsed:.1f}s)"
+                )
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._trip()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    self._probe_started = None
+                return
+            if self._state == OPEN:
+                return
+            self._outcomes.append(failed)
+            if isinstance(error, FATAL_ERRORS):
+                self._trip()
+            elif len(self._outcomes) >= self.min_calls and self._failure_rate() >= self.error_rate:
+                self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started = None
+        self._trips += 1
+
+    def _failure_rate(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.cooldown_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self._state
+            retry_in = 0.0
+            if state == OPEN:
+                retry_in = max(0.0, self._opened_at + self.cooldown_seconds - time.monotonic())
+                if retry_in == 0:
+                    state = HALF_OPEN
+            return {
+                "state": state,
+                "calls": len(self._outcomes),
+                "failure_rate": round(self._failure_rate(), 3),
+                "retry_in_seconds": round(retry_in, 1),
+                "trips": self._trips,
+                "rejected": self._rejected,
+                "last_error": self._last_error,
+            }
@@ -0,0 +1,315 @@
+"""
+Local stand-in for Vertex AI models in Arkitecto AI Backend
+FakeBackend plugs into ai_client.set_backend() (main.py does it when
+AI_BACKEND=fake) so /analyze_budget and /generate_sketch can be exercised
+and load-tested offline, without credentials or quota.
+
+The fake clients mimic the SDK surface the backend uses:
+- GenerativeModel: generate_content (also stream=True), count_tokens.
+  Budget prompts get a canned JSON budget built from the APU rows of the
+  wizard prompt; image analysis prompts get a canned description.
+- ImageGenerationModel: generate_images returns PNGs.
+
+Each call sleeps (blocking the AI worker thread, as the SDK does) for a
+latency drawn from a per-model lognormal distribution and fails at the
+configured rates: not_found (404, deprecated model), resource_exhausted
+(429, quota), safety (blocked response: .text raises / no images) and
+malformed (unparseable JSON).
+
+Profile (FAKE_AI_PROFILE): a preset name from PROFILES, inline JSON or a
+path to a JSON file, shaped like
+    {"time_scale": 1.0,
+     "models": {"*": {"latency_ms": {"median": 2500, "sigma": 0.4},
+                      "errors": {"resource_exhausted": 0.05}},
+                "gemini-pro": {"latency_ms": {"median": 6000}}}}
+Entries for a model are merged over "*". time_scale multiplies every
+latency (FAKE_AI_TIME_SCALE overrides it); FAKE_AI_SEED makes runs
+repeatable.
+"""
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+PROFILES = {
+    # Every model answers, with production-like latencies
+    "nominal": {
+        "models": {
+            "*": {"latency_ms": {"median": 2500, "sigma": 0.35}},
+            "gemini-pro": {"latency_ms": {"median": 5000, "sigma": 0.4}},
+            "imagegeneration@005": {"latency_ms": {"median": 8000, "sigma": 0.3}},
+        },
+    },
+    # Preferred model deprecated, quota pressure on flash, heavy tail
+    "degraded": {
+        "models": {
+            "*": {"latency_ms": {"median": 3500, "sigma": 0.8},
+                  "errors": {"resource_exhausted": 0.05, "safety": 0.02, "malformed": 0.03}},
+            "gemini-1.5-flash-001": {"errors": {"not_found": 1.0}},
+            "gemini-1.5-flash": {"errors": {"resource_exhausted": 0.2, "safety": 0.02, "malformed": 0.03}},
+            "gemini-pro": {"latency_ms": {"median": 7000, "sigma": 0.6}},
+            "imagegeneration@005": {"latency_ms": {"median": 10000, "sigma": 0.5},
+                                    "errors": {"resource_exhausted": 0.1, "safety": 0.05}},
+        },
+    },
+    # Quota exhausted everywhere: every budget must come from the offline generator
+    "outage": {
+        "models": {
+            "*": {"latency_ms": {"median": 300, "sigma": 0.2}, "errors": {"resource_exhausted": 1.0}},
+        },
+    },
+}
+
+DEFAULT_LATENCY = {"median": 2500, "sigma": 0.35}
+# Share of a streamed response's latency spent before the first chunk
+FIRST_CHUNK_RATIO = 0.15
+STREAM_CHUNK_CHARS = 120
+MAX_CANNED_ITEMS = 12
+IMAGE_SIZE = 1024
+
+_APU_ROW = re.compile(r"^([A-Z]+-\d+)\|([^|\n]+)\|([^|\n]+)\|(\d+(?:\.\d+)?)$", re.MULTILINE)
+_AREA = re.compile(r"(\d+(?:[.,]\d+)?)\s*m(?:2|²)", re.IGNORECASE)
+_PROMPT_FIELD = re.compile(r"^- (Tipo|Calidad): (.+)$", re.MULTILINE)
+
+# Used when the prompt has no APU table (free-text instructions)
+CANNED_ROWS = [
+    ("A-001", "Instalacion de faenas", "gl", 450000),
+    ("B-007", "Escarpe terreno vegetal e=20cm", "m2", 2500),
+    ("C-002", "Hormigon fundaciones H20", "m3", 125000),
+    ("K-008", "Pintura latex interior 2 manos", "m2", 3800),
+]
+
+CANNED_DESCRIPTION = (
+    "Single-storey reinforced concrete structure under construction, exposed brick "
+    "masonry walls, steel roof trusses without cladding, compacted gravel ground, "
+    "scaffolding on the north facade."
+)
+
+# Quantity per m2 of built area by unit (fixed items count once)
+_QUANTITY_PER_M2 = {"m2": 1.0, "m3": 0.1, "ml": 0.4, "kg": 2.0}
+
+
+def load_profile(spec: str = None) -> dict:
+    """Profile from a preset name, inline JSON or a JSON file path (default: nominal)."""
+    spec = (spec or "nominal").strip()
+    if spec in PROFILES:
+        profile = PROFILES[spec]
+    elif spec.startswith("{"):
+        profile = json.loads(spec)
+    else:
+        with open(spec, encoding="utf-8") as f:
+            profile = json.load(f)
+    return {"time_scale": profile.get("time_scale", 1.0), "models": profile.get("models", {})}
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(c for c in contents if isinstance(c, str))
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def canned_budget(prompt: str) -> dict:
+    """AIBudgetResponse-shaped budget priced from the APU rows quoted in the prompt."""
+    rows = [(c, d, u, float(p)) for c, d, u, p in _APU_ROW.findall(prompt)] or CANNED_ROWS
+    area = _AREA.search(prompt)
+    area_m2 = float(area.group(1).replace(",", ".")) if area else 50.0
+    fields = dict(_PROMPT_FIELD.findall(prompt))
+    items = []
+    for codigo, descripcion, unidad, precio in rows[:MAX_CANNED_ITEMS]:
+        cantidad = round(area_m2 * _QUANTITY_PER_M2[unidad], 2) if unidad in _QUANTITY_PER_M2 else 1.0
+        items.append({
+            "elemento": descripcion.split()[0],
+            "descripcion": descripcion,
+            "cantidad": cantidad,
+            "unidad": unidad,
+            "precio_unitario": precio,
+            "subtotal": round(cantidad * precio),
+            "apu_origen": codigo,
+        })
+    total = sum(item["subtotal"] for item in items)
+    return {
+        "budget": {
+            "items": items,
+            "total_materials": total,
+            "total_labor": 0,
+            "total_contingency": round(total * 0.1),
+            "total_final": round(total * 1.1),
+            "currency": "CLP",
+        },
+        "metadata": {"tipo": fields.get("Tipo"), "area_m2": area_m2, "calidad": fields.get("Calidad")},
+    }
+
+
+def png_bytes(size: int = IMAGE_SIZE) -> bytes:
+    """size x size RGB PNG (sky-to-ground gradient), written without PIL."""
+    rows = []
+    for y in range(size):
+        t = y / max(1, size - 1)
+        color = bytes((int(90 + 120 * t), int(140 + 60 * t), int(220 - 150 * t)))
+        rows.append(b"\x00" + color * size)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+class _BlockedResponse:
+    """Response whose candidate was blocked: .text raises, like the SDK."""
+
+    def __init__(self, usage):
+        self.usage_metadata = usage
+
+    @property
+    def text(self):
+        raise ValueError("Cannot get the response text: candidate blocked, finish_reason: SAFETY")
+
+
+class FakeBackend:
+    """ai_client backend serving FakeGenerativeModel / FakeImageModel clients."""
+    name = "fake"
+
+    def __init__(self, profile: dict = None, seed: int = None):
+        self.profile = profile or load_profile()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._png = None
+
+    @classmethod
+    def from_env(cls) -> "FakeBackend":
+        profile = load_profile(os.getenv("FAKE_AI_PROFILE"))
+        if os.getenv("FAKE_AI_TIME_SCALE"):
+            profile["time_scale"] = float(os.getenv("FAKE_AI_TIME_SCALE"))
+        seed = os.getenv("FAKE_AI_SEED")
+        return cls(profile, int(seed) if seed else None)
+
+    def generative_model(self, model_name: str):
+        self._fail_if_unknown(model_name)
+        return FakeGenerativeModel(self, model_name)
+
+    def image_model(self, model_name: str):
+        self._fail_if_unknown(model_name)
+        return FakeImageModel(self, model_name)
+
+    def _fail_if_unknown(self, model_name: str):
+        # A deprecated model fails when the SDK looks it up, like the real 404
+        if self.settings(model_name)["errors"].get("not_found", 0) >= 1:
+            raise api_exceptions.NotFound(f"Publisher Model `{model_name}` was not found")
+
+    def settings(self, model_name: str) -> dict:
+        models = self.profile["models"]
+        base, own = models.get("*", {}), models.get(model_name, {})
+        return {
+            "latency_ms": {**DEFAULT_LATENCY, **base.get("latency_ms", {}), **own.get("latency_ms", {})},
+            "errors": {**base.get("errors", {}), **own.get("errors", {})},
+        }
+
+    def draw(self, model_name: str) -> tuple:
+        """(latency in seconds, outcome) for one call: outcome is "ok" or an error name."""
+        settings = self.settings(model_name)
+        latency = settings["latency_ms"]
+        with self._lock:
+            seconds = latency["median"] * math.exp(self._random.gauss(0, latency["sigma"])) / 1000
+            roll = self._random.random()
+        seconds *= self.profile["time_scale"]
+        for outcome, rate in settings["errors"].items():
+            if roll < rate:
+                return seconds, outcome
+            roll -= rate
+        return seconds, "ok"
+
+    def png(self) -> bytes:
+        if self._png is None:
+            self._png = png_bytes()
+        return self._png
+
+
+class FakeGenerativeModel:
+    def __init__(self, backend: FakeBackend, model_name: str):
+        self._backend = backend
+        self._model_name = model_name
+
+    def count_tokens(self, contents):
+        time.sleep(0.02 * self._backend.profile["time_scale"])
+        return SimpleNamespace(total_tokens=_tokens(_prompt_text(contents)))
+
+    def _answer(self, contents) -> tuple:
+        """(seconds, outcome, prompt text, response text) for one call; raises the API errors."""
+        seconds, outcome = self._backend.draw(self._model_name)
+        prompt = _prompt_text(contents)
+        if outcome in ("not_found", "resource_exhausted"):
+            time.sleep(min(seconds, 0.3))   # errors come back fast
+            if outcome == "not_found":
+                raise api_exceptions.NotFound(f"Publisher Model `{self._model_name}` was not found")
+            raise api_exceptions.ResourceExhausted(f"Quota exceeded for {self._model_name}")
+        if not isinstance(contents, str) and any(not isinstance(c, str) for c in contents):
+            text = CANNED_DESCRIPTION   # image analysis
+        else:
+            text = "```json\n" + json.dumps(canned_budget(prompt), ensure_ascii=False, indent=1) + "\n```"
+        if outcome == "malformed":
+            text = text[:len(text) // 3].replace('"', "'")
+        return seconds, outcome, prompt, text
+
+    def _usage(self, prompt: str, text: str):
+        return SimpleNamespace(prompt_token_count=_tokens(prompt), candidates_token_count=_tokens(text))
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        seconds, outcome, prompt, text = self._answer(contents)
+        if stream:
+            return self._stream(seconds, outcome, prompt, text)
+        time.sleep(seconds)
+        if outcome == "safety":
+            return _BlockedResponse(self._usage(prompt, ""))
+        return SimpleNamespace(text=text, usage_metadata=self._usage(prompt, text))
+
+    def _stream(self, seconds: float, outcome: str, prompt: str, text: str):
+        if outcome == "safety":
+            time.sleep(seconds * FIRST_CHUNK_RATIO)
+            yield _BlockedResponse(self._usage(prompt, ""))
+            return
+        pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        time.sleep(seconds * FIRST_CHUNK_RATIO)
+        per_chunk = seconds * (1 - FIRST_CHUNK_RATIO) / len(pieces)
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            yield SimpleNamespace(text=piece, usage_metadata=self._usage(prompt, text) if last else None)
+            if not last:
+                time.sleep(per_chunk)
+
+
+class FakeImageModel:
+    def __init__(self, backend: FakeBackend, model_name: str):
+        self._backend = backend
+        self._model_name = model_name
+
+    def generate_images(self, prompt: str, number_of_images: int = 1, **kwargs):
+        seconds, outcome = self._backend.draw(self._model_name)
+        if outcome == "not_found":
+            raise api_exceptions.NotFound(f"Publisher Model `{self._model_name}` was not found")
+        if outcome in ("resource_exhausted", "malformed"):
+            time.sleep(min(seconds, 0.3))
+            raise api_exceptions.ResourceExhausted(f"Quota exceeded for {self._model_name}")
+        time.sleep(seconds)
+        if outcome == "safety":
+            return SimpleNamespace(images=[])   # filtered, like Imagen
+        png = self._backend.png()
+        return SimpleNamespace(images=[
+            SimpleNamespace(_pil_image=None, _image_bytes=png) for _ in range(number_of_images)
+        ])
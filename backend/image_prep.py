@@ -0,0 +1,122 @@
+"""
+Upload preprocessing for Gemini vision in Arkitecto AI Backend
+Phone photos (5-12 MB, 12+ MP) are far larger than what the vision model
+looks at: it rescales every image internally and bills a fixed number of
+tokens per image. Sending them as is only costs upload time to Vertex AI
+and memory. Before the call, uploads are:
+
+- read in chunks with a hard size cap (read_capped), so an oversized file
+  is rejected without being held in memory;
+- decoded, downscaled to max_side on the long edge, rotated per the EXIF
+  orientation and re-encoded as JPEG or WebP without metadata
+  (prepare_for_vision, blocking: run it in a thread). JPEG sources are
+  decoded at reduced scale (draft mode), which skips most of the decoding
+  work for large photos.
+
+PreparedImage carries the before / after sizes and timings that are
+reported per request.
+"""
+import io
+import os
+import time
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+# Long edge sent to the vision model; more detail is not used for a 100-word description
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1024"))
+# JPEG or WEBP
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG").upper()
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+# Uplink assumed to estimate the transfer time saved (megabits per second)
+VISION_UPLINK_MBPS = float(os.getenv("VISION_UPLINK_MBPS", "50"))
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds the size cap."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds {limit / (1024 * 1024):.0f} MB")
+        self.limit = limit
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_size: tuple
+    size: tuple
+    prep_ms: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def report(self) -> dict:
+        """Per-request stats: sizes, preprocessing time and estimated upload time saved."""
+        return {
+            "original_kb": round(self.original_bytes / 1024, 1),
+            "sent_kb": round(len(self.data) / 1024, 1),
+            "bytes_saved": self.bytes_saved,
+            "original_size": list(self.original_size),
+            "sent_size": list(self.size),
+            "format": self.mime_type,
+            "prep_ms": round(self.prep_ms, 1),
+            "est_upload_ms_saved": round(self.bytes_saved * 8 / (VISION_UPLINK_MBPS * 1e6) * 1000, 1),
+        }
+
+
+async def read_capped(upload, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an UploadFile in chunks; raises UploadTooLarge past max_bytes."""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        chunks.append(chunk)
+
+
+def prepare_for_vision(data: bytes, max_side: int = VISION_MAX_SIDE, image_format: str = VISION_IMAGE_FORMAT,
+                       quality: int = VISION_IMAGE_QUALITY) -> PreparedImage:
+    """
+    Downscaled, EXIF-free re-encoding of an uploaded image (blocking).
+    Raises PIL.UnidentifiedImageError (or another PIL error) if data is
+    not a decodable image.
+    """
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    if image.format == "JPEG":
+        # Decode directly at 1/2, 1/4 or 1/8 scale when that still covers max_side
+        image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        # Transparency is flattened on white (JPEG has no alpha)
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image_format = "JPEG"
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return PreparedImage(
+        data=buffer.getvalue(),
+        mime_type=_MIME_TYPES[image_format],
+        original_bytes=len(data),
+        original_size=original_size,
+        size=image.size,
+        prep_ms=(time.perf_counter() - start) * 1000,
+    )
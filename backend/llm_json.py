@@ -0,0 +1,249 @@
+"""
+Parsing of JSON produced by LLMs for Arkitecto AI Backend
+- parse_json_response: tolerant parser for fenced, unfenced, trailing-comma
+  and truncated JSON, so a paid-for answer is not thrown away over formatting.
+- ArrayItemStream: pulls the objects of a JSON array out of a response
+  while it is still streaming, so each budget item can be sent to the client
+  as soon as the model finishes writing it.
+- vertex_schema / schema_outline: the response schema derived from the
+  pydantic models, for the SDK (constrained decoding) and for the prompt.
+- ParseMetrics: parse outcome counters.
+"""
+import json
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+# Candidate cut points tried when repairing a truncated response
+MAX_REPAIR_ATTEMPTS = 8
+
+
+def _cut_points(text: str) -> list:
+    """
+    (position, open brackets) after each complete value inside the
+    document: before a "," and after a closing bracket, outside strings.
+    """
+    points = []
+    stack = []
+    in_string = escape = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            points.append((i + 1, tuple(stack)))
+        elif c == "," and stack:
+            points.append((i, tuple(stack)))
+    return points
+
+
+def _repair_truncated(text: str) -> Optional[dict]:
+    """Close a truncated document at the last cut point that yields valid JSON."""
+    for position, stack in reversed(_cut_points(text)[-MAX_REPAIR_ATTEMPTS:]):
+        candidate = text[:position] + "".join(_CLOSERS[c] for c in reversed(stack))
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def parse_json_response(text: str) -> tuple:
+    """
+    JSON object from a model response -> (value, outcome).
+    outcome is "ok" (parsed as is), "repaired" (trailing commas removed or
+    truncated document closed) or "failed" (value is None).
+    """
+    if not text:
+        return None, "failed"
+    fenced = _FENCE.search(text)
+    body = fenced.group(1) if fenced else text
+    start = body.find("{")
+    if start < 0:
+        return None, "failed"
+    body = body[start:]
+    end = body.rfind("}")
+
+    # Complete document, possibly followed by prose
+    if end >= 0:
+        try:
+            value = json.loads(body[:end + 1])
+            if isinstance(value, dict):
+                return value, "ok"
+        except ValueError:
+            pass
+    try:
+        value = json.loads(_TRAILING_COMMA.sub(r"\1", body[:end + 1]))
+        if isinstance(value, dict):
+            return value, "repaired"
+    except ValueError:
+        pass
+
+    value = _repair_truncated(_TRAILING_COMMA.sub(r"\1", body))
+    return (value, "repaired") if value is not None else (None, "failed")
+
+
+class ArrayItemStream:
+    """
+    Incremental extractor for the objects of the first `"<key>": [...]`
+    array in a streamed (possibly fenced, possibly truncated) JSON text.
+    feed() returns the objects completed by the new chunk; `text` keeps
+    the whole response for the final parse.
+    """
+
+    def __init__(self, key: str = "items"):
+        self._start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._text = ""
+        self._pos = 0          # next character to scan
+        self._in_array = False
+        self._done = False
+        self._depth = 0        # nesting inside the array ({ and [)
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, chunk: str) -> list:
+        self._text += chunk
+        if self._done:
+            return []
+        if not self._in_array:
+            match = self._start.search(self._text, max(0, self._pos - len(self._start.pattern)))
+            if not match:
+                self._pos = len(self._text)
+                return []
+            self._in_array = True
+            self._pos = match.end()
+        return self._scan()
+
+    def _scan(self) -> list:
+        objects = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                if self._depth == 0 and c == "{":
+                    self._object_start = i
+                self._depth += 1
+            elif c in "}]":
+                if self._depth == 0:
+                    # "]" closing the array itself
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    try:
+                        objects.append(json.loads(text[self._object_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._object_start = None
+        self._pos = len(text)
+        return objects
+
+
+def _resolve(schema: dict, defs: dict) -> dict:
+    if "$ref" in schema:
+        return _resolve(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    if "anyOf" in schema:
+        # Optional[X] -> X, nullable
+        options = [o for o in schema["anyOf"] if o.get("type") != "null"]
+        resolved = dict(_resolve(options[0], defs))
+        if len(options) < len(schema["anyOf"]):
+            resolved["nullable"] = True
+        return resolved
+    return schema
+
+
+def vertex_schema(model) -> dict:
+    """
+    OpenAPI-subset schema (type, properties, items, required, enum,
+    nullable) for a pydantic model, with $refs inlined, as Vertex AI
+    response_schema expects.
+    """
+    root = model.model_json_schema()
+    defs = root.get("$defs", {})
+
+    def convert(schema: dict) -> dict:
+        schema = _resolve(schema, defs)
+        result = {"type": schema.get("type", "object")}
+        if schema.get("nullable"):
+            result["nullable"] = True
+        if "enum" in schema:
+            result["enum"] = schema["enum"]
+        if "properties" in schema:
+            result["properties"] = {k: convert(v) for k, v in schema["properties"].items()}
+            if schema.get("required"):
+                result["required"] = schema["required"]
+        if "items" in schema:
+            result["items"] = convert(schema["items"])
+        return result
+
+    return convert(root)
+
+
+def schema_outline(model) -> str:
+    """Compact one-line example of the expected JSON, for the prompt."""
+    names = {"string": "str", "number": "num", "integer": "num", "boolean": "bool"}
+
+    def outline(schema: dict):
+        if "enum" in schema:
+            return "|".join(str(v) for v in schema["enum"])
+        if schema.get("type") == "array":
+            return [outline(schema["items"])]
+        if "properties" in schema:
+            return {k: outline(v) for k, v in schema["properties"].items()}
+        return names.get(schema.get("type"), "str")
+
+    return json.dumps(outline(vertex_schema(model)), ensure_ascii=False)
+
+
+class ParseMetrics:
+    """Thread-safe counters of parse outcomes (ok / repaired / invalid / failed)."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        usable = counts.get("ok", 0) + counts.get("repaired", 0)
+        return {
+            "total": total,
+            **{k: counts.get(k, 0) for k in ("ok", "repaired", "invalid", "failed")},
+            "success_rate": round(usable / total, 4) if total else 0.0,
+        }
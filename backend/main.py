@@ -1,17 +1,22 @@
 import os
 import uvicorn
+import asyncio
 import base64
+import hashlib
 import io
+import json
 import time
 import re
-from typing import Optional, List
+import sqlite3
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Optional, List, Literal
 from datetime import datetime
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-from vertexai.preview.vision_models import ImageGenerationModel
+from vertexai.generative_models import Part
 from google.auth import exceptions as auth_exceptions
 try:
     from backend.auth_middleware import FirebaseAuthMiddleware
@@ -19,7 +24,8 @@ try:
     from backend.schemas import Project, ProjectMetadata
     from backend.security import (
         RateLimitMiddleware, SecurityHeadersMiddleware,
-        RequestLoggingMiddleware, InputSanitizer
+        RequestLoggingMiddleware, InputSanitizer, UploadSizeLimitMiddleware,
+        rate_limiter, get_client_id
     )
 except ImportError:
     from auth_middleware import FirebaseAuthMiddleware
@@ -27,22 +33,70 @@ except ImportError:
     from schemas import Project, ProjectMetadata
     from security import (
         RateLimitMiddleware, SecurityHeadersMiddleware,
-        RequestLoggingMiddleware, InputSanitizer
+        RequestLoggingMiddleware, InputSanitizer, UploadSizeLimitMiddleware,
+        rate_limiter, get_client_id
     )
 
 # Importar catalogo APU Profesional v2.0
+from apu_search import normalizar
 from apu_catalog import (
-    APU_CATALOG, KEYWORD_MAPPING, buscar_apus, calcular_presupuesto_completo,
-    obtener_sugerencias, obtener_categorias
+    buscar_apus, calcular_presupuestos_lote,
+    detectar_keywords, categoria_principal, detectar_escenario, version_catalogo, RANKING_POR_DEFECTO,
+    obtener_sugerencias, obtener_categorias,
+    recargar_catalogo, info_catalogo, snapshot_actual, CATALOGO_RUTA, PresupuestoIncremental,
+    reconciliar_presupuesto_ia
 )
 
+from apu_riesgo import simular_riesgo, iniciar_procesos, detener_procesos
+
+import ai_client
+import usage_meter
+
 # Importar generador de PDF
 from pdf_generator import generate_budget_pdf, generate_simple_budget_text
+from cache import LRUTTLCache, SQLiteLRUCache, SingleFlight
+from llm_json import ArrayItemStream, ParseMetrics, parse_json_response, vertex_schema
+from image_prep import MAX_UPLOAD_BYTES, PreparedImage, UploadTooLarge, prepare_for_vision, read_capped
+from pydantic import ValidationError
 
 # --- CONFIGURACIÓN ---
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT", "arkitecto-ai-pro-v1")
 LOCATION = "us-central1"
 
+# Lotes de presupuestos (/analyze_budget/batch)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Simulacion de riesgo: tope de trabajo (lineas x simulaciones); sin usuario el tope es menor
+RISK_MAX_CELLS = int(os.getenv("RISK_MAX_CELLS", "100000000"))
+RISK_PUBLIC_MAX_CELLS = int(os.getenv("RISK_PUBLIC_MAX_CELLS", "20000000"))
+
+# Cache de presupuestos offline (clave: version del catalogo + instruccion normalizada)
+OFFLINE_CACHE_SIZE = int(os.getenv("OFFLINE_CACHE_SIZE", "1024"))
+OFFLINE_CACHE_TTL = float(os.getenv("OFFLINE_CACHE_TTL", "3600"))
+
+# Cache persistente de respuestas de Gemini (SQLite); ruta vacia la desactiva.
+# En Cloud Run montar un volumen para que sobreviva entre revisiones.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "5000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 86400)))
+
+# Modelos de Vertex AI (orden de preferencia para presupuestos)
+BUDGET_MODELS = ["gemini-1.5-flash-001", "gemini-1.5-flash", "gemini-pro"]
+VISION_MODEL = "gemini-1.5-flash"
+IMAGE_MODEL = "imagegeneration@005"
+# Backend de modelos: "vertex" (produccion) o "fake" (fake_vertex, sin red
+# ni cuota, para pruebas de carga; perfil en FAKE_AI_PROFILE)
+AI_BACKEND = os.getenv("AI_BACKEND", "vertex")
+# Construir y conectar los clientes al arrancar (ver ai_client.warm_up)
+AI_WARMUP = os.getenv("AI_WARMUP", "1") == "1"
+# Plazo total de /analyze_budget y espera antes de lanzar el siguiente modelo en paralelo
+BUDGET_DEADLINE_SECONDS = float(os.getenv("BUDGET_DEADLINE_SECONDS", "25"))
+BUDGET_HEDGE_DELAY_SECONDS = float(os.getenv("BUDGET_HEDGE_DELAY_SECONDS", "4"))
+
+# Recarga en caliente del catalogo (APU_CATALOG_PATH); 0 desactiva el monitoreo
+CATALOG_RELOAD_SECONDS = float(os.getenv("APU_CATALOG_RELOAD_SECONDS", "0"))
+
 # Fix Unicode encoding for Windows console
 import sys
 if sys.platform == 'win32':
@@ -55,14 +109,21 @@ print(f"Proyecto GCP: {PROJECT_ID}")
 print(f"Region: {LOCATION}")
 print(f"APUs Profesionales: 150+ partidas con precios CLP 2024/2025")
 print(f"Categorias: 17 (preliminares a equipos)")
+print(f"Catalogo: version {version_catalogo()} ({info_catalogo()['origen']}, "
+      f"{info_catalogo()['carga_inicial_ms']} ms)")
 print("-"*60)
 
-# Inicializar Vertex AI
-try:
-    vertexai.init(project=PROJECT_ID, location=LOCATION)
-    print("✅ Vertex AI Generative API    : Conectado")
-except Exception as e:
-    print(f"❌ Vertex AI                   : Error - {str(e)[:50]}")
+# Inicializar Vertex AI (o el backend local de pruebas)
+if AI_BACKEND == "fake":
+    import fake_vertex
+    ai_client.set_backend(fake_vertex.FakeBackend.from_env())
+    print(f"🧪 Vertex AI                   : Backend local (perfil {os.getenv('FAKE_AI_PROFILE', 'nominal')})")
+else:
+    try:
+        vertexai.init(project=PROJECT_ID, location=LOCATION)
+        print("✅ Vertex AI Generative API    : Conectado")
+    except Exception as e:
+        print(f"❌ Vertex AI                   : Error - {str(e)[:50]}")
 
 # Inicializar Firebase
 try:
@@ -76,15 +137,83 @@ print("-"*60)
 print("🎯 Endpoints activos:")
 print("   • GET  /              → Health check")
 print("   • POST /analyze_budget → Presupuestos con IA")
+print("   • POST /analyze_budget/stream → Presupuesto en streaming (SSE)")
+print("   • POST /analyze_budget/batch → Lotes de presupuestos (NDJSON)")
+print("   • PATCH /analyze_budget/lines → Recalculo incremental de totales")
+print("   • POST /budget/risk → Riesgo de costo (Monte Carlo)")
 print("   • POST /generate_sketch → Renders arquitectónicos")
+print("   • POST /catalog/reload → Recarga del catalogo APU (admin)")
+print("   • GET  /metrics/usage → Consumo de Vertex AI (tokens, costo)")
 print("="*60 + "\n")
 
+async def _watch_catalog_file(path: str, interval: float):
+    """
+    Recarga el catalogo cuando cambia el archivo. El snapshot nuevo se
+    construye en un thread y se publica de forma atomica, sin bloquear
+    el event loop ni las solicitudes en curso.
+    """
+    try:
+        last_mtime = os.stat(path).st_mtime
+    except OSError:
+        last_mtime = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            snapshot = await asyncio.to_thread(recargar_catalogo, path)
+            print(f"🔄 [CATALOGO] Version vigente: {snapshot.version}")
+        except (OSError, ValueError) as e:
+            print(f"❌ [CATALOGO] Recarga fallida, se mantiene {version_catalogo()}: {str(e)[:100]}")
+
+
+async def _warm_up_models():
+    """
+    Construye los clientes de Vertex AI y abre sus canales en segundo plano,
+    para que la primera solicitud tras un cold start no pague ese costo.
+    """
+    results = await ai_client.warm_up(BUDGET_MODELS + [VISION_MODEL], [IMAGE_MODEL])
+    for model_name, result in results.items():
+        icon = "✅" if result["status"] == "ready" else "⚠️ "
+        print(f"{icon} [WARMUP] {model_name}: {result['status']} ({result['ms']} ms)")
+
+
+async def _flush_usage(interval: float):
+    """Escribe por lotes los eventos de uso de IA en el almacen local."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(usage_meter.meter.flush)
+        except sqlite3.Error as e:
+            print(f"⚠️  [USO] No se pudo guardar el uso de IA: {str(e)[:80]}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool de procesos de /budget/risk (si RISK_PROCESS_WORKERS > 0), antes de atender solicitudes
+    await asyncio.to_thread(iniciar_procesos)
+    tasks = []
+    if CATALOGO_RUTA and CATALOG_RELOAD_SECONDS > 0:
+        tasks.append(asyncio.create_task(_watch_catalog_file(CATALOGO_RUTA, CATALOG_RELOAD_SECONDS)))
+    if AI_WARMUP:
+        tasks.append(asyncio.create_task(_warm_up_models()))
+    tasks.append(asyncio.create_task(_flush_usage(usage_meter.USAGE_FLUSH_SECONDS)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.to_thread(detener_procesos)
+    await asyncio.to_thread(usage_meter.meter.flush)
+
+
 app = FastAPI(
     title="Arkitecto AI API",
     description="API profesional para presupuestos de construccion con IA",
     version="5.0 PRO",
     docs_url="/docs",
-    redoc_url=None
+    redoc_url=None,
+    lifespan=lifespan
 )
 
 # CORS Configuration - Allow all origins for now (Vercel preview URLs change)
@@ -101,6 +230,8 @@ app.add_middleware(
 # Security middlewares (order matters - last added = first executed)
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
+# Fotos sobre el tope se rechazan por Content-Length (margen para el resto del formulario)
+app.add_middleware(UploadSizeLimitMiddleware, limits={"/generate_sketch": MAX_UPLOAD_BYTES + 64 * 1024})
 app.add_middleware(RateLimitMiddleware)
 app.add_middleware(FirebaseAuthMiddleware)
 
@@ -112,29 +243,154 @@ def generate_budget_offline(instruction: str) -> dict:
     Sistema inteligente de busqueda por keywords naturales.
     Incluye desglose completo: materiales, mano obra, GG, imprevistos, utilidad.
     """
-    instruction_lower = instruction.lower()
+    return generate_budgets_offline([instruction])[0]
+
+
+def _copy_offline_entry(entry: tuple) -> tuple:
+    """Copia (calces, presupuesto) sin deepcopy: los items son dicts planos."""
+    calces, presupuesto = entry
+    presupuesto = dict(presupuesto)
+    presupuesto["items"] = [dict(item) for item in presupuesto["items"]]
+    presupuesto["escenarios"] = {
+        key: [row[:] if isinstance(row, list) else row for row in value]
+        for key, value in presupuesto["escenarios"].items()
+    }
+    return calces, presupuesto
+
+
+offline_cache = LRUTTLCache(OFFLINE_CACHE_SIZE, OFFLINE_CACHE_TTL, copy_fn=_copy_offline_entry)
+
+
+def _offline_fingerprint(instruction: str) -> tuple:
+    """Clave de cache: la busqueda y el parseo de area/cantidad solo dependen del texto normalizado."""
+    return version_catalogo(), normalizar(instruction).strip()
+
+
+llm_cache = None
+if LLM_CACHE_PATH:
+    try:
+        llm_cache = SQLiteLRUCache(LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL)
+    except sqlite3.Error as e:
+        print(f"⚠️  Cache LLM deshabilitado ({LLM_CACHE_PATH}): {str(e)[:80]}")
+
+
+# Coalescencia de solicitudes identicas en curso
+budget_flight = SingleFlight()
+sketch_flight = SingleFlight()
+
+# Resultado del parseo de cada respuesta de Gemini (cada falla es una llamada perdida)
+budget_parse_metrics = ParseMetrics()
+
+
+def _llm_cache_key(model_name: str, prompt: str, catalog_version: str) -> str:
+    """
+    Huella del prompt: modelo + prompt con espacios normalizados + version del
+    catalogo (un cambio de precios invalida las respuestas guardadas).
+    """
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{catalog_version}\0{model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+def _reconciled_cache_key(model_name: str, prompt: str, budget_data: dict) -> str:
+    """Clave de cache LLM con la version del catalogo con que se concilio el presupuesto (no la del inicio)."""
+    return _llm_cache_key(model_name, prompt, budget_data["budget"]["reconciliacion"]["catalogo_version"])
+
+
+def _discard_result(task: asyncio.Future):
+    """Consume el resultado de una tarea descartada (evita "Task exception was never retrieved")."""
+    if not task.cancelled():
+        task.exception()
+
+
+def generate_budgets_offline(instructions: List[str]) -> List[dict]:
+    """
+    Version por lotes de generate_budget_offline: todas las instrucciones
+    se presupuestan en una sola pasada del motor vectorizado
+    (calcular_presupuestos_lote). Los resultados se memorizan en
+    offline_cache; un acierto entrega una copia independiente.
+    """
+    entries = [offline_cache.get(_offline_fingerprint(i)) for i in instructions]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+
+    # Calces, busqueda y precios del mismo snapshot aunque haya una recarga en medio
+    snapshot = snapshot_actual()
+    solicitudes = []
+    calces_por_instruccion = []
+    for instruction in (instructions[i] for i in missing):
+        instruction_lower = instruction.lower()
 
-    # Detectar area si esta especificada
-    area_match = re.search(r'(\d+)\s*m[²2]', instruction_lower)
-    cantidad_match = re.search(r'(\d+)\s*(unidad|un|und|u\b|puerta|ventana)', instruction_lower)
+        # Detectar area si esta especificada
+        area_match = re.search(r'(\d+)\s*m[²2]', instruction_lower)
+        cantidad_match = re.search(r'(\d+)\s*(unidad|un|und|u\b|puerta|ventana)', instruction_lower)
 
-    area = float(area_match.group(1)) if area_match else None
-    cantidad = int(cantidad_match.group(1)) if cantidad_match else None
+        area = float(area_match.group(1)) if area_match else None
+        cantidad = int(cantidad_match.group(1)) if cantidad_match else None
+
+        # Una sola pasada sobre la instruccion: sirve a la busqueda y a la categoria
+        calces_por_instruccion.append(detectar_keywords(instruction, snapshot))
+        solicitudes.append((instruction, area, cantidad))
 
     # Usar el nuevo sistema de presupuesto completo
-    presupuesto = calcular_presupuesto_completo(instruction, area=area, cantidad=cantidad)
+    if solicitudes:
+        presupuestos = calcular_presupuestos_lote(
+            solicitudes, calces=calces_por_instruccion, escenarios=True, snapshot=snapshot
+        )
+        for i, calces, presupuesto in zip(missing, calces_por_instruccion, presupuestos):
+            # Nombre de la categoria del mismo snapshot que precio el presupuesto
+            presupuesto["categoria_detectada"] = (
+                snapshot.catalogo.nombre_de(categoria_principal(calces)) or "Construccion General"
+            )
+            entries[i] = (calces, presupuesto)
+            # La clave usa la version con que realmente se preció (puede haber recarga en medio)
+            key = (presupuesto["catalogo_version"], normalizar(instructions[i]).strip())
+            offline_cache.set(key, entries[i])
+
+    return [
+        _offline_response(instruction, calces, presupuesto)
+        for instruction, (calces, presupuesto) in zip(instructions, entries)
+    ]
+
+
+# Lineas del usuario en el prompt wizard (PROYECTO DEL USUARIO)
+_LINEA_CALIDAD = re.compile(r"^- Calidad: (.+)$", re.MULTILINE)
+_LINEA_UBICACION = re.compile(r"^- Ubicaci[oó]n: (.+)$", re.MULTILINE)
+
+
+def _escenario_solicitado(instruction: str) -> tuple:
+    """
+    (calidad, region) pedidas. En el prompt wizard solo cuentan las lineas
+    - Calidad: / - Ubicación: del usuario: las instrucciones del prompt
+    nombran todas las calidades y ganaria la primera.
+    """
+    calidad_linea = _LINEA_CALIDAD.search(instruction)
+    ubicacion_linea = _LINEA_UBICACION.search(instruction)
+    if not calidad_linea and not ubicacion_linea:
+        return detectar_escenario(instruction)
+    calidad, _ = detectar_escenario(calidad_linea.group(1)) if calidad_linea else ("estandar", None)
+    _, region = detectar_escenario(ubicacion_linea.group(1)) if ubicacion_linea else (None, "metropolitana")
+    return calidad, region
 
-    # Detectar categoria para el analisis
-    categoria_detectada = "Construccion General"
-    for keyword, cat in KEYWORD_MAPPING.items():
-        if keyword in instruction_lower:
-            if cat in APU_CATALOG:
-                categoria_detectada = APU_CATALOG[cat]["nombre"]
-            break
+
+def _offline_response(instruction: str, calces: list, presupuesto: dict) -> dict:
+    """Arma la respuesta de /analyze_budget para un presupuesto offline."""
+    # Categoria para el analisis (primera keyword segun KEYWORD_MAPPING), ya resuelta al preciar
+    categoria_detectada = presupuesto["categoria_detectada"]
 
     # Contar partidas principales (sin costos indirectos)
     partidas_principales = len([i for i in presupuesto["items"] if "%" not in i.get("apu_origen", "")])
 
+    # Escenario mencionado en la instruccion (calidad / region) dentro de la matriz
+    escenarios = presupuesto["escenarios"]
+    calidad, region = _escenario_solicitado(instruction)
+    q, r = escenarios["calidades"].index(calidad), escenarios["regiones"].index(region)
+    escenarios["seleccionado"] = {
+        "calidad": calidad,
+        "region": region,
+        "subtotal_directo": escenarios["subtotal_directo"][q][r],
+        "total_estimado": escenarios["total_estimado"][q][r],
+        "total_con_iva": escenarios["total_con_iva"][q][r]
+    }
+
     analisis = (
         f"Presupuesto profesional generado para: {instruction}\n"
         f"Categoria detectada: {categoria_detectada}\n"
@@ -154,7 +410,8 @@ def generate_budget_offline(instruction: str) -> dict:
             "gastos_generales": presupuesto["gastos_generales"],
             "imprevistos": presupuesto["imprevistos"],
             "utilidad": presupuesto["utilidad"],
-            "total_con_iva": presupuesto["total_con_iva"]
+            "total_con_iva": presupuesto["total_con_iva"],
+            "escenarios": escenarios
         },
         "metadata": {
             "elementos_detectados": len(presupuesto["items"]),
@@ -162,7 +419,8 @@ def generate_budget_offline(instruction: str) -> dict:
             "generator": "apu_profesional_v2",
             "categoria": categoria_detectada,
             "version": "2.0",
-            "transparencia": "Codigos APU compatibles"
+            "transparencia": "Codigos APU compatibles",
+            "catalogo_version": presupuesto["catalogo_version"]
         }
     }
 
@@ -172,7 +430,16 @@ def health_check():
         "status": "online",
         "version": "5.0 PRO",
         "apu_catalog": "v2.0 - 150+ partidas",
-        "features": ["budget_analysis", "render_generation", "projects_crud", "smart_suggestions"]
+        "features": ["budget_analysis", "render_generation", "projects_crud", "smart_suggestions"],
+        "catalog": info_catalogo(),
+        "offline_cache": offline_cache.stats(),
+        "ai_models": ai_client.registry_info(),
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "llm_parse": budget_parse_metrics.stats(),
+        "coalescing": {
+            "analyze_budget": budget_flight.stats(),
+            "generate_sketch": sketch_flight.stats()
+        }
     }
 
 
@@ -206,29 +473,92 @@ def get_categories():
 
 
 @app.get("/search/{query}")
-def search_apus(query: str, limit: int = 10):
+def search_apus(query: str, limit: int = 10, ranking: Optional[Literal["bm25", "legacy"]] = None):
     """
     Busca APUs por texto libre.
     Util para autocompletado y busqueda en tiempo real.
+    ranking=bm25 ordena por relevancia; legacy mantiene el orden del catalogo.
     """
-    resultados = buscar_apus(query, max_resultados=limit)
+    resultados = buscar_apus(query, max_resultados=limit, ranking=ranking)
     return {
         "success": True,
         "query": query,
+        "ranking": ranking or RANKING_POR_DEFECTO,
         "results": resultados,
         "total": len(resultados)
     }
 
 
+@app.post("/catalog/reload")
+async def reload_catalog(request: Request):
+    """
+    Recarga el catalogo APU desde APU_CATALOG_PATH. Los indices se
+    construyen en segundo plano y el cambio de version es atomico.
+    Solo administradores (custom claim admin=true en el token de Firebase).
+    """
+    if request.state.user.get("admin") is not True:
+        raise HTTPException(status_code=403, detail="Only administrators can reload the catalog")
+    previous = version_catalogo()
+    try:
+        snapshot = await asyncio.to_thread(recargar_catalogo)
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Catalogo invalido: {str(e)[:200]}")
+    return {
+        "success": True,
+        "previous_version": previous,
+        "changed": snapshot.version != previous,
+        "catalog": info_catalogo()
+    }
+
+
+
+@app.get("/metrics/usage")
+async def get_usage_metrics(request: Request, since_hours: float = 24):
+    """
+    Consumo de Vertex AI: llamadas, tokens de prompt y respuesta, imagenes,
+    latencia y costo estimado (USD) por endpoint y modelo. "process" son
+    los contadores en memoria de esta instancia; "stored" lo persistido por
+    todas las instancias en la ventana since_hours; "me" lo del usuario.
+    """
+    await asyncio.to_thread(usage_meter.meter.flush)
+    uid = request.state.user["uid"]
+    return {
+        "since_hours": since_hours,
+        "process": usage_meter.meter.snapshot(),
+        "stored": await asyncio.to_thread(usage_meter.meter.stored, None, since_hours),
+        "me": {
+            "uid": uid,
+            "process": usage_meter.meter.for_uid(uid),
+            "stored": await asyncio.to_thread(usage_meter.meter.stored, uid, since_hours)
+        },
+        "prices_usd": usage_meter.MODEL_PRICES
+    }
+
 from prompts.wizard_prompt import build_wizard_prompt, LOICA_REFERENCE
-from schemas import BudgetRequest
+from schemas import (
+    AIBudgetResponse, BudgetItem, BudgetRequest, BudgetBatchRequest, BudgetLinesPatch, BudgetRiskRequest
+)
+
+# Salida JSON restringida al esquema de AIBudgetResponse si el SDK lo soporta
+_budget_config = ai_client.json_generation_config(vertex_schema(AIBudgetResponse))
+BUDGET_GENERATION = {"generation_config": _budget_config} if _budget_config else {}
+# Con JSON mode el prompt pide el objeto sin bloque ```json
+BUDGET_JSON_MODE = _budget_config is not None
 
 # ... (existing code) ...
 
-@app.post("/analyze_budget")
-async def analyze_budget(request: BudgetRequest):
-    instruction = request.instruction
-    
+def _prepare_instruction(instruction: str) -> str:
+    """
+    Prompt para el modelo. Se sanitiza lo que escribio el usuario; el formato
+    wizard se convierte despues en el prompt con LOICA y partidas APU (que
+    excede el largo maximo de una instruccion).
+    """
+    # Sanitize input
+    try:
+        instruction = InputSanitizer.sanitize_instruction(instruction)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # Si la instrucción tiene formato wizard, usar prompt especial
     if "Tipo de proyecto:" in instruction:
         # Parsear respuestas
@@ -239,70 +569,457 @@ async def analyze_budget(request: BudgetRequest):
                 key, value = line.split(':', 1)
                 key_norm = key.strip().lower().replace(' de proyecto', '').replace(' ', '_')
                 answers[key_norm] = value.strip()
-        
+
         # Usar prompt con LOICA de referencia
-        instruction = build_wizard_prompt(answers)
+        instruction = build_wizard_prompt(answers, json_mode=BUDGET_JSON_MODE)
+    return instruction
 
-    # Sanitize input
-    try:
-        instruction = InputSanitizer.sanitize_instruction(instruction)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/analyze_budget")
+async def analyze_budget(request: BudgetRequest):
+    instruction = _prepare_instruction(request.instruction)
 
     print(f"\n💰 [PRESUPUESTO] Calculando para: '{instruction[:100]}...'")
 
-    # Lista de modelos a intentar
-    models_to_try = ["gemini-1.5-flash-001", "gemini-1.5-flash", "gemini-pro"]
+    # Solicitudes identicas simultaneas (p. ej. un preset de campaña) comparten una sola llamada
+    return await budget_flight.do(" ".join(instruction.split()), partial(_generate_ai_budget, instruction))
+
+
+async def _generate_ai_budget(instruction: str) -> dict:
+    """Presupuesto con IA para un prompt ya sanitizado: cache LLM, carrera de modelos y respaldo offline."""
+    # Respuesta ya pagada para el mismo prompt (cualquier modelo, en orden de preferencia)
+    catalog_version = version_catalogo()
+    cache_keys = {_llm_cache_key(name, instruction, catalog_version): name for name in BUDGET_MODELS}
+    if llm_cache:
+        cached = await asyncio.to_thread(llm_cache.get_first, list(cache_keys))
+        if cached:
+            key, budget_data = cached
+            print(f"💾 [PRESUPUESTO] Respuesta de {cache_keys[key]} desde cache")
+            return _ai_budget_response(budget_data)
+
+    # El presupuesto offline se calcula en paralelo: es la respuesta si
+    # ningun modelo entrega un JSON valido antes del plazo
+    offline_task = asyncio.ensure_future(asyncio.to_thread(generate_budget_offline, instruction))
+    # Si gana la IA (o se cancela la solicitud) nadie la espera: su resultado o error se descarta
+    offline_task.add_done_callback(_discard_result)
+
+    # Modelos con el circuito abierto se omiten sin esperar a que fallen
+    models = [name for name in BUDGET_MODELS if ai_client.is_available(name)]
+    skipped = [name for name in BUDGET_MODELS if name not in models]
+    if skipped:
+        print(f"⏭️  Modelos omitidos (circuito abierto): {', '.join(skipped)}")
 
-    for model_name in models_to_try:
+    try:
+        model_name, budget_data = await ai_client.hedged(
+            [(name, partial(_budget_from_model, name, instruction)) for name in models],
+            hedge_delay=BUDGET_HEDGE_DELAY_SECONDS,
+            deadline=BUDGET_DEADLINE_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        print(f"⏱️ [PRESUPUESTO] Sin respuesta de Vertex AI en {BUDGET_DEADLINE_SECONDS}s - usando generador offline")
+        return await offline_task
+    except Exception:
+        print("⚠️ [PRESUPUESTO] Vertex AI no disponible - usando generador offline")
+        return await offline_task
+
+    offline_task.cancel()
+    print(f"✅ [PRESUPUESTO] Generado con {model_name}")
+    if llm_cache:
         try:
-            print(f"🔄 Intentando modelo: {model_name}")
-            model = GenerativeModel(model_name)
-            
-            response = model.generate_content(instruction)
-
-            print(f"✅ [PRESUPUESTO] Generado con {model_name}")
-
-            # Extract JSON from the response text
-            match = re.search(r'```json\n({.*?})\n```', response.text, re.DOTALL)
-            if match:
-                json_str = match.group(1)
-                budget_data = json.loads(json_str)
-                # Here you would typically map this to your response model
-                return {
-                    "success": True,
-                    "analisis": "Presupuesto generado con IA conversacional.",
-                    "presupuesto": budget_data.get("budget"),
-                    "metadata": budget_data.get("metadata")
-                }
-            else:
-                 # Fallback for non-JSON response, or use the offline generator
-                print("⚠️ No se encontró JSON en la respuesta, usando generador offline.")
-                return generate_budget_offline(instruction)
-
-        except Exception as e:
-            print(f"❌ Error con {model_name}: {str(e)[:100]}")
+            await asyncio.to_thread(
+                llm_cache.set, _reconciled_cache_key(model_name, instruction, budget_data), budget_data
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️  No se pudo guardar en cache LLM: {str(e)[:80]}")
+    return _ai_budget_response(budget_data)
+
+
+def _parse_model_budget(text: str, instruction: str) -> Optional[dict]:
+    """
+    Presupuesto de la respuesta del modelo: JSON tolerante (con o sin bloque
+    ```json, con comas sobrantes o truncado), partidas validadas con
+    schemas.BudgetItem y re-preciadas contra el catalogo. None si no queda
+    ninguna partida valida. Cada resultado se registra en budget_parse_metrics.
+    """
+    data, outcome = parse_json_response(text)
+    if data is None:
+        budget_parse_metrics.record("failed")
+        return None
+    budget = data.get("budget") if isinstance(data.get("budget"), dict) else data
+    metadata = data.get("metadata") if isinstance(data.get("metadata"), dict) else {}
+    budget_data = _budget_from_model_items(budget.get("items") or [], instruction, metadata)
+    budget_parse_metrics.record("invalid" if budget_data is None else outcome)
+    return budget_data
+
+
+def _budget_from_model_items(raw_items: list, instruction: str, metadata: dict) -> Optional[dict]:
+    """
+    Partidas del modelo validadas con schemas.BudgetItem (se descartan las
+    invalidas) y re-preciadas contra el catalogo. None si no queda ninguna.
+    """
+    items = []
+    for raw in raw_items:
+        if isinstance(raw, dict) and "subtotal" not in raw:
+            raw = {**raw, "subtotal": 0}   # se recalcula al re-preciar
+        try:
+            items.append(BudgetItem.model_validate(raw).model_dump())
+        except ValidationError:
             continue
+    if not items:
+        return None
+    # Calidad pedida por el usuario (linea del prompt wizard), si no la que reporta el modelo
+    match = _LINEA_CALIDAD.search(instruction)
+    calidad, _ = detectar_escenario(match.group(1) if match else metadata.get("calidad") or instruction)
+    return {"budget": reconciliar_presupuesto_ia(items, calidad), "metadata": metadata}
+
+
+def _ai_budget_response(budget_data: dict) -> dict:
+    return {
+        "success": True,
+        "analisis": "Presupuesto generado con IA conversacional.",
+        "presupuesto": budget_data.get("budget"),
+        "metadata": budget_data.get("metadata")
+    }
+
+
+async def _budget_from_model(model_name: str, instruction: str) -> dict:
+    """Presupuesto JSON de un modelo; falla si no responde o no trae JSON (intento no aceptable)."""
+    print(f"🔄 Intentando modelo: {model_name}")
+    try:
+        start = time.perf_counter()
+        response = await ai_client.generate_content(model_name, instruction, **BUDGET_GENERATION)
+        usage = getattr(response, "usage_metadata", None)
+        print(f"📏 {model_name}: {getattr(usage, 'prompt_token_count', '?')} tokens prompt, "
+              f"{getattr(usage, 'candidates_token_count', '?')} respuesta, "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        budget_data = _parse_model_budget(response.text, instruction)
+        if budget_data is None:
+            raise ValueError("No se encontró JSON en la respuesta")
+        return budget_data
+    except ai_client.CircuitOpenError as e:
+        print(f"⏭️  {model_name} omitido: {e}")
+        raise
+    except asyncio.TimeoutError:
+        print(f"⏱️ Timeout con {model_name} ({ai_client.GEMINI_TIMEOUT_SECONDS}s)")
+        raise
+    except Exception as e:
+        print(f"❌ Error con {model_name}: {str(e)[:100]}")
+        raise
+
+def _is_offline_capable(item: BudgetRequest) -> bool:
+    """Instrucciones de texto libre (sin formato wizard ni imagen) se resuelven con el catalogo APU."""
+    return "Tipo de proyecto:" not in item.instruction and not item.image
+
+
+def _ndjson_line(index: int, result: dict) -> str:
+    return json.dumps({"index": index, **result}, ensure_ascii=False, default=str) + "\n"
+
+
+@app.post("/analyze_budget/batch")
+async def analyze_budget_batch(batch: BudgetBatchRequest, http_request: Request):
+    """
+    Presupuesta una lista de BudgetRequest en una sola llamada.
+    Los items offline se calculan juntos con el motor vectorizado; el resto
+    pasa por analyze_budget con concurrencia acotada. La respuesta es NDJSON:
+    una linea por item (con su "index") a medida que cada uno termina.
+
+    Los items que van al modelo (cada uno una llamada facturada) requieren
+    usuario autenticado y cuentan uno a uno en el rate limit del cliente.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="El lote no tiene items")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Maximo {BATCH_MAX_ITEMS} items por lote")
+
+    concurrency = max(1, min(batch.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+
+    if batch.mode == "offline":
+        offline = list(range(len(batch.items)))
+    elif batch.mode == "ai":
+        offline = []
+    else:
+        offline = [i for i, item in enumerate(batch.items) if _is_offline_capable(item)]
+    offline_set = set(offline)
+    online = [i for i in range(len(batch.items)) if i not in offline_set]
+
+    if online:
+        if not getattr(http_request.state, "user", None):
+            raise HTTPException(status_code=401, detail="Se requiere autenticacion para presupuestos con IA en lote")
+        # La solicitud del lote ya conto una vez en RateLimitMiddleware
+        allowed, error_message = rate_limiter.is_allowed(get_client_id(http_request), cost=len(online) - 1)
+        if not allowed:
+            raise HTTPException(status_code=429, detail=error_message)
+
+    print(f"\n📦 [LOTE] {len(batch.items)} presupuestos | offline: {len(offline)} | IA: {len(online)} | concurrencia: {concurrency}")
+
+    async def stream():
+        # 1. Offline: sanitizar y calcular todo en una pasada vectorizada
+        instructions, indices = [], []
+        for i in offline:
+            try:
+                instructions.append(InputSanitizer.sanitize_instruction(batch.items[i].instruction))
+                indices.append(i)
+            except ValueError as e:
+                yield _ndjson_line(i, {"success": False, "error": str(e)})
+        if instructions:
+            results = await asyncio.to_thread(generate_budgets_offline, instructions)
+            for i, result in zip(indices, results):
+                yield _ndjson_line(i, result)
+
+        # 2. IA: como maximo `concurrency` llamadas a analyze_budget en paralelo
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(i: int):
+            async with semaphore:
+                try:
+                    return i, await analyze_budget(batch.items[i])
+                except HTTPException as e:
+                    return i, {"success": False, "error": e.detail}
+                except Exception as e:
+                    return i, {"success": False, "error": str(e)[:250]}
+
+        tasks = [asyncio.create_task(run(i)) for i in online]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, result = await next_done
+                yield _ndjson_line(i, result)
+        finally:
+            # Si el cliente se desconecta, no dejar llamadas huerfanas
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/analyze_budget/stream")
+async def analyze_budget_stream(request: BudgetRequest):
+    """
+    Variante Server-Sent Events de /analyze_budget, para no esperar toda la
+    respuesta de Gemini con un spinner. Eventos, cada uno con elapsed_ms:
+      offline -> presupuesto APU del motor local, en milisegundos
+      item    -> cada partida de Gemini apenas el modelo termina de escribirla
+      final   -> presupuesto conciliado: el JSON completo del modelo, o las
+                 partidas validas recibidas si quedo truncado, o el offline si
+                 no hubo IA
+    """
+    start = time.perf_counter()
+    instruction = _prepare_instruction(request.instruction)
+    catalog_version = version_catalogo()
+
+    def elapsed() -> float:
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    async def stream():
+        offline = await asyncio.to_thread(generate_budget_offline, instruction)
+        yield _sse_event("offline", {"elapsed_ms": elapsed(), **offline})
+
+        if llm_cache:
+            cache_keys = {_llm_cache_key(name, instruction, catalog_version): name for name in BUDGET_MODELS}
+            cached = await asyncio.to_thread(llm_cache.get_first, list(cache_keys))
+            if cached:
+                key, budget_data = cached
+                for index, item in enumerate((budget_data.get("budget") or {}).get("items") or []):
+                    yield _sse_event("item", {"index": index, "model": cache_keys[key], "item": item, "elapsed_ms": elapsed()})
+                yield _sse_event("final", {"elapsed_ms": elapsed(), "source": "cache", "model": cache_keys[key],
+                                           **_ai_budget_response(budget_data)})
+                return
+
+        deadline = time.monotonic() + BUDGET_DEADLINE_SECONDS
+        items, model_name, budget_data = [], None, None
+        for name in [m for m in BUDGET_MODELS if ai_client.is_available(m)]:
+            parser = ArrayItemStream("items")
+            try:
+                async for chunk in ai_client.stream_content(
+                        name, instruction, timeout=deadline - time.monotonic(), **BUDGET_GENERATION):
+                    for item in parser.feed(chunk):
+                        items.append(item)
+                        yield _sse_event("item", {"index": len(items) - 1, "model": name, "item": item, "elapsed_ms": elapsed()})
+            except Exception as e:
+                print(f"❌ [STREAM] Error con {name}: {str(e)[:100]}")
+                if items:
+                    # Ya se enviaron partidas de este modelo: no mezclar con otro
+                    model_name = name
+                    break
+                continue
+            budget_data = _parse_model_budget(parser.text, instruction)
+            if budget_data is not None or items:
+                model_name = name
+                break
+
+        partial_data = None
+        if budget_data is None and items:
+            # Respuesta truncada: mismas validaciones y conciliacion que el JSON completo
+            partial_data = _budget_from_model_items(items, instruction, {})
+
+        if budget_data is not None:
+            final = {"source": "ai", "model": model_name, **_ai_budget_response(budget_data)}
+            if llm_cache:
+                try:
+                    await asyncio.to_thread(
+                        llm_cache.set, _reconciled_cache_key(model_name, instruction, budget_data), budget_data
+                    )
+                except sqlite3.Error as e:
+                    print(f"⚠️  No se pudo guardar en cache LLM: {str(e)[:80]}")
+        elif partial_data is not None:
+            final = {"source": "ai_partial", "model": model_name, **_ai_budget_response(partial_data),
+                     "analisis": "Presupuesto generado con IA conversacional (respuesta incompleta)."}
+        else:
+            final = {"source": "offline", **offline}
+        print(f"✅ [STREAM] {final['source']} en {elapsed()} ms ({len(items)} partidas IA)")
+        yield _sse_event("final", {"elapsed_ms": elapsed(), **final})
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.patch("/analyze_budget/lines")
+def patch_budget_lines(patch: BudgetLinesPatch):
+    """
+    Recalculo "what if": aplica cambios de lineas sobre el costo directo
+    actual y retorna solo los totales que cambiaron (costo directo,
+    indirectos, total, IVA) y el nuevo subtotal de cada linea. Cada cambio
+    cuesta O(1); pensado para sliders. 422 si el lote deja el costo
+    directo negativo (se quita mas de lo que el presupuesto tiene).
+    """
+    presupuesto = PresupuestoIncremental(patch.subtotal_directo)
+    anteriores = presupuesto.totales()
+    subtotales = []
+    for delta in patch.deltas:
+        if delta.op == "add":
+            subtotales.append(presupuesto.ajustar(delta.precio_unitario, delta.cantidad))
+        elif delta.op == "delete":
+            presupuesto.ajustar(0, 0, delta.precio_unitario, delta.cantidad)
+            subtotales.append(None)
+        else:
+            if delta.cantidad_anterior is None:
+                raise HTTPException(status_code=422, detail="update requiere cantidad_anterior")
+            precio_anterior = delta.precio_unitario if delta.precio_anterior is None else delta.precio_anterior
+            subtotales.append(presupuesto.ajustar(
+                delta.precio_unitario, delta.cantidad, precio_anterior, delta.cantidad_anterior
+            ))
+    if presupuesto.subtotal_directo < 0:
+        raise HTTPException(status_code=422, detail=(
+            "Los cambios dejan el costo directo negativo: una linea quitada o reducida "
+            "supera el subtotal_directo enviado"
+        ))
+    return {
+        "success": True,
+        "totales": {clave: valor for clave, valor in presupuesto.totales().items()
+                    if anteriores.get(clave) != valor},
+        "subtotales": subtotales
+    }
+
+
+async def _budget_risk(items: list, request: BudgetRiskRequest, authenticated: bool) -> dict:
+    """
+    Corre simular_riesgo fuera del event loop (numpy libera el GIL en el calculo).
+    La memoria y el tiempo crecen con lineas x simulaciones: sobre
+    RISK_PUBLIC_MAX_CELLS se requiere usuario, y nunca sobre RISK_MAX_CELLS.
+    """
+    cells = len(items) * request.simulaciones
+    if cells > RISK_MAX_CELLS:
+        raise HTTPException(status_code=422, detail=(
+            f"Simulacion demasiado grande: lineas x simulaciones no puede superar {RISK_MAX_CELLS:,}"
+        ))
+    if cells > RISK_PUBLIC_MAX_CELLS and not authenticated:
+        raise HTTPException(status_code=401, detail=(
+            f"Simulaciones sobre {RISK_PUBLIC_MAX_CELLS:,} lineas x simulaciones requieren autenticacion"
+        ))
+    try:
+        resultado = await asyncio.to_thread(
+            simular_riesgo,
+            items,
+            {cat: d.model_dump(exclude_none=True) for cat, d in request.distribuciones.items()},
+            request.por_defecto.model_dump(exclude_none=True),
+            request.simulaciones,
+            request.semilla
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"success": True, **resultado}
+
+
+@app.post("/budget/risk")
+async def budget_risk(request: BudgetRiskRequest, http_request: Request):
+    """
+    Simulacion Monte Carlo del costo de un presupuesto: percentiles
+    P50/P80/P95 del total y aporte de cada categoria al riesgo.
+    """
+    if not request.presupuesto or not request.presupuesto.items:
+        raise HTTPException(status_code=422, detail="Se requiere presupuesto con items")
+    items = [item.model_dump() for item in request.presupuesto.items]
+    return await _budget_risk(items, request, authenticated=bool(getattr(http_request.state, "user", None)))
+
+
+def _generated_image_bytes(image_obj) -> bytes:
+    """Bytes PNG de una imagen generada por Imagen."""
+    # Método 1: Usar PIL Image si está disponible
+    if hasattr(image_obj, '_pil_image') and image_obj._pil_image is not None:
+        img_buffer = io.BytesIO()
+        image_obj._pil_image.save(img_buffer, format='PNG', optimize=True)
+        return img_buffer.getvalue()
+    # Método 2: Usar bytes directos
+    if hasattr(image_obj, '_image_bytes'):
+        return image_obj._image_bytes
+    raise ValueError("No se pudo extraer los bytes de la imagen generada")
+
+
+async def _prepare_upload(image: UploadFile) -> Optional[PreparedImage]:
+    """
+    Foto subida -> imagen reducida y sin EXIF para Gemini (ver image_prep).
+    La lectura tiene tope de tamaño (413); la decodificacion corre en un
+    thread. None si el archivo no es una imagen: el render sigue sin contexto.
+    """
+    try:
+        img_content = await read_capped(image)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Imagen demasiado grande (maximo {e.limit / (1024 * 1024):.0f} MB)")
+    if not img_content:
+        return None
+    try:
+        prepared = await asyncio.to_thread(prepare_for_vision, img_content)
+    except Exception as e:
+        print(f"⚠️ Imagen no decodificable ({type(e).__name__}), se omite el analisis")
+        return None
+    report = prepared.report()
+    print(f"🗜️  Imagen {report['original_size'][0]}x{report['original_size'][1]} {report['original_kb']} KB -> "
+          f"{report['sent_size'][0]}x{report['sent_size'][1]} {report['sent_kb']} KB "
+          f"({report['prep_ms']} ms, ~{report['est_upload_ms_saved']} ms de subida ahorrados)")
+    return prepared
 
-    # Si todos los modelos fallaron, usar generador offline
-    print("⚠️ [PRESUPUESTO] Vertex AI no disponible - usando generador offline")
-    return generate_budget_offline(instruction)
 
 @app.post("/generate_sketch")
 async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str = Form(...)):
     print(f"\n🎨 [IMAGEN] Generando render: '{prompt}'")
 
+    prepared = await _prepare_upload(image) if image else None
+
+    # Mismo prompt + misma imagen en curso: se comparte el render
+    key = (prompt.strip(), hashlib.sha256(prepared.data).hexdigest() if prepared else None)
+    result = await sketch_flight.do(key, partial(
+        _generate_sketch, prompt, prepared.data if prepared else None, prepared.mime_type if prepared else None
+    ))
+    if prepared and isinstance(result, dict):
+        result = {**result, "input_image": prepared.report()}
+    return result
+
+
+async def _generate_sketch(prompt: str, img_content: Optional[bytes], content_type: Optional[str]):
     try:
         context_from_image = "a construction site"
         # 1. Analizar imagen original con Gemini para extraer contexto (si existe)
-        if image:
+        if img_content:
             print("📸 Analizando imagen original...")
-            img_content = await image.read()
 
             # Usar Gemini para describir la imagen
             try:
-                vision_model = GenerativeModel("gemini-1.5-flash")
-                image_part = Part.from_data(data=img_content, mime_type=image.content_type)
+                image_part = Part.from_data(data=img_content, mime_type=content_type)
 
                 analysis_prompt = """
                 Describe esta imagen de construcción en inglés técnico.
@@ -310,7 +1027,7 @@ async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str
                 elementos arquitectónicos. Máximo 100 palabras. Sin mencionar personas.
                 """
 
-                analysis = vision_model.generate_content([image_part, analysis_prompt])
+                analysis = await ai_client.generate_content(VISION_MODEL, [image_part, analysis_prompt])
                 context_from_image = analysis.text.strip()
                 print(f"📊 Contexto detectado: {context_from_image[:100]}...")
             except Exception as e:
@@ -320,7 +1037,6 @@ async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str
 
         # 2. Configurar modelo de generación
         print("📡 Conectando a Vertex AI Image Generation...")
-        model = ImageGenerationModel.from_pretrained("imagegeneration@005")
 
         # 3. Crear prompt PRO ultra-realista COMBINANDO imagen + visión del usuario
         safe_prompt = prompt.replace("person", "").replace("people", "").replace("man", "").replace("woman", "").replace("worker", "").replace("astronaut", "")
@@ -342,7 +1058,8 @@ async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str
         print(f"🤖 Generando imagen 1:1...")
 
         # 3. Generar imagen en formato cuadrado (único estable)
-        response = model.generate_images(
+        response = await ai_client.generate_images(
+            IMAGE_MODEL,
             prompt=full_prompt,
             number_of_images=1,
             aspect_ratio="1:1",
@@ -355,18 +1072,8 @@ async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str
         # 4. Convertir imagen a Base64 PNG
         print("🔄 Convirtiendo imagen a PNG...")
 
-        image_obj = response.images[0]
-
-        # Método 1: Usar PIL Image si está disponible
-        if hasattr(image_obj, '_pil_image') and image_obj._pil_image is not None:
-            img_buffer = io.BytesIO()
-            image_obj._pil_image.save(img_buffer, format='PNG', optimize=True)
-            img_bytes = img_buffer.getvalue()
-        # Método 2: Usar bytes directos
-        elif hasattr(image_obj, '_image_bytes'):
-            img_bytes = image_obj._image_bytes
-        else:
-            raise ValueError("No se pudo extraer los bytes de la imagen generada")
+        # La compresion PNG es CPU: fuera del event loop
+        img_bytes = await asyncio.to_thread(_generated_image_bytes, response.images[0])
 
         # 5. Codificar en Base64
         base64_str = base64.b64encode(img_bytes).decode('utf-8')
@@ -390,7 +1097,13 @@ async def generate_sketch(image: Optional[UploadFile] = File(None), prompt: str
         user_message = "Error al generar imagen. Intenta con otra descripción."
         status_code = 500
 
-        if "DefaultCredentialsError" in error_msg or "permission_denied" in error_msg.lower() or "403" in error_msg:
+        if isinstance(e, asyncio.TimeoutError):
+            user_message = "El servicio de IA tardó demasiado en responder. Intenta nuevamente."
+            status_code = 504 # Gateway Timeout
+        elif isinstance(e, ai_client.CircuitOpenError):
+            user_message = "Modelo de generación temporalmente no disponible. Intenta nuevamente en unos minutos."
+            status_code = 503 # Service Unavailable
+        elif "DefaultCredentialsError" in error_msg or "permission_denied" in error_msg.lower() or "403" in error_msg:
             user_message = "Error de autenticación con el servicio de IA. (Permissions Error)"
             status_code = 503 # Service Unavailable
             print("🚨 DETECTADO ERROR DE PERMISOS DE GOOGLE CLOUD. Verifica que el service account de Cloud Run tenga el rol 'Vertex AI User'.")
@@ -483,6 +1196,27 @@ async def get_project(project_id: str, request: Request):
     p.id = project.id
     return p
 
+@app.post("/api/v1/projects/{project_id}/risk")
+async def project_budget_risk(project_id: str, request: Request, risk: BudgetRiskRequest):
+    """
+    Runs the Monte Carlo cost-risk simulation on a stored project budget.
+    """
+    user_id = request.state.user["uid"]
+    db = firebase_service.get_db()
+
+    project = db.collection("projects").document(project_id).get()
+    if not project.exists:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    project_data = project.to_dict()
+    if user_id not in project_data.get("collaborators", {}):
+        raise HTTPException(status_code=403, detail="Not authorized to access this project")
+
+    items = [item.model_dump() for item in Project.parse_obj(project_data).budget.items]
+    if not items:
+        raise HTTPException(status_code=422, detail="Project budget has no items")
+    return await _budget_risk(items, risk, authenticated=True)
+
 @app.put("/api/v1/projects/{project_id}", response_model=Project)
 async def update_project(project_id: str, project_update: Project, request: Request):
     """
@@ -1,7 +1,36 @@
 """
 Prompt para generar presupuestos desde respuestas del Wizard
-Usa el proyecto LOICA como referencia
+Usa el proyecto LOICA como referencia y solo las partidas APU relevantes
+del catalogo local (recuperadas con el indice de busqueda), para que el
+modelo no invente partidas ni escriba respuestas largas.
 """
+import os
+
+from apu_catalog import IMPREVISTOS_PRESUPUESTO_IA, buscar_filas, snapshot_actual
+from llm_json import schema_outline
+from schemas import AIBudgetResponse
+
+# Partidas del catalogo incluidas en el prompt: las mas relevantes para el
+# proyecto y algunas de cada fase que todo proyecto necesita
+APU_PROMPT_TOP_K = int(os.getenv("APU_PROMPT_TOP_K", "12"))
+APU_PROMPT_POR_FASE = 2
+FASES_BASE = (
+    "escarpe excavacion",
+    "hormigon fundaciones radier",
+    "punto electrico tablero",
+    "pintura",
+)
+
+# Claves del wizard tal como llegan desde la instruccion (main._prepare_instruction)
+CLAVES_WIZARD = {
+    "tipo": "type",
+    "dimensiones": "dimensions",
+    "calidad": "quality",
+    "nivel_de_calidad": "quality",
+    "detalles": "details",
+    "ubicación": "location",
+    "ubicacion": "location",
+}
 
 LOICA_REFERENCE = """
 EJEMPLO DE PROYECTO PROFESIONAL (Central Loica):
@@ -17,13 +46,40 @@ EJEMPLO DE PROYECTO PROFESIONAL (Central Loica):
 - Total: ~$8,000,000 CLP
 """
 
-def build_wizard_prompt(answers: dict) -> str:
-    """Construye prompt para Gemini desde respuestas del wizard"""
+# Esquema de salida derivado de schemas.AIBudgetResponse (el mismo que valida la respuesta)
+FORMATO_SALIDA = schema_outline(AIBudgetResponse)
+# Pedido de formato: con salida JSON configurada (response_mime_type / response_schema)
+# el modelo ya entrega el objeto sin bloque de codigo; sin ella, se pide el bloque
+SALIDA_JSON = "Responde solo con el objeto JSON, sin bloque de codigo ni texto adicional"
+SALIDA_BLOQUE = "Responde solo con un bloque ```json, sin texto adicional"
+
+
+def partidas_relevantes(answers: dict, top_k: int = APU_PROMPT_TOP_K) -> list:
+    """Filas del catalogo vigente para el prompt: top_k por tipo/detalles + las de cada fase base."""
+    snapshot = snapshot_actual()
+    consulta = f"{answers.get('type', '')} {answers.get('details', '')}"
+    filas = [fila for fila, _ in buscar_filas(consulta, top_k, ranking="bm25", snapshot=snapshot)]
+    for fase in FASES_BASE:
+        filas += [fila for fila, _ in buscar_filas(fase, APU_PROMPT_POR_FASE, ranking="bm25", snapshot=snapshot)]
+    catalogo = snapshot.catalogo
+    return [
+        (catalogo.codigo(fila), catalogo.desc(fila), catalogo.unidad(fila), catalogo.precio(fila))
+        for fila in dict.fromkeys(filas)
+    ]
+
+
+def build_wizard_prompt(answers: dict, top_k: int = APU_PROMPT_TOP_K, json_mode: bool = False) -> str:
+    """
+    Construye prompt para Gemini desde respuestas del wizard.
+    json_mode: la llamada usa la generation config JSON (main.BUDGET_GENERATION).
+    """
+    answers = {CLAVES_WIZARD.get(clave, clave): valor for clave, valor in answers.items()}
+    tabla = "\n".join(
+        f"{codigo}|{desc}|{unidad}|{precio}" for codigo, desc, unidad, precio in partidas_relevantes(answers, top_k)
+    )
     return f"""
 Eres un experto en presupuestación de construcción en Chile.
-
 {LOICA_REFERENCE}
-
 PROYECTO DEL USUARIO:
 - Tipo: {answers.get('type', 'No especificado')}
 - Dimensiones: {answers.get('dimensions', 'No especificado')}
@@ -31,21 +87,14 @@ PROYECTO DEL USUARIO:
 - Detalles: {answers.get('details', 'Ninguno')}
 - Ubicación: {answers.get('location', 'Chile central')}
 
+PARTIDAS APU (codigo|descripcion|unidad|precio CLP):
+{tabla}
+
 INSTRUCCIONES:
-1. Genera un presupuesto DETALLADO similar al ejemplo LOICA
-2. Incluye TODAS las partidas necesarias del catálogo APU
-3. Considera la calidad solicitada: 
-   - Económico: materiales básicos, -20% en precios
-   - Estándar: precios normales APU
-   - Premium: materiales premium, +30% en precios
-4. Ajusta por ubicación si es necesario
-5. Incluye:
-   - Movimiento de tierras
-   - Fundaciones
-   - Estructura
-   - Instalaciones
-   - Terminaciones
-   - Imprevistos (10%)
-
-FORMATO DE SALIDA: JSON con estructura Budget
-"""
\ No newline at end of file
+1. Usa solo partidas de la tabla (codigo en apu_origen, su unidad y precio); entre 8 y 20 items
+2. Calcula cantidades según las dimensiones; subtotal = cantidad x precio_unitario
+3. Calidad: Económico -20% en precios, Estándar precio APU, Premium +30%
+4. Imprevistos {IMPREVISTOS_PRESUPUESTO_IA:.0%} en total_contingency
+5. {SALIDA_JSON if json_mode else SALIDA_BLOQUE}:
+{FORMATO_SALIDA}
+"""
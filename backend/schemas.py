@@ -37,6 +37,16 @@ class Budget(BaseModel):
     total_final: float = 0
     currency: Literal["CLP", "USD", "EUR"] = "CLP"
 
+class BudgetMetadata(BaseModel):
+    tipo: Optional[str] = None
+    area_m2: Optional[float] = None
+    calidad: Optional[str] = None
+
+class AIBudgetResponse(BaseModel):
+    """Respuesta esperada de Gemini en /analyze_budget (esquema de salida del modelo)."""
+    budget: Budget
+    metadata: Optional[BudgetMetadata] = None
+
 class Collaborator(BaseModel):
     role: Literal["owner", "editor", "viewer"] = "viewer"
     invited_at: datetime = Field(default_factory=datetime.utcnow)
@@ -51,3 +61,36 @@ class Project(BaseModel):
 class BudgetRequest(BaseModel):
     instruction: str
     image: Optional[str] = None # Optional base64 encoded image
+
+class BudgetBatchRequest(BaseModel):
+    items: List[BudgetRequest] = Field(max_length=500) # Tope duro; BATCH_MAX_ITEMS puede bajarlo
+    concurrency: Optional[int] = None # Max llamadas IA en paralelo (acotado por BATCH_MAX_CONCURRENCY)
+    mode: Literal["auto", "offline", "ai"] = "auto" # auto: texto libre offline, wizard/imagen con IA
+
+class BudgetLineDelta(BaseModel):
+    op: Literal["add", "update", "delete"]
+    precio_unitario: float = Field(ge=0)
+    cantidad: float = Field(ge=0)
+    precio_anterior: Optional[float] = Field(default=None, ge=0) # update: por defecto el mismo precio
+    cantidad_anterior: Optional[float] = Field(default=None, ge=0) # update: requerido
+
+class BudgetLinesPatch(BaseModel):
+    subtotal_directo: float = Field(ge=0) # Costo directo actual del presupuesto
+    deltas: List[BudgetLineDelta] = Field(min_length=1, max_length=200)
+
+class RiskDistribution(BaseModel):
+    precio: Optional[List[float]] = Field(default=None, min_length=3, max_length=3) # [min, moda, max] como factor (1.0 = base)
+    cantidad: Optional[List[float]] = Field(default=None, min_length=3, max_length=3)
+
+class RiskBudgetItem(BudgetItem):
+    categoria: Optional[str] = None # Items offline la traen; si no, se deduce del codigo APU
+
+class RiskBudget(BaseModel):
+    items: List[RiskBudgetItem] = Field(default=[], max_length=1000)
+
+class BudgetRiskRequest(BaseModel):
+    presupuesto: Optional[RiskBudget] = None # Presupuesto de /analyze_budget o Project.budget (se usan sus items)
+    distribuciones: dict[str, RiskDistribution] = {} # Categoria -> incertidumbre
+    por_defecto: RiskDistribution = Field(default_factory=RiskDistribution)
+    simulaciones: int = Field(default=100_000, ge=1_000, le=2_000_000)
+    semilla: Optional[int] = None
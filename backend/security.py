@@ -7,6 +7,7 @@ import time
 from collections import defaultdict
 from typing import Optional
 from fastapi import Request, HTTPException
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 
@@ -41,31 +42,35 @@ class RateLimiter:
             if current_time - t < 3600
         ]
 
-    def is_allowed(self, client_id: str) -> tuple[bool, Optional[str]]:
+    def is_allowed(self, client_id: str, cost: int = 1) -> tuple[bool, Optional[str]]:
         """
-        Check if the client is allowed to make a request.
+        Check if the client is allowed to make a request worth `cost`
+        requests (e.g. a batch charging one per billed AI item).
         Returns (allowed, error_message)
         """
         self._cleanup_old_requests(client_id)
         current_time = time.time()
 
         # Check minute limit
-        if len(self.minute_requests[client_id]) >= self.requests_per_minute:
-            return False, "Rate limit exceeded. Max 60 requests per minute."
+        if len(self.minute_requests[client_id]) + cost > self.requests_per_minute:
+            return False, f"Rate limit exceeded. Max {self.requests_per_minute} requests per minute."
 
         # Check hour limit
-        if len(self.hour_requests[client_id]) >= self.requests_per_hour:
-            return False, "Rate limit exceeded. Max 500 requests per hour."
+        if len(self.hour_requests[client_id]) + cost > self.requests_per_hour:
+            return False, f"Rate limit exceeded. Max {self.requests_per_hour} requests per hour."
 
         # Record this request
-        self.minute_requests[client_id].append(current_time)
-        self.hour_requests[client_id].append(current_time)
+        self.minute_requests[client_id].extend([current_time] * cost)
+        self.hour_requests[client_id].extend([current_time] * cost)
 
         return True, None
 
 
-# Global rate limiter instance
+# Global rate limiter instances
 rate_limiter = RateLimiter()
+# /analyze_budget/lines is pure arithmetic driven by UI sliders (many updates
+# per second): its own, higher budget instead of the global one
+slider_rate_limiter = RateLimiter(requests_per_minute=600, requests_per_hour=12000)
 
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
@@ -74,6 +79,8 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     """
     # Paths exempt from rate limiting
     EXEMPT_PATHS = ["/", "/docs", "/openapi.json"]
+    # Paths with their own limiter
+    PATH_LIMITERS = {"/analyze_budget/lines": slider_rate_limiter}
 
     async def dispatch(self, request: Request, call_next) -> Response:
         # Skip rate limiting for exempt paths
@@ -81,10 +88,11 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             return await call_next(request)
 
         # Get client identifier (IP or user ID if authenticated)
-        client_id = self._get_client_id(request)
+        client_id = get_client_id(request)
 
         # Check rate limit
-        allowed, error_message = rate_limiter.is_allowed(client_id)
+        limiter = self.PATH_LIMITERS.get(request.url.path, rate_limiter)
+        allowed, error_message = limiter.is_allowed(client_id)
 
         if not allowed:
             return Response(
@@ -95,18 +103,19 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
 
         return await call_next(request)
 
-    def _get_client_id(self, request: Request) -> str:
-        """Get a unique identifier for the client."""
-        # Try to get user ID from state (if authenticated)
-        if hasattr(request.state, 'user') and request.state.user:
-            return f"user:{request.state.user.get('uid', 'unknown')}"
 
-        # Fall back to IP address
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return f"ip:{forwarded.split(',')[0].strip()}"
+def get_client_id(request: Request) -> str:
+    """Get a unique identifier for the client."""
+    # Try to get user ID from state (if authenticated)
+    if hasattr(request.state, 'user') and request.state.user:
+        return f"user:{request.state.user.get('uid', 'unknown')}"
 
-        return f"ip:{request.client.host if request.client else 'unknown'}"
+    # Fall back to IP address
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return f"ip:{forwarded.split(',')[0].strip()}"
+
+    return f"ip:{request.client.host if request.client else 'unknown'}"
 
 
 # =====================================================
@@ -227,6 +236,38 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         return response
 
 
+# =====================================================
+# UPLOAD SIZE LIMIT
+# =====================================================
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject requests whose declared Content-Length exceeds the limit for
+    their path (413), before the multipart body is read and spooled.
+    Chunked uploads without a length are capped by the endpoint itself.
+    Plain ASGI (not BaseHTTPMiddleware): requests that pass cost one dict
+    lookup, without an extra task per request.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is not None:
+            content_length = Headers(scope=scope).get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                response = Response(
+                    content=f'{{"detail": "Request body too large. Max {limit // (1024 * 1024)} MB."}}',
+                    status_code=413,
+                    media_type="application/json"
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
 # =====================================================
 # REQUEST LOGGING
 # =====================================================
@@ -0,0 +1,14 @@
+"""
+Configuracion comun de las pruebas: backend/ en sys.path y la app sin
+Vertex AI real (fake_vertex), sin cache LLM ni registro de uso en disco.
+"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("AI_BACKEND", "fake")
+os.environ.setdefault("AI_WARMUP", "0")
+os.environ.setdefault("LLM_CACHE_PATH", "")
+os.environ.setdefault("USAGE_DB_PATH", "")
@@ -0,0 +1,59 @@
+"""FirebaseAuthMiddleware: token opcional verificado fuera del event loop y contexto de medicion de uso."""
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth_middleware
+import main
+import usage_meter
+
+
+@pytest.fixture
+def verificaciones(monkeypatch):
+    hilos = []
+
+    def verify_id_token(token):
+        hilos.append(threading.current_thread())
+        return {"uid": "u-" + token}
+
+    monkeypatch.setattr(auth_middleware.auth, "verify_id_token", verify_id_token)
+    return hilos
+
+
+def test_token_opcional_se_verifica_en_un_thread_y_atribuye_el_uso(monkeypatch, verificaciones):
+    contextos, hilo_loop = [], []
+
+    async def hedged(attempts, **kwargs):
+        hilo_loop.append(threading.current_thread())
+        contextos.append(usage_meter.current())
+        raise RuntimeError("sin modelos")   # respaldo offline
+
+    monkeypatch.setattr(main.ai_client, "hedged", hedged)
+    r = TestClient(main.app).post("/analyze_budget", json={"instruction": "radier 20 m2 galpon"},
+                                  headers={"Authorization": "Bearer 7", "X-Forwarded-For": "10.10.0.1"})
+    assert r.status_code == 200
+    assert contextos == [("/analyze_budget", "u-7")]
+    assert verificaciones and verificaciones[0] is not hilo_loop[0]
+
+
+def test_sin_token_el_uso_es_anonimo(monkeypatch, verificaciones):
+    contextos = []
+
+    async def hedged(attempts, **kwargs):
+        contextos.append(usage_meter.current())
+        raise RuntimeError("sin modelos")
+
+    monkeypatch.setattr(main.ai_client, "hedged", hedged)
+    r = TestClient(main.app).post("/analyze_budget", json={"instruction": "radier 20 m2 bodega norte"},
+                                  headers={"X-Forwarded-For": "10.10.0.2"})
+    assert r.status_code == 200
+    assert contextos == [("/analyze_budget", None)]
+    assert verificaciones == []
+
+
+def test_upload_sobre_el_tope_es_413():
+    limite = main.MAX_UPLOAD_BYTES + 64 * 1024
+    r = TestClient(main.app).post("/generate_sketch", content=b"x" * (limite + 1),
+                                  headers={"Content-Type": "application/octet-stream", "X-Forwarded-For": "10.10.0.3"})
+    assert r.status_code == 413
@@ -0,0 +1,45 @@
+"""/analyze_budget/batch: items que van al modelo requieren usuario y cuentan en el rate limit."""
+import pytest
+from fastapi.testclient import TestClient
+
+import auth_middleware
+import main
+
+WIZARD = "Tipo de proyecto: Quincho\nDimensiones: 30 m2\nCalidad: Estándar"
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def usuario(monkeypatch):
+    monkeypatch.setattr(auth_middleware.auth, "verify_id_token", lambda token: {"uid": f"u-{token}"})
+    return {"Authorization": "Bearer lote"}
+
+
+def test_lote_ia_anonimo_rechazado(client):
+    r = client.post("/analyze_budget/batch", json={"items": [{"instruction": WIZARD}], "mode": "ai"},
+                    headers={"X-Forwarded-For": "10.9.0.1"})
+    assert r.status_code == 401
+
+
+def test_lote_offline_anonimo_permitido(client):
+    r = client.post("/analyze_budget/batch", json={"items": [{"instruction": "radier 20 m2"}] * 3},
+                    headers={"X-Forwarded-For": "10.9.0.2"})
+    assert r.status_code == 200
+    assert len(r.text.strip().splitlines()) == 3
+
+
+def test_lote_ia_cobra_rate_limit_por_item(client, usuario):
+    items = [{"instruction": f"{WIZARD}\nDetalles: {i}"} for i in range(main.rate_limiter.requests_per_minute + 1)]
+    r = client.post("/analyze_budget/batch", json={"items": items, "mode": "ai"}, headers=usuario)
+    assert r.status_code == 429
+
+
+def test_esquema_limita_items(client):
+    items = [{"instruction": "radier 20 m2"}] * 501
+    r = client.post("/analyze_budget/batch", json={"items": items, "mode": "offline"},
+                    headers={"X-Forwarded-For": "10.9.0.3"})
+    assert r.status_code == 422
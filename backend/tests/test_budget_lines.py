@@ -0,0 +1,63 @@
+"""/analyze_budget/lines: recalculo incremental y su propio rate limit."""
+from fastapi.testclient import TestClient
+
+import main
+from security import slider_rate_limiter
+
+
+def test_add_update_delete_en_o1():
+    client = TestClient(main.app)
+    r = client.patch("/analyze_budget/lines", headers={"X-Forwarded-For": "10.8.0.1"}, json={
+        "subtotal_directo": 100000,
+        "deltas": [
+            {"op": "add", "precio_unitario": 1000, "cantidad": 10},
+            {"op": "update", "precio_unitario": 2000, "cantidad": 5, "precio_anterior": 1000, "cantidad_anterior": 10},
+            {"op": "delete", "precio_unitario": 500, "cantidad": 20},
+        ],
+    })
+    assert r.status_code == 200
+    body = r.json()
+    assert body["subtotales"] == [10000, 10000, None]
+    # +10000 (add), 10000 -> 10000 (update), -10000 (delete): ningun total cambia
+    assert body["totales"] == {}
+
+
+def test_solo_totales_que_cambian():
+    client = TestClient(main.app)
+    r = client.patch("/analyze_budget/lines", headers={"X-Forwarded-For": "10.8.0.3"}, json={
+        "subtotal_directo": 100000,
+        "deltas": [{"op": "add", "precio_unitario": 1000, "cantidad": 10}],
+    })
+    assert r.status_code == 200
+    totales = r.json()["totales"]
+    assert totales["subtotal_directo"] == 110000
+    assert totales["total_con_iva"] > totales["total_estimado"] > 110000
+    assert "moneda" not in totales and "iva_incluido" not in totales
+
+
+def test_costo_directo_negativo_es_422():
+    client = TestClient(main.app)
+    cabeceras = {"X-Forwarded-For": "10.8.0.4"}
+    quitar = {"op": "delete", "precio_unitario": 1000, "cantidad": 20}
+    bajar = {"op": "update", "precio_unitario": 1000, "cantidad": 0, "cantidad_anterior": 20}
+    for delta in (quitar, bajar):
+        r = client.patch("/analyze_budget/lines", headers=cabeceras,
+                         json={"subtotal_directo": 10000, "deltas": [delta]})
+        assert r.status_code == 422
+    # Negativo solo a mitad del lote: el resultado final es valido
+    r = client.patch("/analyze_budget/lines", headers=cabeceras, json={
+        "subtotal_directo": 10000,
+        "deltas": [quitar, {"op": "add", "precio_unitario": 1000, "cantidad": 15}],
+    })
+    assert r.status_code == 200
+    assert r.json()["totales"]["subtotal_directo"] == 5000
+
+
+def test_tiene_rate_limit_propio():
+    client = TestClient(main.app)
+    cabeceras = {"X-Forwarded-For": "10.8.0.2"}
+    patch = {"subtotal_directo": 0, "deltas": [{"op": "add", "precio_unitario": 1, "cantidad": 1}]}
+    codigos = [client.patch("/analyze_budget/lines", json=patch, headers=cabeceras).status_code
+               for _ in range(slider_rate_limiter.requests_per_minute + 1)]
+    assert codigos[:-1] == [200] * slider_rate_limiter.requests_per_minute
+    assert codigos[-1] == 429
@@ -0,0 +1,45 @@
+"""/budget/risk: items validados (422, no 500) y tope de trabajo sin usuario."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ITEM = {"elemento": "Radier", "descripcion": "Radier H20", "cantidad": 20, "unidad": "m2",
+        "precio_unitario": 18500, "subtotal": 370000, "apu_origen": "APU Pro C-002"}
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def _riesgo(client, items, simulaciones=1000, ip="10.7.0.1"):
+    return client.post("/budget/risk", headers={"X-Forwarded-For": ip},
+                       json={"presupuesto": {"items": items}, "simulaciones": simulaciones, "semilla": 1})
+
+
+def test_presupuesto_offline_simula(client):
+    items = main.generate_budget_offline("radier 40 m2")["presupuesto"]["items"]
+    r = _riesgo(client, items)
+    assert r.status_code == 200
+    assert r.json()["percentiles"]["P80"]["total_estimado"] > 0
+
+
+@pytest.mark.parametrize("item", [
+    {k: v for k, v in ITEM.items() if k != "precio_unitario"},
+    {**ITEM, "apu_origen": None},
+    "no es un item",
+])
+def test_items_invalidos_son_422(client, item):
+    assert _riesgo(client, [item]).status_code == 422
+
+
+def test_trabajo_grande_sin_usuario_requiere_autenticacion(client):
+    simulaciones = 2_000_000
+    lineas = main.RISK_PUBLIC_MAX_CELLS // simulaciones + 1
+    r = _riesgo(client, [ITEM] * lineas, simulaciones=simulaciones, ip="10.7.0.2")
+    assert r.status_code == 401
+
+
+def test_esquema_limita_items(client):
+    assert _riesgo(client, [ITEM] * 1001, ip="10.7.0.3").status_code == 422
@@ -0,0 +1,30 @@
+"""POST /catalog/reload: solo administradores (custom claim admin)."""
+import pytest
+from fastapi.testclient import TestClient
+
+import auth_middleware
+import main
+
+
+@pytest.fixture
+def token(monkeypatch):
+    claims = {}
+    monkeypatch.setattr(auth_middleware.auth, "verify_id_token", lambda _: dict(claims))
+    return claims
+
+
+def _recargar(ip):
+    return TestClient(main.app).post("/catalog/reload", headers={
+        "Authorization": "Bearer x", "X-Forwarded-For": ip})
+
+
+def test_usuario_sin_claim_admin_es_403(token):
+    token.update(uid="u1")
+    assert _recargar("10.9.0.1").status_code == 403
+
+
+def test_admin_recarga(token):
+    token.update(uid="u2", admin=True)
+    r = _recargar("10.9.0.2")
+    assert r.status_code == 200
+    assert r.json()["catalog"]["version"] == main.version_catalogo()
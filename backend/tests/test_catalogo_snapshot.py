@@ -0,0 +1,42 @@
+"""Busqueda y precios con un catalogo recargado que no tiene todas las categorias base."""
+import apu_catalog
+from apu_catalog import APU_CATALOG, buscar_filas, calcular_presupuestos_lote, construir_snapshot, detectar_keywords
+
+
+def _snapshot_sin(categoria: str):
+    return construir_snapshot({k: v for k, v in APU_CATALOG.items() if k != categoria}, "prueba")
+
+
+def test_fallback_sin_revestimientos_no_falla():
+    snapshot = _snapshot_sin("revestimientos")
+    assert buscar_filas("qwzx", snapshot=snapshot) == []
+
+
+def test_calces_de_otra_version_se_ignoran():
+    calces = detectar_keywords("pintura interior 40 m2")   # snapshot vigente
+    assert any(c.categoria == "revestimientos" for c in calces)
+
+    snapshot = _snapshot_sin("revestimientos")
+    presupuesto, = calcular_presupuestos_lote([("pintura interior 40 m2", 40, None)], calces=[calces],
+                                             snapshot=snapshot)
+    assert presupuesto["catalogo_version"] == snapshot.version
+
+
+def test_lote_usa_el_snapshot_entregado():
+    snapshot = _snapshot_sin("revestimientos")
+    vigente = apu_catalog.snapshot_actual()
+    presupuesto, = calcular_presupuestos_lote([("radier 20 m2", 20, None)], snapshot=snapshot)
+    assert presupuesto["catalogo_version"] == snapshot.version != vigente.version
+
+
+def test_offline_nombra_la_categoria_con_el_snapshot_que_precio(monkeypatch):
+    import main
+    renombrado = {k: dict(v) for k, v in APU_CATALOG.items()}
+    renombrado["fundacion"]["nombre"] = "Fundaciones v2"
+    snapshot = construir_snapshot(renombrado, "prueba")
+    monkeypatch.setattr(main, "snapshot_actual", lambda: snapshot)
+
+    respuesta = main.generate_budget_offline("radier 20 m2 patio v2")
+    assert respuesta["metadata"]["categoria"] == "Fundaciones v2"
+    assert "Categoria detectada: Fundaciones v2" in respuesta["analisis"]
+    assert respuesta["metadata"]["catalogo_version"] == snapshot.version
@@ -0,0 +1,31 @@
+"""Apertura del circuit breaker: errores fatales de inmediato, cuota (429) por tasa de error."""
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from circuit_breaker import CircuitBreaker
+
+
+def _falla(breaker, error):
+    with pytest.raises(type(error)):
+        breaker.call(lambda: (_ for _ in ()).throw(error))
+
+
+def test_un_429_no_abre_el_circuito():
+    breaker = CircuitBreaker("m", window=10, min_calls=5, error_rate=0.5)
+    for _ in range(4):
+        breaker.call(lambda: "ok")
+    _falla(breaker, api_exceptions.ResourceExhausted("quota"))
+    assert breaker.state == "closed"
+
+
+def test_429_frecuentes_abren_por_tasa_de_error():
+    breaker = CircuitBreaker("m", window=10, min_calls=5, error_rate=0.5)
+    for _ in range(5):
+        _falla(breaker, api_exceptions.ResourceExhausted("quota"))
+    assert breaker.state == "open"
+
+
+def test_404_abre_de_inmediato():
+    breaker = CircuitBreaker("m", window=10, min_calls=5, error_rate=0.5)
+    _falla(breaker, api_exceptions.NotFound("modelo"))
+    assert breaker.state == "open"
@@ -0,0 +1,27 @@
+"""json_generation_config: esquema cuando el SDK lo soporta, respaldo con SDK antiguos."""
+import ai_client
+
+SCHEMA = {"type": "object", "properties": {"items": {"type": "array", "items": {"type": "object"}}}}
+
+
+class _ConfigNuevo:
+    def __init__(self, temperature=None, response_mime_type=None, response_schema=None):
+        self.response_mime_type = response_mime_type
+        self.response_schema = response_schema
+
+
+class _ConfigAntiguo:
+    def __init__(self, temperature=None):
+        pass
+
+
+def test_sdk_con_response_schema(monkeypatch):
+    monkeypatch.setattr(ai_client, "GenerationConfig", _ConfigNuevo)
+    config = ai_client.json_generation_config(SCHEMA)
+    assert config.response_mime_type == "application/json"
+    assert config.response_schema == SCHEMA
+
+
+def test_sdk_antiguo_sin_config(monkeypatch):
+    monkeypatch.setattr(ai_client, "GenerationConfig", _ConfigAntiguo)
+    assert ai_client.json_generation_config(SCHEMA) is None
@@ -0,0 +1,31 @@
+"""Escenario (calidad / region) del presupuesto offline para instrucciones wizard y de texto libre."""
+import main
+
+WIZARD_PREMIUM_TEMUCO = (
+    "Tipo de proyecto: Casa\n"
+    "Dimensiones: 80 m2\n"
+    "Calidad: Premium\n"
+    "Detalles: dos pisos, porcelanato y termopaneles\n"
+    "Ubicación: Temuco"
+)
+
+
+def test_wizard_premium_usa_la_calidad_del_usuario():
+    prompt = main._prepare_instruction(WIZARD_PREMIUM_TEMUCO)
+    # El prompt nombra todas las calidades en sus instrucciones
+    assert "Económico" in prompt and "Premium" in prompt
+
+    seleccionado = main.generate_budget_offline(prompt)["presupuesto"]["escenarios"]["seleccionado"]
+    assert seleccionado["calidad"] == "premium"
+    assert seleccionado["region"] == "araucania"
+
+
+def test_wizard_sin_calidad_ni_region_usa_valores_por_defecto():
+    prompt = main._prepare_instruction("Tipo de proyecto: Quincho\nDimensiones: 30 m2")
+    seleccionado = main.generate_budget_offline(prompt)["presupuesto"]["escenarios"]["seleccionado"]
+    assert (seleccionado["calidad"], seleccionado["region"]) == ("estandar", "metropolitana")
+
+
+def test_texto_libre_detecta_calidad_y_region_en_la_instruccion():
+    seleccionado = main.generate_budget_offline("radier 40 m2 economico en Antofagasta")["presupuesto"]["escenarios"]["seleccionado"]
+    assert (seleccionado["calidad"], seleccionado["region"]) == ("economico", "antofagasta")
@@ -0,0 +1,69 @@
+"""_generate_ai_budget: clave de cache con la version conciliada y tarea offline descartada sin ruido."""
+import asyncio
+import gc
+
+import pytest
+
+import main
+from apu_catalog import APU_CATALOG, construir_snapshot, reconciliar_presupuesto_ia
+
+INSTRUCCION = "radier 20 m2 patio"
+ITEM = {"elemento": "Radier", "descripcion": "Radier H20", "cantidad": 20, "unidad": "m2",
+        "precio_unitario": 18500, "subtotal": 370000, "apu_origen": "APU Pro C-002"}
+
+
+class _CacheMemoria:
+    def __init__(self):
+        self.guardado = {}
+
+    def get_first(self, keys):
+        return None
+
+    def set(self, key, value):
+        self.guardado[key] = value
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = _CacheMemoria()
+    monkeypatch.setattr(main, "llm_cache", cache)
+    return cache
+
+
+def test_cache_usa_la_version_con_que_se_concilio(monkeypatch, cache):
+    # Recarga entre la lectura de la version y la conciliacion
+    nuevo = construir_snapshot({k: dict(v) for k, v in APU_CATALOG.items() if k != "pisos"}, "prueba")
+    budget_data = {"budget": reconciliar_presupuesto_ia([ITEM], snapshot=nuevo), "metadata": {}}
+
+    async def hedged(attempts, **kwargs):
+        return "gemini-pro", budget_data
+
+    monkeypatch.setattr(main.ai_client, "hedged", hedged)
+    asyncio.run(main._generate_ai_budget(INSTRUCCION))
+    assert list(cache.guardado) == [main._llm_cache_key("gemini-pro", INSTRUCCION, nuevo.version)]
+    assert nuevo.version != main.version_catalogo()
+
+
+def test_solicitud_cancelada_no_deja_error_offline_sin_consumir(monkeypatch, cache):
+    def offline_que_falla(instruction):
+        raise RuntimeError("fallo offline")
+
+    async def hedged(attempts, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(main, "generate_budget_offline", offline_que_falla)
+    monkeypatch.setattr(main.ai_client, "hedged", hedged)
+    reportes = []
+
+    async def correr():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: reportes.append(context))
+        solicitud = asyncio.ensure_future(main._generate_ai_budget(INSTRUCCION))
+        await asyncio.sleep(0.1)   # la tarea offline ya termino con error
+        solicitud.cancel()         # p. ej. el cliente del lote se desconecto
+        with pytest.raises(asyncio.CancelledError):
+            await solicitud
+        del solicitud
+        gc.collect()
+
+    asyncio.run(correr())
+    assert reportes == []
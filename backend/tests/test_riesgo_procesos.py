@@ -0,0 +1,30 @@
+"""Pool de procesos de la simulacion de riesgo: spawn, ciclo de vida explicito y mismo resultado."""
+import multiprocessing
+
+import pytest
+
+import apu_riesgo
+import main
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(apu_riesgo, "BLOQUE", 5_000)
+    monkeypatch.setattr(apu_riesgo, "UMBRAL_PROCESOS", 10_000)
+    pool = apu_riesgo.iniciar_procesos(2)
+    yield pool
+    apu_riesgo.detener_procesos()
+
+
+def test_procesos_con_spawn_dan_el_mismo_resultado(pool):
+    assert pool._mp_context.get_start_method() == "spawn"
+    items = main.generate_budget_offline("radier 40 m2")["presupuesto"]["items"]
+    en_pool = apu_riesgo.simular_riesgo(items, simulaciones=20_000, semilla=3)
+    local = apu_riesgo.simular_riesgo(items, simulaciones=20_000, semilla=3, en_procesos=False)
+    assert en_pool["percentiles"] == local["percentiles"]
+
+
+def test_sin_iniciar_no_hay_pool():
+    apu_riesgo.detener_procesos()
+    assert apu_riesgo._pool is None
+    assert apu_riesgo.iniciar_procesos(0) is None
@@ -0,0 +1,42 @@
+"""/analyze_budget/stream: respuesta truncada -> partidas validadas y conciliadas como el JSON completo."""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+VALIDO = {"elemento": "Radier", "descripcion": "Radier H20", "cantidad": 20, "unidad": "m2",
+          "precio_unitario": 18500, "subtotal": 1, "apu_origen": "APU Pro C-002"}
+SIN_PRECIO = {"elemento": "Ceramica", "descripcion": "Ceramica piso", "cantidad": 12, "unidad": "m2",
+              "subtotal": 90000, "apu_origen": "APU Pro X-999"}
+
+
+@pytest.fixture
+def truncado(monkeypatch):
+    async def stream_content(model_name, contents, timeout=None, **kwargs):
+        yield '{"items": [' + json.dumps(VALIDO) + ", " + json.dumps(SIN_PRECIO) + ', {"elemento": "Pint'
+        raise TimeoutError("stream cortado")
+
+    monkeypatch.setattr(main.ai_client, "stream_content", stream_content)
+
+
+def _final(respuesta) -> dict:
+    evento = None
+    for linea in respuesta.text.splitlines():
+        if linea.startswith("event: "):
+            evento = linea[7:]
+        elif linea.startswith("data: ") and evento == "final":
+            return json.loads(linea[6:])
+
+
+def test_parcial_valida_y_concilia(truncado):
+    r = TestClient(main.app).post("/analyze_budget/stream", headers={"X-Forwarded-For": "10.8.0.1"},
+                                  json={"instruction": "Calidad: Premium\nradier 20 m2"})
+    final = _final(r)
+    assert final["source"] == "ai_partial"
+    items = final["presupuesto"]["items"]
+    assert [item["elemento"] for item in items] == ["Radier"]
+    assert items[0]["subtotal"] == pytest.approx(items[0]["cantidad"] * items[0]["precio_unitario"], abs=1)
+    assert items[0]["subtotal"] != 1
+    assert final["presupuesto"]["total_final"] > items[0]["subtotal"]
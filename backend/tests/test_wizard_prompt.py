@@ -0,0 +1,24 @@
+"""build_wizard_prompt: pedido de formato segun la salida JSON configurada."""
+import pytest
+
+import main
+from prompts.wizard_prompt import build_wizard_prompt
+
+RESPUESTAS = {"tipo": "Quincho", "dimensiones": "30 m2", "calidad": "Premium", "detalles": "parrilla"}
+
+
+def test_json_mode_pide_el_objeto_sin_bloque():
+    prompt = build_wizard_prompt(RESPUESTAS, json_mode=True)
+    assert "```" not in prompt
+    assert "objeto JSON" in prompt
+
+
+def test_sin_json_mode_pide_el_bloque():
+    assert "```json" in build_wizard_prompt(RESPUESTAS)
+
+
+@pytest.mark.parametrize("json_mode", [True, False])
+def test_prompt_wizard_sigue_la_config(monkeypatch, json_mode):
+    monkeypatch.setattr(main, "BUDGET_JSON_MODE", json_mode)
+    prompt = main._prepare_instruction("Tipo de proyecto: Quincho\nDimensiones: 30 m2\nCalidad: Premium")
+    assert ("```json" in prompt) is not json_mode
@@ -0,0 +1,176 @@
+"""
+Token and cost metering for Vertex AI calls in Arkitecto AI Backend
+Every Gemini / Imagen call (ai_client) reports model, token counts from
+usage_metadata, generated images, latency and outcome, attributed to the
+endpoint and Firebase uid of the request that made it (a context variable
+bound by FirebaseAuthMiddleware once it knows the user).
+
+Counters are aggregated in memory (cheap to read for /metrics/usage) and
+the raw events are flushed in batches to a local SQLite store, the basis
+for capacity planning and for enforcing UserProfile.credits_remaining.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+
+# Reference list prices in USD (per 1M tokens, per image); override with
+# MODEL_PRICES_JSON='{"model": {"input": x, "output": y, "image": z}}'
+MODEL_PRICES = {
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+    "gemini-1.5-flash-001": {"input": 0.075, "output": 0.30},
+    "gemini-pro": {"input": 0.50, "output": 1.50},
+    "imagegeneration@005": {"image": 0.020},
+}
+MODEL_PRICES.update(json.loads(os.getenv("MODEL_PRICES_JSON", "{}")))
+
+_context = contextvars.ContextVar("usage_context", default=("-", None))
+
+
+def bind(endpoint: str, uid: Optional[str]):
+    """Attribute the AI calls made from the current context to endpoint / uid."""
+    _context.set((endpoint, uid))
+
+
+def current() -> tuple:
+    """(endpoint, uid) of the current request; capture it before handing work to a thread."""
+    return _context.get()
+
+
+def estimate_cost(model: str, prompt_tokens: int, response_tokens: int, images: int) -> float:
+    prices = MODEL_PRICES.get(model, {})
+    return (prompt_tokens * prices.get("input", 0) + response_tokens * prices.get("output", 0)) / 1e6 \
+        + images * prices.get("image", 0)
+
+
+class UsageMeter:
+    """
+    Thread-safe meter: record() is called from request coroutines and AI
+    worker threads; flush() (blocking) writes pending events to SQLite.
+    """
+
+    def __init__(self, path: str = None, batch_size: int = 200):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()      # counters and pending events
+        self._db_lock = threading.Lock()   # SQLite connection (writes don't block record())
+        self._pending = []
+        self._totals = defaultdict(lambda: defaultdict(float))   # (endpoint, model, outcome) -> counters
+        self._by_uid = defaultdict(lambda: defaultdict(float))   # uid -> counters
+        self._conn = None
+        self.flushed = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_events ("
+                " ts REAL, endpoint TEXT, uid TEXT, model TEXT, kind TEXT, outcome TEXT,"
+                " latency_ms REAL, prompt_tokens INTEGER, response_tokens INTEGER, images INTEGER,"
+                " cost_usd REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_events_uid_ts ON usage_events (uid, ts)")
+
+    def record(self, context: tuple, model: str, kind: str, outcome: str, latency_ms: float,
+               prompt_tokens: int = 0, response_tokens: int = 0, images: int = 0):
+        endpoint, uid = context
+        cost = estimate_cost(model, prompt_tokens, response_tokens, images)
+        event = (time.time(), endpoint, uid, model, kind, outcome, round(latency_ms, 1),
+                 prompt_tokens, response_tokens, images, cost)
+        full = False
+        with self._lock:
+            for counters in (self._totals[(endpoint, model, outcome)], self._by_uid[uid or "anonymous"]):
+                counters["calls"] += 1
+                counters["prompt_tokens"] += prompt_tokens
+                counters["response_tokens"] += response_tokens
+                counters["images"] += images
+                counters["latency_ms"] += latency_ms
+                counters["cost_usd"] += cost
+            if self._conn is not None:
+                self._pending.append(event)
+                full = len(self._pending) >= self.batch_size
+        if self._conn is not None and full:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def flush(self) -> int:
+        """Write pending events to SQLite in one transaction; returns how many."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch or self._conn is None:
+            return 0
+        with self._db_lock:
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT INTO usage_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                self._conn.execute("COMMIT")
+                self.flushed += len(batch)
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                with self._lock:
+                    self._pending[:0] = batch   # retried on the next flush
+                raise
+        return len(batch)
+
+    @staticmethod
+    def _summary(counters: dict) -> dict:
+        calls = counters["calls"]
+        return {
+            "calls": int(calls),
+            "prompt_tokens": int(counters["prompt_tokens"]),
+            "response_tokens": int(counters["response_tokens"]),
+            "images": int(counters["images"]),
+            "avg_latency_ms": round(counters["latency_ms"] / calls, 1) if calls else 0.0,
+            "cost_usd": round(counters["cost_usd"], 6),
+        }
+
+    def snapshot(self) -> list:
+        """In-memory totals of this process by endpoint / model / outcome."""
+        with self._lock:
+            rows = [(key, dict(counters)) for key, counters in self._totals.items()]
+        return [
+            {"endpoint": endpoint, "model": model, "outcome": outcome, **self._summary(counters)}
+            for (endpoint, model, outcome), counters in sorted(rows)
+        ]
+
+    def for_uid(self, uid: str) -> dict:
+        """In-memory totals of this process for one uid."""
+        with self._lock:
+            counters = dict(self._by_uid.get(uid, {}))
+        return self._summary(defaultdict(float, counters))
+
+    def stored(self, uid: str = None, since_hours: float = 24) -> list:
+        """Persisted totals (all workers that share the file) by endpoint / model over a window."""
+        if self._conn is None:
+            return []
+        query = (
+            "SELECT endpoint, model, COUNT(*), SUM(prompt_tokens), SUM(response_tokens), SUM(images),"
+            " AVG(latency_ms), SUM(cost_usd), SUM(outcome = 'ok') FROM usage_events WHERE ts >= ?"
+        )
+        params = [time.time() - since_hours * 3600]
+        if uid is not None:
+            query += " AND uid = ?"
+            params.append(uid)
+        query += " GROUP BY endpoint, model ORDER BY endpoint, model"
+        with self._db_lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {
+                "endpoint": endpoint, "model": model, "calls": calls,
+                "prompt_tokens": prompt or 0, "response_tokens": response or 0, "images": images or 0,
+                "avg_latency_ms": round(latency or 0, 1), "cost_usd": round(cost or 0, 6), "ok": ok or 0,
+            }
+            for endpoint, model, calls, prompt, response, images, latency, cost, ok in rows
+        ]
+
+
+# Process-wide meter; USAGE_DB_PATH empty keeps counters in memory only
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.sqlite3")
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+
+meter = UsageMeter(USAGE_DB_PATH or None)